@@ -1,17 +1,47 @@
+from collections.abc import Callable
 import logging
+from pathlib import Path
+from typing import Any, Protocol
 
 from pymodbus.client import ModbusSerialClient, ModbusTcpClient
 from rich.pretty import pprint
 
+from kronoterm2mqtt.constants import REPLAY_PORT_PREFIX, SIMULATE_PORT_PREFIX
+from kronoterm2mqtt.register_blocks import BusCost
 from kronoterm2mqtt.user_settings import HeatPump
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_modbus_client(heat_pump: HeatPump, definitions: dict, verbosity: int) -> ModbusSerialClient | ModbusTcpClient:
+class ModbusClient(Protocol):
+    """
+    A pymodbus client or a stand-in for it: RecordingClient, ReplayModbusClient
+    or SimulatedModbusClient. The methods are attributes, because pymodbus takes
+    the address positionally and the stand-ins take keyword arguments only.
+    """
+
+    read_holding_registers: Callable[..., Any]
+    write_register: Callable[..., Any]
+
+    def close(self) -> None: ...
+
+
+def get_modbus_client(heat_pump: HeatPump, definitions: dict, verbosity: int) -> ModbusClient:
     print(f'Connect to {heat_pump.port}...')
 
+    if heat_pump.port.startswith(REPLAY_PORT_PREFIX):  # Serve a recording instead of a heat pump
+        from kronoterm2mqtt.recording import ReplayModbusClient
+
+        file_path = Path(heat_pump.port.removeprefix(REPLAY_PORT_PREFIX)).expanduser()
+        return ReplayModbusClient(file_path, speed=heat_pump.replay_speed)
+
+    if heat_pump.port.startswith(SIMULATE_PORT_PREFIX):  # Simulate the heat pump, e.g. "simulate:sine"
+        from kronoterm2mqtt.simulator import HeatPumpSimulator, SimulatedModbusClient
+
+        generator = heat_pump.port.removeprefix(SIMULATE_PORT_PREFIX) or 'random-walk'
+        return SimulatedModbusClient(HeatPumpSimulator(definitions, generator=generator, seed=0))
+
     if heat_pump.port[0] == '/':  # Serial client starting with /dev
         conn_settings = definitions['connection']
 
@@ -37,4 +67,16 @@ def get_modbus_client(heat_pump: HeatPump, definitions: dict, verbosity: int) ->
         print('connected:', client.connect())
         print(client)
 
+    if heat_pump.record_file:
+        from kronoterm2mqtt.recording import RecordingClient
+
+        client = RecordingClient(client, Path(heat_pump.record_file).expanduser())
+
     return client
+
+
+def get_bus_cost(heat_pump: HeatPump, definitions: dict) -> BusCost:
+    """Cost model of Modbus reads used to plan the register blocks"""
+    if heat_pump.port[0] == '/':  # Serial client starting with /dev
+        return BusCost.for_serial(definitions['connection'])
+    return BusCost.for_tcp()
@@ -0,0 +1,274 @@
+"""
+Benchmarks of the dev CLI commands "benchmark-decode" and "benchmark-cycles".
+
+The dev CLI installs the typeguard import hook, whose runtime type checks
+would dominate the timings. So the commands run these benchmarks in a fresh
+interpreter via: python -m kronoterm2mqtt.benchmarks <name> <JSON arguments>
+The JSON result is printed as the last line.
+"""
+
+import asyncio
+import collections
+import dataclasses
+from decimal import Decimal
+import json
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
+from ha_services.mqtt4homeassistant.components.select import Select
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.components.switch import Switch
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
+from ha_services.mqtt4homeassistant.mocks.mqtt_client_mock import MqttClientMock
+from ha_services.mqtt4homeassistant.utilities.string_utils import slugify
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
+
+from kronoterm2mqtt.constants import SIMULATE_PORT_PREFIX
+from kronoterm2mqtt.decode_plan import DecodePlan
+from kronoterm2mqtt.mqtt_handler import KronotermMqttHandler
+from kronoterm2mqtt.register_blocks import IllegalRegisters
+from kronoterm2mqtt.timing import RunningStats
+from kronoterm2mqtt.user_settings import HeatPump, UserSettings
+
+
+class LegacyDecode:
+    """
+    The per-cycle decoding as done before the decode plan: Decimal math
+    for every sensor and linear scans over the options keys.
+    Yields (component, state) just like DecodePlan.decode()
+    """
+
+    def __init__(self):
+        self.sensors = dict()
+        self.binary_sensors = dict()
+        self.enum_sensors = dict()
+        self.switches = dict()
+        self.selects = dict()
+
+    def decode(self, registers: dict):
+        for address in self.sensors:
+            sensor, scale = self.sensors[address]
+            yield sensor, float(scale * Decimal(registers[address]))
+        for address in self.binary_sensors:
+            for bit, sensor in self.binary_sensors[address].items():
+                value = registers[address]
+                if bit is not None:
+                    value &= 1 << bit
+                yield sensor, sensor.ON if value else sensor.OFF
+        for address in self.enum_sensors:
+            sensor, options = self.enum_sensors[address]
+            value = registers[address]
+            for index, key in enumerate(options['keys']):
+                if value == key:
+                    yield sensor, options['values'][index]
+                    break
+        for address, switch in self.switches.items():
+            yield switch, switch.ON if registers[address] else switch.OFF
+        for address, (select, options) in self.selects.items():
+            for index, key in enumerate(options['keys']):
+                if registers[address] == key:
+                    yield select, options['values'][index]
+                    break
+
+
+def build_decoders(definitions: dict) -> tuple[LegacyDecode, DecodePlan, dict]:
+    """Create components from the definitions and random register values for them"""
+    device = MqttDevice(name='Benchmark', uid='benchmark')
+    legacy = LegacyDecode()
+    plan = DecodePlan()
+    registers = dict()
+
+    def create(component_class, parameter, **kwargs):
+        address = parameter['register'] - 1
+        uid = f'{slugify(parameter["name"], "_").lower()}_{len(device.components)}'
+        return address, component_class(device=device, name=parameter['name'], uid=uid, **kwargs)
+
+    for parameter in definitions['sensor']:
+        address, sensor = create(Sensor, parameter)
+        scale = Decimal(str(parameter['scale']))
+        legacy.sensors[address] = (sensor, scale)
+        plan.add_sensor(address, sensor, scale)
+        registers[address] = random.randrange(0, 1000)
+    for parameter in definitions['binary_sensor']:
+        address, sensor = create(BinarySensor, parameter)
+        legacy.binary_sensors.setdefault(address, {})[parameter.get('bit')] = sensor
+        plan.add_binary_sensor(address, sensor, parameter.get('bit'))
+        registers[address] = random.randrange(0, 0x10000)
+    for parameter in definitions['enum_sensor']:
+        address, sensor = create(Sensor, parameter)
+        options = parameter['options'][0]
+        legacy.enum_sensors[address] = (sensor, options)
+        plan.add_options(address, sensor, options)
+        registers[address] = random.choice(options['keys'][: len(options['values'])])
+    for parameter in definitions.get('switch', ()):
+        address, switch = create(Switch, parameter, callback=lambda **kwargs: None)
+        legacy.switches[address] = switch
+        plan.add_switch(address, switch)
+        registers[address] = random.randrange(0, 2)
+    for parameter in definitions.get('select', ()):
+        options = parameter['options'][0]
+        address, select = create(
+            Select,
+            parameter,
+            default_option=parameter['default_option'],
+            options=tuple(options['values']),
+            callback=lambda **kwargs: None,
+        )
+        legacy.selects[address] = (select, options)
+        plan.add_options(address, select, options)
+        registers[address] = random.choice(options['keys'][: len(options['values'])])
+
+    return legacy, plan, registers
+
+
+def benchmark_decode(definitions_name: str, cycles: int) -> dict:
+    """Per-cycle decode time in µs of the register values before and after the decode plan"""
+    definitions = HeatPump(definitions_name=definitions_name).get_definitions(verbosity=0)
+    legacy, plan, registers = build_decoders(definitions)
+
+    decoders = (
+        ('Decimal and linear scans', lambda: collections.deque(legacy.decode(registers), maxlen=0)),
+        ('Decode plan', lambda: collections.deque(plan.decode(registers, registers), maxlen=0)),
+    )
+    results = dict()
+    for name, decode in decoders:
+        seconds = min(timeit.repeat(decode, number=cycles, repeat=5))
+        results[name] = seconds / cycles * 1_000_000
+    return dict(registers=len(registers), results=results)
+
+
+class BenchmarkMqttClient(MqttClientMock):
+    """Counts the published messages and their bytes instead of sending them to a broker"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = 0
+        self.published_bytes = 0
+
+    def publish(self, *, topic: str, payload=None, **kwargs) -> MQTTMessageInfo:
+        self.published += 1
+        self.published_bytes += len(topic.encode()) + len(str(payload).encode())
+        return MQTTMessageInfo(self.published)
+
+    def subscribe(self, *args, **kwargs):
+        return MQTT_ERR_SUCCESS, self.published
+
+    def message_callback_add(self, *args, **kwargs):
+        pass
+
+    def loop_start(self, *args, **kwargs):
+        pass
+
+    def loop_stop(self, *args, **kwargs):
+        pass
+
+    def disconnect(self, *args, **kwargs):
+        pass
+
+
+@dataclasses.dataclass
+class CycleResult:
+    """Mean values per publish cycle of one definitions file"""
+
+    read_ms: float = 0.0
+    decode_ms: float = 0.0
+    publish_ms: float = 0.0
+    expander_ms: float = 0.0
+    cycle_ms: float = 0.0
+    messages: float = 0.0
+    message_bytes: float = 0.0  # Topics and payloads of the messages
+    peak_kib: float = 0.0  # Memory allocated above the level before the cycle
+    retained_bytes: float = 0.0  # Memory still allocated after the cycle, e.g. leaks
+
+
+async def run_cycles(handler: KronotermMqttHandler, cycles: int, trace_memory: bool) -> dict[str, RunningStats]:
+    """
+    Run the stages of publish cycles of the first heat pump back to back.
+    Every cycle reads all poll tiers, like the first cycle after the start.
+    """
+    heat_pump_handler = handler.heat_pump_handlers[0]
+    mqtt_client = handler.mqtt_client
+    stats = collections.defaultdict(RunningStats)
+    for _ in range(cycles):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            memory_before, _ = tracemalloc.get_traced_memory()
+        published = mqtt_client.published
+        published_bytes = mqtt_client.published_bytes
+        start = time.perf_counter()
+        refreshed = await heat_pump_handler.read_heat_pump_register_blocks(list(heat_pump_handler.address_ranges))
+        read_end = time.perf_counter()
+        states = heat_pump_handler.decode_states(refreshed)
+        decode_end = time.perf_counter()
+        heat_pump_handler.publish_states(states)
+        publish_end = time.perf_counter()
+        await handler.update_expander(heat_pump_handler.registers)
+        end = time.perf_counter()
+        if trace_memory:
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            stats['peak'].add(memory_peak - memory_before)
+            stats['retained'].add(memory_after - memory_before)
+        else:
+            stats['read'].add(read_end - start)
+            stats['decode'].add(decode_end - read_end)
+            stats['publish'].add(publish_end - decode_end)
+            stats['expander'].add(end - publish_end)
+            stats['cycle'].add(end - start)
+            stats['messages'].add(mqtt_client.published - published)
+            stats['bytes'].add(mqtt_client.published_bytes - published_bytes)
+    return stats
+
+
+async def benchmark_definitions(definitions_name: str, cycles: int, json_state: bool = False) -> CycleResult:
+    """Publish cycles of a heat pump simulated from the definitions to a fake MQTT client"""
+    user_settings = UserSettings()
+    user_settings.heat_pump.definitions_name = definitions_name
+    user_settings.heat_pump.json_state = json_state
+    user_settings.heat_pump.port = f'{SIMULATE_PORT_PREFIX}random-walk'
+    # The expander needs its hardware: It stays disabled, so its stage measures only that check.
+    with KronotermMqttHandler(user_settings, verbosity=0, mqtt_client=BenchmarkMqttClient()) as handler:
+        await handler.init_devices()
+        for heat_pump_handler in handler.heat_pump_handlers:
+            # Independent of the illegal registers learned from the user's heat pump:
+            heat_pump_handler.illegal_registers = IllegalRegisters()
+            heat_pump_handler.plan_address_ranges()
+        for component in BaseMqttDevice.components.values():
+            component.throttle_sec = 0  # The publish loop runs much slower than the state throttling
+        await run_cycles(handler, cycles=1, trace_memory=False)  # Publishes all states once
+        stats = await run_cycles(handler, cycles, trace_memory=False)
+        tracemalloc.start()
+        try:
+            memory_stats = await run_cycles(handler, cycles, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+    return CycleResult(
+        read_ms=stats['read'].mean * 1000,
+        decode_ms=stats['decode'].mean * 1000,
+        publish_ms=stats['publish'].mean * 1000,
+        expander_ms=stats['expander'].mean * 1000,
+        cycle_ms=stats['cycle'].mean * 1000,
+        messages=stats['messages'].mean,
+        message_bytes=stats['bytes'].mean,
+        peak_kib=memory_stats['peak'].mean / 1024,
+        retained_bytes=memory_stats['retained'].mean,
+    )
+
+
+def benchmark_cycles(definitions_name: str, cycles: int, json_state: bool) -> dict:
+    result = asyncio.run(benchmark_definitions(definitions_name, cycles, json_state=json_state))
+    return dataclasses.asdict(result)
+
+
+BENCHMARKS = {
+    'decode': benchmark_decode,
+    'cycles': benchmark_cycles,
+}
+
+
+if __name__ == '__main__':
+    name, arguments = sys.argv[1:]
+    print(json.dumps(BENCHMARKS[name](**json.loads(arguments))))
@@ -1,83 +1,108 @@
 from decimal import Decimal
 import logging
+from pathlib import Path
+import time
 
 from cli_base.cli_tools.verbosity import setup_logging
 from cli_base.tyro_commands import TyroVerbosityArgType
-from pymodbus.exceptions import ModbusIOException
-from pymodbus.pdu import ExceptionResponse
-from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 from rich import (
     print,
 )
 from rich.pretty import pprint
 
-from kronoterm2mqtt.api import get_modbus_client
+from kronoterm2mqtt.api import ModbusClient, get_bus_cost, get_modbus_client
 from kronoterm2mqtt.cli_app import app
-from kronoterm2mqtt.constants import MODBUS_SLAVE_ID
-
-# from kronoterm2mqtt.probe_usb_ports import print_parameter_values, probe_one_port
+from kronoterm2mqtt.constants import DEFINITION_SECTIONS
+from kronoterm2mqtt.port_probe import get_bundled_definitions, get_probe_candidates, probe_ports
+from kronoterm2mqtt.register_blocks import IllegalRegisters, plan_register_blocks, read_register_block_bisecting
+from kronoterm2mqtt.register_scanner import RegisterScan
+from kronoterm2mqtt.register_snapshot import RegisterSnapshot
 from kronoterm2mqtt.user_settings import HeatPump, get_user_settings
 
 
 logger = logging.getLogger(__name__)
 
 
-def probe_one_port(heat_pump, definitions, verbosity):
-    client = get_modbus_client(heat_pump, definitions, verbosity)
-
-    parameters = definitions['sensor']
-    if verbosity > 1:
-        pprint(parameters)
-
-    print_parameter_values(client, parameters, verbosity)
+def read_definition_registers(
+    client: ModbusClient,
+    heat_pump: HeatPump,
+    definitions: dict,
+    sections: tuple[str, ...] = DEFINITION_SECTIONS,
+) -> RegisterSnapshot:
+    """
+    Read the registers of all entities of the definitions sections at once, in the
+    blocks planned just like in the publish loop, skipping the illegal
+    registers learned there.
+    """
+    addresses = {
+        parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
+        for section in sections
+        for parameter in definitions.get(section, ())
+    }
+    illegal_registers = IllegalRegisters(heat_pump.get_illegal_registers_path())
+    blocks = plan_register_blocks(addresses, get_bus_cost(heat_pump, definitions), excluded=illegal_registers)
+    registers = RegisterSnapshot(min(addresses), max(addresses))
+
+    def read(address: int, count: int):
+        return client.read_holding_registers(address=address, count=count, device_id=heat_pump.slave_id)
+
+    start = time.monotonic()
+    learned = []
+    for first, last in blocks:
+        read_blocks, illegal = read_register_block_bisecting(read, first, last)
+        for address, values in read_blocks:
+            registers.update_block(address, values)
+        learned += illegal
+    print(f'Read {len(addresses)} registers in {len(blocks)} blocks in {time.monotonic() - start:.1f} s')
+    if learned:
+        logger.warning(f'{heat_pump.device_name} refused to read registers {learned}')
+    return registers
 
 
 @app.command
-# @Click.option('--max-port', default=10, help='Maximum USB port number')
-# @click.option('--port-template', default='/dev/ttyUSB{i}', help='USB device path template')
 def probe_usb_ports(verbosity: TyroVerbosityArgType, max_port: int = 10, port_template: str = '/dev/ttyUSB{i}'):
     """
-    Probe through the USB ports and print the values from definition
+    Probe all USB ports at once for a heat pump, its serial settings and definitions
     """
     setup_logging(verbosity=verbosity)
 
-    systemd_settings = get_user_settings(verbosity)
-    heat_pump: HeatPump = systemd_settings.heat_pump
-    definitions = heat_pump.get_definitions(verbosity)
-
-    for port_number in range(max_port):
-        port = port_template.format(i=port_number)
-        print(f'Probe port: {port}...')
+    user_settings = get_user_settings(verbosity)
+    heat_pump: HeatPump = user_settings.heat_pump
 
-        heat_pump.port = port
-        try:
-            probe_one_port(heat_pump, definitions, verbosity)
-        except Exception as err:   # noqa: BLE001
-            print(f'ERROR: {err}')
+    ports = [port_template.format(i=port_number) for port_number in range(max_port)]
+    ports = [port for port in ports if Path(port).exists()]
+    if not ports:
+        print(f'[red]No port {port_template!r} found')
+        return
+
+    candidates = get_probe_candidates(get_bundled_definitions())
+    print(f'Probe {len(ports)} ports with {len(candidates)} serial settings...')
+    start = time.monotonic()
+    results = probe_ports(ports, candidates, slave_id=heat_pump.slave_id)
+    print(f'Probed in {time.monotonic() - start:.1f} s:')
+    for result in results:
+        if result.definitions_name:
+            print(f'[green]{result}')
+        else:
+            print(f'[dim]{result}')
 
 
-def print_parameter_values(client, parameters, verbosity):
+def print_parameter_values(registers: RegisterSnapshot, parameters: list, verbosity: int):
     for parameter in parameters:
         print(f'{parameter["name"]:>50}', end=' ')
         address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
         if verbosity:
             print(f'(Register dec: {address:02} hex: {address:04x})', end=' ')
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        if address not in registers:
+            print('[red]Error:[/red] not readable')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            value = response.registers[0]
-            # if count > 1:
-            #    value += response.registers[1] * 65536
-
             scale = Decimal(str(parameter['scale']))
-            value = (value - (value >> 15 << 16)) * scale  # Convert value to signed integer
+            value = registers[address] * scale  # The snapshot holds signed values
             print(f'{value} [blue]{parameter.get("unit_of_measurement", "")}')
     print('\n')
 
 
-def print_binary_sensor_values(client, parameters, verbosity):
+def print_binary_sensor_values(registers: RegisterSnapshot, parameters: list, verbosity: int):
     for parameter in parameters:
         print(f'{parameter["name"]:>50}', end=' ')
         address = parameter['register'] - 1
@@ -85,12 +110,10 @@ def print_binary_sensor_values(client, parameters, verbosity):
         if verbosity:
             bit_info = f' bit:{bit}' if bit is not None else ''
             print(f'(Register dec: {address:02} hex: {address:04x}{bit_info})', end=' ')
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        if address not in registers:
+            print('[red]Error:[/red] not readable')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            raw_value = response.registers[0]
+            raw_value = registers[address] & 0xFFFF
             if bit is not None:
                 value = bool(raw_value & (1 << bit))
             else:
@@ -100,18 +123,16 @@ def print_binary_sensor_values(client, parameters, verbosity):
     print('\n')
 
 
-def print_enum_sensor_values(client, parameters, verbosity):
+def print_enum_sensor_values(registers: RegisterSnapshot, parameters: list, verbosity: int):
     for parameter in parameters:
         print(f'{parameter["name"]:>50}', end=' ')
         address = parameter['register'] - 1
         if verbosity:
             print(f'(Register dec: {address:02} hex: {address:04x})', end=' ')
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        if address not in registers:
+            print('[red]Error:[/red] not readable')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            raw_value = response.registers[0]
+            raw_value = registers[address] & 0xFFFF
             options = parameter['options'][0] if isinstance(parameter['options'], list) else parameter['options']
             display_value = None
             for index, key in enumerate(options['keys']):
@@ -125,35 +146,31 @@ def print_enum_sensor_values(client, parameters, verbosity):
     print('\n')
 
 
-def print_switch_values(client, parameters, verbosity):
+def print_switch_values(registers: RegisterSnapshot, parameters: list, verbosity: int):
     for parameter in parameters:
         print(f'{parameter["name"]:>50}', end=' ')
         address = parameter['register'] - 1
         if verbosity:
             print(f'(Register dec: {address:02} hex: {address:04x})', end=' ')
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        if address not in registers:
+            print('[red]Error:[/red] not readable')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            raw_value = response.registers[0]
+            raw_value = registers[address] & 0xFFFF
             state = '[green]ON[/green]' if raw_value else '[red]OFF[/red]'
             print(f'{state} [dim](raw: {raw_value})[/dim]')
     print('\n')
 
 
-def print_select_values(client, parameters, verbosity):
+def print_select_values(registers: RegisterSnapshot, parameters: list, verbosity: int):
     for parameter in parameters:
         print(f'{parameter["name"]:>50}', end=' ')
         address = parameter['register'] - 1
         if verbosity:
             print(f'(Register dec: {address:02} hex: {address:04x})', end=' ')
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
+        if address not in registers:
+            print('[red]Error:[/red] not readable')
         else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            raw_value = response.registers[0]
+            raw_value = registers[address] & 0xFFFF
             options = parameter['options'][0] if isinstance(parameter['options'], list) else parameter['options']
             display_value = None
             for index, key in enumerate(options['keys']):
@@ -179,34 +196,41 @@ def print_values(verbosity: TyroVerbosityArgType):
     definitions = heat_pump.get_definitions(verbosity)
 
     client = get_modbus_client(heat_pump, definitions, verbosity)
+    registers = read_definition_registers(client, heat_pump, definitions)
 
     print('[bold]--- Sensors ---[/bold]')
     parameters = definitions['sensor']
     if verbosity > 1:
         pprint(parameters)
-    print_parameter_values(client, parameters, verbosity)
+    print_parameter_values(registers, parameters, verbosity)
 
     if 'binary_sensor' in definitions:
         print('[bold]--- Binary Sensors ---[/bold]')
-        print_binary_sensor_values(client, definitions['binary_sensor'], verbosity)
+        print_binary_sensor_values(registers, definitions['binary_sensor'], verbosity)
 
     if 'enum_sensor' in definitions:
         print('[bold]--- Enum Sensors ---[/bold]')
-        print_enum_sensor_values(client, definitions['enum_sensor'], verbosity)
+        print_enum_sensor_values(registers, definitions['enum_sensor'], verbosity)
 
     if 'switch' in definitions:
         print('[bold]--- Switches ---[/bold]')
-        print_switch_values(client, definitions['switch'], verbosity)
+        print_switch_values(registers, definitions['switch'], verbosity)
 
     if 'select' in definitions:
         print('[bold]--- Selects ---[/bold]')
-        print_select_values(client, definitions['select'], verbosity)
+        print_select_values(registers, definitions['select'], verbosity)
 
 
 @app.command
-def print_registers(verbosity: TyroVerbosityArgType):
+def print_registers(verbosity: TyroVerbosityArgType, first: int = 2000, last: int = 3030, output: str = ''):
     """
     Print RAW modbus register data
+
+    Args:
+        first: First (zero-based) register address to scan
+        last: Last register address to scan
+        output: Save the scan to this .csv or .json file. An existing file is continued,
+            only the addresses missing in it are scanned.
     """
     setup_logging(verbosity=verbosity)
 
@@ -216,25 +240,33 @@ def print_registers(verbosity: TyroVerbosityArgType):
 
     client = get_modbus_client(heat_pump, definitions, verbosity)
 
-    parameters = definitions['sensor']
-    if verbosity > 1:
-        pprint(parameters)
-
-    error_count = 0
-    address = 2000
-    while error_count < 5:
-        print(f'[blue]Read register[/blue] dec: {address:02} hex: {address:04x} ->', end=' ')
-
-        response = client.read_holding_registers(address=address, count=1, device_id=MODBUS_SLAVE_ID)
-        if isinstance(response, (ExceptionResponse, ModbusIOException)):
-            print('Error:', response)
-            error_count += 1
-        else:
-            assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-            for value in response.registers:
-                print(f'[green]Result[/green]: dec:{value:05} hex:{value:08x}', end=' ')
-            print()
-
-        address += 1
-        if address > 3030:
-            break
+    def read(address: int, count: int):
+        response = client.read_holding_registers(address=address, count=count, device_id=heat_pump.slave_id)
+        if verbosity:
+            print(f'[blue]Read registers[/blue] {address}-{address + count - 1} ->', response)
+        return response
+
+    output_path = Path(output).expanduser() if output else None
+    if output_path and output_path.is_file():
+        scan = RegisterScan.load(output_path)
+    else:
+        scan = RegisterScan()
+    save_progress = (lambda scan: scan.save(output_path)) if output_path else None
+    scan.scan(read, first, last, on_block=save_progress)
+
+    for address, value in sorted(scan.values.items()):
+        if first <= address <= last:
+            print(
+                f'[blue]Register[/blue] dec: {address:02} hex: {address:04x} ->'
+                f' [green]Result[/green]: dec:{value:05} hex:{value:08x}'
+            )
+    illegal = sorted(address for address in scan.illegal if first <= address <= last)
+    unknown = sum(block_last - block_first + 1 for block_first, block_last in scan.get_unknown_blocks(first, last))
+    print(
+        f'{len(scan.values)} readable registers, {len(illegal)} illegal addresses,'
+        f' {unknown} failed addresses in {scan.requests} requests'
+    )
+    if verbosity:
+        print(f'Illegal addresses: {illegal}')
+    if output_path:
+        print(f'Scan saved to {output_path}')
@@ -1,12 +1,9 @@
 import asyncio
-from asyncio.exceptions import CancelledError
 import logging
 import sys
-import time
 
 from cli_base.cli_tools.verbosity import setup_logging
 from cli_base.tyro_commands import TyroVerbosityArgType
-from ha_services.exceptions import InvalidStateValue
 from rich import print
 
 from kronoterm2mqtt.cli_app import app
@@ -41,18 +38,14 @@ def publish_loop(verbosity: TyroVerbosityArgType):
     setup_logging(verbosity=verbosity)
     user_settings: UserSettings = get_user_settings(verbosity=verbosity)
 
-    while True:
-        try:
-            print('[green]Starting Kronoterm 2 MQTT[/green]')
-            with KronotermMqttHandler(user_settings=user_settings, verbosity=verbosity) as mqtt_handler:
-                asyncio.run(mqtt_handler.publish_loop())
-        except KeyboardInterrupt:
-            raise
-        except (InvalidStateValue, CancelledError) as e:
-            logger.error(f'Kronoterm2MQTT loop failed. USB problem? {e}. Restating in 5 seconds ...')
-            time.sleep(5)
-        except Exception as e:
-            print(f'Error: {e}', type(e), file=sys.stderr)
-            logger.exception('Unhandled Exception in publish loop')
-            sys.exit(1)
-
+    # The Modbus links, the MQTT link and the expander UART restart on their own after a failure:
+    try:
+        print('[green]Starting Kronoterm 2 MQTT[/green]')
+        with KronotermMqttHandler(user_settings=user_settings, verbosity=verbosity) as mqtt_handler:
+            asyncio.run(mqtt_handler.publish_loop())
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        print(f'Error: {e}', type(e), file=sys.stderr)
+        logger.exception('Unhandled Exception in publish loop')
+        sys.exit(1)
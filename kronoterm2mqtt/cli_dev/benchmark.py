@@ -0,0 +1,108 @@
+import dataclasses
+import datetime
+import json
+from pathlib import Path
+import platform
+import subprocess
+import sys
+
+from cli_base.tyro_commands import TyroVerbosityArgType
+from rich import print
+from rich.table import Table
+
+import kronoterm2mqtt
+from kronoterm2mqtt.benchmarks import CycleResult
+from kronoterm2mqtt.cli_dev import PACKAGE_ROOT, app
+from kronoterm2mqtt.constants import BASE_PATH
+from kronoterm2mqtt.user_settings import UserSettings, get_user_settings
+
+
+REGRESSION_THRESHOLD = 1.2  # Results 20% worse than the last stored run are highlighted
+
+
+def run_benchmark(name: str, **arguments):
+    """
+    Run a benchmark of kronoterm2mqtt.benchmarks in a fresh interpreter,
+    without the typeguard import hook of this CLI, and return its result.
+    """
+    process = subprocess.run(
+        [sys.executable, '-m', 'kronoterm2mqtt.benchmarks', name, json.dumps(arguments)],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+@app.command
+def benchmark_decode(verbosity: TyroVerbosityArgType, cycles: int = 10_000):
+    """
+    Compare the per-cycle decode time of the register values before and after the decode plan
+    """
+    user_settings: UserSettings = get_user_settings(verbosity=verbosity)
+    definitions_name = user_settings.heat_pump.definitions_name
+    benchmark = run_benchmark('decode', definitions_name=definitions_name, cycles=cycles)
+    print(f'Decode {benchmark["registers"]} registers of {definitions_name!r}, {cycles} cycles:')
+    for name, microseconds in benchmark['results'].items():
+        print(f'{name:>25}: {microseconds:.1f} µs per cycle')
+    print('(Without setting the states of the components, which costs the same in both cases)')
+
+
+def load_last_results(results_path: Path) -> dict[str, dict]:
+    """Results of the last stored run by definitions name"""
+    if not results_path.is_file():
+        return {}
+    lines = results_path.read_text(encoding='UTF-8').splitlines()
+    return json.loads(lines[-1])['results'] if lines else {}
+
+
+@app.command
+def benchmark_cycles(verbosity: TyroVerbosityArgType, cycles: int = 200, results_file: str = ''):
+    """
+    Benchmark the publish cycle stages of all definitions against a simulated heat pump
+
+    Args:
+        cycles: Measured publish cycles per definitions file
+        results_file: Compare with the last results in this file and append the new ones,
+            default: .benchmarks/publish_cycles.jsonl
+    """
+    results_path = Path(results_file) if results_file else PACKAGE_ROOT / '.benchmarks' / 'publish_cycles.jsonl'
+    last_results = load_last_results(results_path)
+    results = dict()
+    for definitions_path in sorted((BASE_PATH / 'definitions').glob('*.toml')):
+        definitions_name = definitions_path.stem
+        for json_state in (False, True):
+            name = f'{definitions_name} (JSON state)' if json_state else definitions_name
+            print(f'Benchmark {cycles} publish cycles of {name!r}...')
+            results[name] = run_benchmark(
+                'cycles', definitions_name=definitions_name, cycles=cycles, json_state=json_state
+            )
+
+    table = Table(title='Mean per publish cycle (change to the last stored run)')
+    table.add_column('Definitions')
+    for field in dataclasses.fields(CycleResult):
+        table.add_column(field.name, justify='right')
+    for definitions_name, result in results.items():
+        last_result = last_results.get(definitions_name, {})
+        cells = []
+        for name, value in result.items():
+            cell = f'{value:.2f}'
+            if (last_value := last_result.get(name, 0)) > 0:
+                change = value / last_value
+                color = 'red' if change > REGRESSION_THRESHOLD else 'green' if change < 1 / REGRESSION_THRESHOLD else ''
+                cell += f' [{color}]({change - 1:+.0%})[/{color}]' if color else f' ({change - 1:+.0%})'
+            cells.append(cell)
+        table.add_row(definitions_name, *cells)
+    print(table)
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    record = dict(
+        timestamp=datetime.datetime.now(tz=datetime.UTC).isoformat(timespec='seconds'),
+        version=kronoterm2mqtt.__version__,
+        python=platform.python_version(),
+        cycles=cycles,
+        results=results,
+    )
+    with results_path.open('a', encoding='UTF-8') as file:
+        file.write(json.dumps(record) + '\n')
+    print(f'Results appended to {results_path}')
@@ -0,0 +1,54 @@
+import asyncio
+import contextlib
+
+from cli_base.cli_tools.verbosity import setup_logging
+from cli_base.tyro_commands import TyroVerbosityArgType
+
+from kronoterm2mqtt.cli_dev import app
+from kronoterm2mqtt.constants import MODBUS_SLAVE_ID
+from kronoterm2mqtt.simulator import HeatPumpSimulator, serve_simulator
+from kronoterm2mqtt.user_settings import HeatPump
+
+
+@app.command
+def simulate(
+    verbosity: TyroVerbosityArgType,
+    definitions_name: str = 'kronoterm_ksm',
+    port: str = 'pty',
+    slave_id: int = MODBUS_SLAVE_ID,
+    generator: str = 'random-walk',
+    latency: float = 0.0,
+    baudrate: int = 0,
+    exception_rate: float = 0.0,
+    illegal_registers: tuple[int, ...] = (),
+    seed: int | None = None,
+):
+    """
+    Simulate a heat pump with the registers of the definitions for tests and benchmarks
+
+    Args:
+        port: "pty" serves Modbus RTU on a virtual serial line, "host:port" serves Modbus TCP
+        generator: How read-only registers change: "constant", "random-walk" or "sine"
+        latency: Delay of every request in seconds
+        baudrate: Delay requests by the transfer time at this baud rate, 0: no delay
+        exception_rate: Share of requests failing with "device busy"
+        illegal_registers: Zero-based addresses failing with "illegal address"
+        seed: Seed of the random values, for reproducible runs
+    """
+    setup_logging(verbosity=verbosity)
+    definitions = HeatPump(definitions_name=definitions_name).get_definitions(verbosity)
+    simulator = HeatPumpSimulator(
+        definitions,
+        generator=generator,
+        latency=latency,
+        baudrate=baudrate,
+        exception_rate=exception_rate,
+        illegal_registers=illegal_registers,
+        seed=seed,
+    )
+    print(
+        f'Simulate {len(simulator.values)} registers of {definitions_name!r}'
+        f' ({simulator.first_address}-{simulator.last_address}), stop with Ctrl-C'
+    )
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve_simulator(simulator, slave_id=slave_id, port=port, connection=definitions['connection']))
@@ -9,7 +9,32 @@ BASE_PATH = Path(__file__).parent
 DEFAULT_DEVICE_MANUFACTURER = 'KRONOTERM'
 
 MODBUS_SLAVE_ID = 20  # Kronoterm System Module Modbus address
+MODBUS_MAX_READ_REGISTERS = 125  # Modbus limit for "read holding registers" (function code 3)
+MODBUS_TRANSACTION_SECONDS = 0.03  # Estimated request, turnaround and framing overhead of one Modbus TCP transaction
+MODBUS_TURNAROUND_SECONDS = 0.02  # Estimated time the heat pump needs to start a response on the serial line
+MODBUS_RTU_READ_REQUEST_BYTES = 8  # slave id, function code, address, count and CRC
+MODBUS_RTU_READ_RESPONSE_BYTES = 5  # slave id, function code, byte count and CRC, without the registers
+MODBUS_RTU_WRITE_BYTES = 8  # Request and response of "write single register" each
+MODBUS_RTU_FRAME_GAP_CHARS = 3.5  # Silent interval after every RTU frame
+MODBUS_ILLEGAL_REGISTER_EXCEPTION_CODES = (0x02, 0x03)  # Illegal data address, illegal data value
+REPLAY_PORT_PREFIX = 'replay:'  # Port of a heat pump to replay a Modbus recording, e.g. "replay:~/kronoterm.rec"
+SIMULATE_PORT_PREFIX = 'simulate:'  # Port of a heat pump simulated in-process, e.g. "simulate:sine"
+PROBE_TIMEOUT = 0.3  # Seconds to wait for the answer of an identification read while probing ports
+MQTT_MAX_INFLIGHT = 20  # Messages handed to paho at once, the others wait in the outbox
+MQTT_MAX_PENDING = 1000  # Topics waiting in the outbox, the oldest is dropped above it
+MQTT_RECONNECT_MIN_DELAY = 1  # Seconds before the first reconnect to the MQTT broker, doubled up to:
+MQTT_RECONNECT_MAX_DELAY = 60
+HOME_ASSISTANT_STATUS_TOPIC = 'homeassistant/status'  # Home Assistant announces its (re-)start here
+HOME_ASSISTANT_BIRTH_PAYLOAD = 'online'
+SUPERVISOR_MIN_DELAY = 1  # Seconds before the first restart of a failed Modbus link or expander UART, doubled up to:
+SUPERVISOR_MAX_DELAY = 60
+
+POLL_TIERS = ('fast', 'normal', 'slow', 'static')  # "poll" values in definitions, fastest first
+DEFAULT_POLL_TIER = 'fast'
+DEFINITION_SECTIONS = ('sensor', 'binary_sensor', 'enum_sensor', 'switch', 'select')  # Entities with a register
 
 # Etera expander module constants
 
 MIXING_VALVE_HOLD_TIME = 120  # time between motor movements in seconds
+EXPANDER_READY_TIMEOUT = 10  # Seconds to wait for the expander after opening its UART
+EXPANDER_REGISTERS = (2102, 2023, 2015, 2044, 2046, 2043, 2000)  # Heat pump registers that control the expander
@@ -0,0 +1,66 @@
+from collections.abc import Container, Iterator, Mapping
+from decimal import Decimal
+import logging
+from typing import no_type_check
+
+from ha_services.mqtt4homeassistant.components import BaseComponent
+from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
+from ha_services.mqtt4homeassistant.components.select import Select
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.components.switch import Switch
+
+
+logger = logging.getLogger(__name__)
+
+
+class DecodePlan:
+    """
+    Decoding of register values into component states, prepared once from
+    the definitions: integer fractions of the scale factors, bit masks and
+    dicts from register values to states. Decoding a cycle is then just a
+    loop over the registers, without Decimal math or linear scans of the options.
+
+    The fraction gives the same float as the Decimal math, because both round
+    only once from the exact value:
+
+    >>> numerator, denominator = Decimal('0.1').as_integer_ratio()
+    >>> 223 * numerator / denominator, float(Decimal('0.1') * Decimal(223))
+    (22.3, 22.3)
+    """
+
+    def __init__(self):
+        self.scaled: list[tuple[int, Sensor, int, int]] = list()  # address, sensor, numerator, denominator
+        self.bits: list[tuple[int, BinarySensor | Switch, int]] = list()  # address, component, bit mask
+        self.mapped: list[tuple[int, Sensor | Select, dict[int, str]]] = list()  # address, component, value -> state
+
+    def add_sensor(self, address: int, sensor: Sensor, scale: Decimal) -> None:
+        numerator, denominator = scale.as_integer_ratio()
+        self.scaled.append((address, sensor, numerator, denominator))
+
+    def add_binary_sensor(self, address: int, sensor: BinarySensor, bit: int | None) -> None:
+        mask = 0xFFFF if bit is None else 1 << bit
+        self.bits.append((address, sensor, mask))
+
+    def add_switch(self, address: int, switch: Switch) -> None:
+        self.bits.append((address, switch, 0xFFFF))
+
+    def add_options(self, address: int, component: Sensor | Select, options: dict) -> None:
+        """Enum sensors and selects with "keys" (register values) and "values" (states)"""
+        self.mapped.append((address, component, dict(zip(options['keys'], options['values']))))
+
+    @no_type_check  # Called every cycle: Don't let the typeguard import hook of the tests instrument the loop
+    def decode(self, registers: Mapping[int, int], addresses: Container[int]) -> Iterator[tuple[BaseComponent, object]]:
+        """Yields (component, state) of all components with a register in `addresses`"""
+        for address, sensor, numerator, denominator in self.scaled:
+            if address in addresses:
+                yield sensor, registers[address] * numerator / denominator
+        for address, component, mask in self.bits:
+            if address in addresses:
+                yield component, component.ON if registers[address] & mask else component.OFF
+        for address, component, states in self.mapped:
+            if address in addresses:
+                value = registers[address]
+                if (state := states.get(value)) is not None:
+                    yield component, state
+                else:
+                    logger.debug(f'Unknown value {value} of {component.name}')
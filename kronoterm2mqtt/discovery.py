@@ -0,0 +1,96 @@
+from collections.abc import Callable
+import json
+import logging
+
+from ha_services.mqtt4homeassistant.components import BaseComponent, get_origin_data
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, Client, MQTTMessage
+
+from kronoterm2mqtt.constants import HOME_ASSISTANT_BIRTH_PAYLOAD, HOME_ASSISTANT_STATUS_TOPIC
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_device_config(device: BaseMqttDevice, components: list[BaseComponent]) -> tuple[str, dict]:
+    """
+    Topic and payload of a device-based discovery message: One config of the
+    device with all its components, instead of one message per component
+    that repeats the device and origin information.
+    """
+    payload = {
+        'device': dict(device.get_mqtt_payload()),
+        'origin': get_origin_data(),
+        'components': {},
+    }
+    for component in components:
+        config = dict(component.get_config().payload)
+        del config['device']
+        config['platform'] = config.pop('component')
+        payload['components'][component.uid] = config
+    return f'{device.topic_prefix}/device/{device.uid}/config', payload
+
+
+class DiscoveryPublisher:
+    """
+    Publish the discovery configs of all components once at start and again
+    when Home Assistant announces its (re-)start with the birth message.
+    The components publish only their states, so the large retained configs
+    are not sent again and again in the publish loop.
+    Devices added with add_device() are discovered with a single
+    device-based config message.
+    """
+
+    def __init__(self, mqtt_client: Client, on_birth: Callable[[], None]):
+        self.mqtt_client = mqtt_client
+        self.on_birth = on_birth  # Called in the MQTT network thread
+        self.devices: dict[str, BaseMqttDevice] = dict()  # uid -> device with device-based discovery
+        self.published = 0
+
+    def add_device(self, device: BaseMqttDevice) -> None:
+        """Discover the device and its components with one device-based config"""
+        self.devices[device.uid] = device
+
+    def subscribe(self) -> None:
+        self.mqtt_client.message_callback_add(HOME_ASSISTANT_STATUS_TOPIC, self.status_callback)
+        result, _ = self.mqtt_client.subscribe(HOME_ASSISTANT_STATUS_TOPIC)
+        if result is MQTT_ERR_NO_CONN:
+            logger.info(f'Not connected, {HOME_ASSISTANT_STATUS_TOPIC} is subscribed after connecting')
+        elif result is not MQTT_ERR_SUCCESS:
+            logger.error(f'Error subscribing {HOME_ASSISTANT_STATUS_TOPIC}: {result=}')
+
+    def status_callback(self, client: Client, userdata, message: MQTTMessage) -> None:
+        status = message.payload.decode()
+        logger.info(f'Home Assistant status: {status!r}')
+        if status == HOME_ASSISTANT_BIRTH_PAYLOAD:
+            self.on_birth()
+
+    def subscribe_command(self, component: BaseComponent) -> None:
+        """Switches and selects subscribe in publish_config(), which is not used for device-based discovery"""
+        if command_topic := getattr(component, 'command_topic', None):
+            self.mqtt_client.message_callback_add(command_topic, component._command_callback)
+            result, _ = self.mqtt_client.subscribe(command_topic)
+            if result is not MQTT_ERR_SUCCESS:
+                logger.error(f'Error subscribing {command_topic=}: {result=}')
+
+    def publish(self) -> None:
+        """
+        Publish the configs of all components. Switches and selects also
+        subscribe to their command topics again, e.g. after a reconnect.
+        """
+        components = list(BaseMqttDevice.components.values())
+        device_components = {uid: [] for uid in self.devices}
+        for component in components:
+            if component.device.uid in device_components:
+                device_components[component.device.uid].append(component)
+                self.subscribe_command(component)
+            else:
+                component.config_throttle_sec = 0  # Only sent on demand, so never throttled
+                component.publish_config(self.mqtt_client)
+        for uid, device in self.devices.items():
+            topic, payload = get_device_config(device, device_components[uid])
+            payload = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+            logger.info(f'Publishing device config {topic} with {len(device_components[uid])} components')
+            self.mqtt_client.publish(topic=topic, payload=payload, qos=0, retain=True)
+        self.published += 1
+        logger.info(f'Published the discovery configs of {len(components)} components')
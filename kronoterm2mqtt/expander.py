@@ -9,12 +9,14 @@ from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
 from ha_services.mqtt4homeassistant.components.select import Select
 from ha_services.mqtt4homeassistant.components.sensor import Sensor
 from ha_services.mqtt4homeassistant.components.switch import Switch
-from ha_services.mqtt4homeassistant.device import MqttDevice
+from ha_services.mqtt4homeassistant.data_classes import NO_STATE
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
 from ha_services.mqtt4homeassistant.utilities.string_utils import slugify
 from paho.mqtt.client import Client
 
-from kronoterm2mqtt.constants import MIXING_VALVE_HOLD_TIME
+from kronoterm2mqtt.constants import EXPANDER_READY_TIMEOUT, MIXING_VALVE_HOLD_TIME
 from kronoterm2mqtt.pyetera_uart_bridge import EteraUartBridge
+from kronoterm2mqtt.supervisor import Supervisor
 from kronoterm2mqtt.user_settings import UserSettings
 
 
@@ -50,6 +52,12 @@ class ExpanderMqttHandler:
         self.mixing_valve_timer: list[float] = list()  # Measuring time from last move
         self.expedited_heating_timer: list[float] = list()  # Measuring time from start of expedited heating
         self.last_working_function: int = 5  # Heat pump in 5=Standby
+        # A failed UART is reopened on its own, without the valve calibration of init_device():
+        self.supervisor = Supervisor(
+            'ETERA expander UART',
+            restart=self.restart,
+            errors=(EteraUartBridge.DeviceException, OSError, TimeoutError),
+        )
 
     class WorkingMode(Enum):
         OFF = 'Izklop'
@@ -72,12 +80,7 @@ class ExpanderMqttHandler:
 
         self.taskgroup = asyncio.TaskGroup()
         await self.taskgroup.__aenter__()
-        
-        self.etera = EteraUartBridge(
-            port, on_device_reset_handler=etera_reset_handler, on_device_message_handler=etera_message_handler
-        )
-        self.taskgroup.create_task(self.etera.run_forever())
-        await self.etera.ready()
+        await self.connect()
 
         self.mqtt_device = MqttDevice(
             main_device=main_device,
@@ -86,7 +89,6 @@ class ExpanderMqttHandler:
             manufacturer='Wigaun DIY',
             model='Arduino nano',
             sw_version='1.1.3',
-            config_throttle_sec=self.user_settings.mqtt.publish_config_throttle_seconds,
         )
 
         for name in self.user_settings.custom_expander.sensor_names:
@@ -139,7 +141,7 @@ class ExpanderMqttHandler:
                 )
                 self.mixing_valve_sensors.append(mixing_valve_sensor)
                 mixing_valve_sensor.set_state(0)
-                mixing_valve_sensor.publish(self.mqtt_client)
+                mixing_valve_sensor.publish_state(self.mqtt_client)
                 self.taskgroup.create_task(self.mixing_valve_motor_close(i, 120))
                 self.mixing_valve_timer.append(time.monotonic())
                 self.expedited_heating_timer.append(None)
@@ -150,6 +152,30 @@ class ExpanderMqttHandler:
             initial_state=Switch.OFF,
         )
 
+    async def connect(self):
+        """Open the UART of the expander and wait until it's ready"""
+        self.etera = EteraUartBridge(
+            self.user_settings.custom_expander.port,
+            on_device_reset_handler=etera_reset_handler,
+            on_device_message_handler=etera_message_handler,
+        )
+        self.taskgroup.create_task(self.serve(self.etera))
+        async with asyncio.timeout(EXPANDER_READY_TIMEOUT):
+            await self.etera.ready()
+
+    async def serve(self, etera: EteraUartBridge):
+        """Run the UART bridge: A failure restarts the UART instead of cancelling the task group"""
+        try:
+            await etera.run_forever()
+        except (EteraUartBridge.DeviceException, OSError) as err:
+            if etera is self.etera:  # Not an already replaced bridge
+                self.supervisor.failed(err)
+
+    async def restart(self):
+        """Reopen the UART, the states and valve positions are kept"""
+        self.stop()
+        await self.connect()
+
     async def mixing_valve_motor_close(self, heating_loop_number: int, duration: float, override: bool = True):
         try:
             await self.etera.move_motor(
@@ -162,7 +188,7 @@ class ExpanderMqttHandler:
             position -= duration / 120.0 * 100
             position = max(position, 0)
             self.mixing_valve_sensors[heating_loop_number].set_state(position)
-            self.mixing_valve_sensors[heating_loop_number].publish(self.mqtt_client)
+            self.mixing_valve_sensors[heating_loop_number].publish_state(self.mqtt_client)
         except IndexError as e:
             print(f'Motor #{heating_loop_number} close invalid', e)
         except EteraUartBridge.DeviceException as e:
@@ -177,10 +203,17 @@ class ExpanderMqttHandler:
             position += duration / 120.0 * 100
             position = min(position, 100)
             self.mixing_valve_sensors[heating_loop_number].set_state(position)
-            self.mixing_valve_sensors[heating_loop_number].publish(self.mqtt_client)
+            self.mixing_valve_sensors[heating_loop_number].publish_state(self.mqtt_client)
         except EteraUartBridge.DeviceException as e:
             print(f'Motor #{heating_loop_number} move error', e)
 
+    def republish_states(self):
+        """Publish all known states again, e.g. after Home Assistant restarted"""
+        for component in BaseMqttDevice.components.values():
+            if component.device is self.mqtt_device and component.state is not NO_STATE:
+                component._next_publish = 0  # Bypass the state throttling, the state may have been sent just before
+                component.publish_state(self.mqtt_client)
+
     def loop_switch_callback(self, *, client: Client, component: Select, old_state: str, new_state: str):
         """Switches on/off (manually) loop."""
         loop_number = self.loop_states.index(component)
@@ -288,10 +321,10 @@ class ExpanderMqttHandler:
             for i, sensor in enumerate(self.sensors):
                 value = temperatures[ids[i]]
                 sensor.set_state(value)
-                sensor.publish(self.mqtt_client)
+                sensor.publish_state(self.mqtt_client)
             for select in self.loop_states:
-                select.publish(self.mqtt_client)
-            self.switch_intertank.publish(self.mqtt_client)
+                select.publish_state(self.mqtt_client)
+            self.switch_intertank.publish_state(self.mqtt_client)
 
             # Expander control start
             collector_temperature = temperatures[settings.solar_sensors[0]]
@@ -435,4 +468,4 @@ class ExpanderMqttHandler:
             logger.warning('Skiping due to invalid state: %s', err)
         for relay in self.relays:
             if relay is not None:
-                relay.publish(self.mqtt_client)
+                relay.publish_state(self.mqtt_client)
@@ -0,0 +1,75 @@
+import json
+import logging
+import time
+
+from ha_services.mqtt4homeassistant.components import BaseComponent
+from ha_services.mqtt4homeassistant.data_classes import NO_STATE, ComponentConfig
+from ha_services.mqtt4homeassistant.device import MqttDevice
+from paho.mqtt.client import Client, MQTTMessageInfo
+
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStatePublisher:
+    """
+    Publish the states of all components of a device as one JSON document on
+    a single topic, instead of one message per component. The discovery
+    configs of the components point to this topic and extract their field
+    with a "value_template". Unchanged documents are published again only
+    after the heartbeat.
+    """
+
+    def __init__(self, device: MqttDevice, heartbeat: float):
+        self.device = device
+        self.heartbeat = heartbeat
+        self.topic = f'{device.topic_prefix}/{device.uid}/state'  # e.g.: 'homeassistant/kronoterm/state'
+        self.components: dict[str, BaseComponent] = dict()  # JSON field -> component
+        self.last_payload: str | None = None
+        self.last_time = 0.0
+        self.sent = 0
+        self.suppressed = 0
+
+    def add(self, component: BaseComponent) -> None:
+        """Publish the state of the component in the JSON document and change its discovery config for it"""
+        field = component.uid.removeprefix(f'{self.device.uid}-')
+        self.components[field] = component
+        get_config = component.get_config
+
+        def get_json_state_config() -> ComponentConfig:
+            config = get_config()
+            config.payload['state_topic'] = self.topic
+            config.payload['value_template'] = f"{{{{ value_json['{field}'] }}}}"
+            return config
+
+        component.get_config = get_json_state_config
+
+    def get_payload(self) -> str:
+        states = {
+            field: component.get_state().payload
+            for field, component in self.components.items()
+            if component.state is not NO_STATE
+        }
+        return json.dumps(states, ensure_ascii=False, separators=(',', ':'))
+
+    def publish(self, client: Client, force: bool = False) -> MQTTMessageInfo | None:
+        """Publish the JSON document, if it changed, after the heartbeat or with `force`"""
+        payload = self.get_payload()
+        now = time.monotonic()
+        if not force and payload == self.last_payload and now - self.last_time < self.heartbeat:
+            self.suppressed += 1
+            return None
+
+        logger.debug(f'Publishing {self.topic}: {payload}')
+        info = client.publish(topic=self.topic, payload=payload, qos=0, retain=False)
+        self.last_payload = payload
+        self.last_time = now
+        self.sent += 1
+        return info
+
+    def reset_counters(self) -> None:
+        self.sent = 0
+        self.suppressed = 0
+
+    def __str__(self):
+        return f'{self.sent} JSON documents sent, {self.suppressed} suppressed'
@@ -0,0 +1,166 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+import functools
+import itertools
+import logging
+import queue
+import threading
+
+from pymodbus.exceptions import ConnectionException, ModbusException, ModbusIOException
+
+from kronoterm2mqtt.api import ModbusClient, get_bus_cost, get_modbus_client
+from kronoterm2mqtt.register_blocks import BusCost
+from kronoterm2mqtt.supervisor import Supervisor
+from kronoterm2mqtt.user_settings import HeatPump
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModbusBus:
+    """
+    One Modbus connection (a serial RS-485 line or a TCP host) shared by all
+    heat pumps on it. A single bus-owner thread takes the requests from a
+    priority queue, so they never block the event loop and never interleave
+    on the wire. Writes of user commands go before all waiting reads: the
+    heat pumps read block by block, so a command waits at most for the block
+    that is currently read. A write to a register that is still waiting is
+    coalesced with the new one, only the latest value is written.
+    Reads are served in the order they are made, so heat pumps on the same
+    bus take turns fairly, while heat pumps on different buses run in parallel.
+    A failed connection (e.g. an unplugged USB adapter) is reopened by the
+    supervisor of the bus, while the heat pumps on it skip their cycles.
+    A slave that doesn't respond (e.g. a powered off heat pump) has its own
+    supervisor: Only its cycles are skipped until it responds to a probe
+    again, so its timeouts don't hold up the other slaves. The connection is
+    reopened only if no slave on the bus responds.
+    """
+
+    PRIORITY_WRITE = 0
+    PRIORITY_READ = 1
+
+    def __init__(self, name: str, client: ModbusClient, cost: BusCost):
+        self.name = name
+        self.client = client
+        self.cost = cost
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()  # Keeps the order of requests with the same priority
+        self.lock = threading.Lock()
+        self.pending_writes: dict[tuple[int, int], tuple[Future, int]] = dict()  # (slave id, address) -> future, value
+        self.coalesced_writes = 0
+        self.supervisor = Supervisor(f'Modbus link {name}', restart=self.reconnect, errors=(ModbusException, OSError))
+        self.slave_supervisors: dict[int, Supervisor] = dict()  # slave id -> supervisor of its responses
+        self.thread = threading.Thread(target=self.serve, name=f'modbus {name}', daemon=True)
+        self.thread.start()
+
+    def serve(self) -> None:
+        """The bus-owner thread: Run the queued requests one after another"""
+        while True:
+            _, _, future, func = self.queue.get()
+            if func is None:  # Closed
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func()
+            except Exception as err:  # noqa: BLE001 - Raised by the awaiting side
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+    def submit(self, func: Callable, *args, priority: int = PRIORITY_READ, **kwargs) -> Future:
+        """Queue a call of func in the bus thread, also usable from other threads (e.g. MQTT callbacks)"""
+        future = Future()
+        self.queue.put((priority, next(self.sequence), future, functools.partial(func, *args, **kwargs)))
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Call func in the bus thread and wait for the result"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def get_slave_supervisor(self, slave_id: int) -> Supervisor:
+        if (supervisor := self.slave_supervisors.get(slave_id)) is None:
+            supervisor = self.slave_supervisors[slave_id] = Supervisor(
+                f'Modbus slave {slave_id} on {self.name}',
+                restart=functools.partial(self.probe, slave_id),
+                errors=(ModbusIOException,),  # No response, other slaves may respond
+            )
+        return supervisor
+
+    async def run_slave(self, slave_id: int, func: Callable[..., Awaitable], *args, **kwargs) -> bool:
+        """Await func with requests to one slave, unless the bus or the slave is down. Returns if it succeeded."""
+        slave_supervisor = self.get_slave_supervisor(slave_id)
+        if self.supervisor.is_down or slave_supervisor.is_down:
+            logger.debug(f'{self.name} or slave {slave_id} is down: Skip {func.__name__}()')
+            return False
+        try:
+            await func(*args, **kwargs)
+        except slave_supervisor.errors as err:
+            slave_supervisor.failed(err)
+            if all(supervisor.is_down for supervisor in self.slave_supervisors.values()):
+                self.supervisor.failed(err)  # No slave responds: Maybe the connection itself
+            return False
+        except self.supervisor.errors as err:
+            self.supervisor.failed(err)
+            return False
+        return True
+
+    async def probe(self, slave_id: int) -> None:
+        """Raises if the slave doesn't respond, any response (even an exception response) will do"""
+        await self.run(self.client.read_holding_registers, address=0, count=1, device_id=slave_id)
+
+    def write_register(self, *, slave_id: int, address: int, value: int) -> Future:
+        """Queue a write before all reads. Returns the future of the response."""
+        key = (slave_id, address)
+        with self.lock:
+            if key in self.pending_writes:
+                future, _ = self.pending_writes[key]
+                self.pending_writes[key] = (future, value)
+                self.coalesced_writes += 1
+                logger.debug(f'Coalesced write of {value} to register {address} of slave {slave_id}')
+                return future
+            future = self.submit(self.write_pending_register, key, priority=self.PRIORITY_WRITE)
+            self.pending_writes[key] = (future, value)
+            return future
+
+    def write_pending_register(self, key: tuple[int, int]):
+        with self.lock:
+            _, value = self.pending_writes.pop(key)
+        slave_id, address = key
+        return self.client.write_register(address=address, value=value, device_id=slave_id)
+
+    async def reconnect(self) -> None:
+        """Reopen the connection in the bus thread, before all waiting reads"""
+        await self.run(self.reopen, priority=self.PRIORITY_WRITE)
+
+    def reopen(self) -> None:
+        self.client.close()
+        if not self.client.connect():
+            raise ConnectionException(f'Could not open {self.name}')
+
+    def close(self) -> None:
+        self.queue.put((-1, -1, None, None))  # Stop the bus thread before any waiting request
+        self.thread.join(timeout=5)
+        while not self.queue.empty():
+            _, _, future, _ = self.queue.get_nowait()
+            if future is not None:
+                future.cancel()
+        self.client.close()
+
+
+def get_modbus_buses(heat_pumps: list[HeatPump], verbosity: int) -> dict[str, ModbusBus]:
+    """One bus per port of the heat pumps, heat pumps with the same port share it"""
+    buses = dict()
+    for heat_pump in heat_pumps:
+        definitions = heat_pump.get_definitions(verbosity)
+        if bus := buses.get(heat_pump.port):
+            if get_bus_cost(heat_pump, definitions) != bus.cost:
+                logger.warning(
+                    f'{heat_pump.device_name!r} uses other connection settings than the first device'
+                    f' on {heat_pump.port}: They are ignored!'
+                )
+            continue
+        client = get_modbus_client(heat_pump, definitions, verbosity)
+        buses[heat_pump.port] = ModbusBus(heat_pump.port, client, get_bus_cost(heat_pump, definitions))
+    return buses
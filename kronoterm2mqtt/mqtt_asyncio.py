@@ -0,0 +1,166 @@
+import asyncio
+from collections.abc import Callable, Coroutine
+import logging
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTErrorCode
+
+from kronoterm2mqtt.constants import MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_MIN_DELAY
+from kronoterm2mqtt.mqtt_outbox import OutboxClient
+
+
+logger = logging.getLogger(__name__)
+
+background_tasks: set[asyncio.Task] = set()  # Strong references, the event loop keeps only weak ones
+
+
+def run_in_loop(coroutine: Coroutine, loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Run the coroutine of an MQTT callback in the event loop: As a task, if the
+    callback already runs in the event loop (AsyncioMqttClient), otherwise
+    handed over from paho's network thread.
+    """
+    try:
+        in_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        in_loop = False
+    if in_loop:
+        task = loop.create_task(coroutine)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    else:
+        asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+
+class AsyncioMqttClient(OutboxClient):
+    """
+    MQTT client driven by the event loop of the publish loop instead of paho's
+    network thread: The socket is watched with add_reader()/add_writer() and a
+    task sends the keepalive pings and reconnects, the blocking reconnect() in
+    an executor thread. So all paho callbacks, e.g. the commands of switches
+    and selects, run in the event loop thread, and the publish loop can await
+    the outbox being sent with drain().
+
+    Call start() in the event loop after connect() and loop_stop() before disconnect().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.misc_task: asyncio.Task | None = None
+        self.network_event = asyncio.Event()  # Set by every (dis-)connect and sent message
+
+    async def start(self, timeout: float = 10) -> None:
+        """Attach the connected client to the running event loop and wait for the CONNACK of the broker"""
+        self.loop = asyncio.get_running_loop()
+        self.on_socket_open = self.socket_opened
+        self.on_socket_close = self.socket_closed
+        self.on_socket_register_write = self.register_write
+        self.on_socket_unregister_write = self.unregister_write
+        if (sock := self.socket()) is not None:
+            self.socket_opened(self, None, sock)
+            self.loop_write()  # Registers the writer, if packets are waiting
+        self.misc_task = self.loop.create_task(self.misc_loop())
+        if not await self.wait_until(self.is_connected, timeout):
+            logger.warning(f'MQTT broker did not accept the connection within {timeout} seconds')
+
+    def loop_stop(self) -> MQTTErrorCode:
+        """Detach the client from the event loop, a later disconnect() writes directly"""
+        if self.loop is None:
+            return super().loop_stop()
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+        if (sock := self.socket()) is not None:
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+        self.on_socket_open = None
+        self.on_socket_close = None
+        self.on_socket_register_write = None
+        self.on_socket_unregister_write = None
+        self.loop = None
+        return MQTT_ERR_SUCCESS
+
+    def call_in_loop(self, callback: Callable, *args) -> None:
+        """
+        The socket callbacks of reconnect() are called in its executor thread:
+        They are handed over to the event loop, in their order.
+        """
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def socket_opened(self, client, userdata, sock) -> None:
+        self.call_in_loop(self.loop.add_reader, sock, self.read)
+
+    def socket_closed(self, client, userdata, sock) -> None:
+        # paho closes the socket after this callback, a handed over one gets the file descriptor:
+        self.call_in_loop(self.socket_removed, sock.fileno())
+
+    def socket_removed(self, fd: int) -> None:
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        self.network_event.set()
+
+    def register_write(self, client, userdata, sock) -> None:
+        self.call_in_loop(self.loop.add_writer, sock, self.loop_write)
+
+    def unregister_write(self, client, userdata, sock) -> None:
+        self.call_in_loop(self.loop.remove_writer, sock.fileno())
+
+    def read(self) -> None:
+        self.loop_read()
+        # TLS may have decrypted more than one packet, the selector doesn't see the rest:
+        while (sock := self.socket()) is not None and getattr(sock, 'pending', int)():
+            if self.loop_read() != MQTT_ERR_SUCCESS:
+                break
+
+    async def misc_loop(self) -> None:
+        """Send the keepalive pings and reconnect with an exponential backoff"""
+        delay = MQTT_RECONNECT_MIN_DELAY
+        while True:
+            if self.loop_misc() == MQTT_ERR_SUCCESS:
+                delay = MQTT_RECONNECT_MIN_DELAY
+                await asyncio.sleep(1)
+                continue
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MQTT_RECONNECT_MAX_DELAY)
+            logger.info('Reconnect to the MQTT broker...')
+            try:
+                # The TCP connection may take until its timeout, the publish loop goes on meanwhile:
+                await self.loop.run_in_executor(None, self.reconnect)
+            except OSError as err:
+                logger.warning(f'MQTT reconnect failed: {err}')
+
+    def message_published(self, *args) -> None:
+        super().message_published(*args)
+        self.network_event.set()
+
+    def connected(self) -> None:
+        super().connected()
+        self.network_event.set()
+
+    async def wait_until(self, condition: Callable[[], bool], timeout: float) -> bool:
+        """Wait until the condition is true, it's checked after every network event"""
+        try:
+            async with asyncio.timeout(timeout):
+                while not condition():
+                    self.network_event.clear()
+                    await self.network_event.wait()
+        except TimeoutError:
+            return False
+        return True
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Flow control: Wait until all messages are sent, so a slow broker slows
+        the publish loop down. While disconnected, it returns at once and the
+        outbox keeps the newest states. Returns False on timeout.
+        """
+        if await self.wait_until(lambda: not (self.is_connected() and (self.pending or self.inflight)), timeout):
+            return True
+        logger.warning(f'MQTT broker did not take the messages within {timeout} seconds: {self.get_statistics()}')
+        return False
@@ -1,37 +1,48 @@
 import logging
+import socket
 import ssl
 
-from ha_services.mqtt4homeassistant.mqtt import get_connected_client as _upstream_get_connected_client
+from bx_py_utils.anonymize import anonymize
+from cli_base.cli_tools.rich_utils import human_error
+from ha_services.mqtt4homeassistant.mqtt import OnConnectCallback, get_client_id
 import paho.mqtt.client as mqtt
+from rich import print
 
+from kronoterm2mqtt.constants import MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_MIN_DELAY
+from kronoterm2mqtt.mqtt_asyncio import AsyncioMqttClient
+from kronoterm2mqtt.mqtt_outbox import OutboxClient
 from kronoterm2mqtt.user_settings import MqttTlsSettings, UserSettings
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_connected_client(user_settings: UserSettings, verbosity: int, timeout: int = 10) -> mqtt.Client:
+class OutboxConnectCallback(OnConnectCallback):
+    """Send the newest states held back in the outbox right after every (re-)connect"""
+
+    def __call__(self, client: OutboxClient, userdata, flags, reason_code, properties):
+        super().__call__(client, userdata, flags, reason_code, properties)
+        client.connected()
+
+
+def get_connected_client(
+    user_settings: UserSettings, verbosity: int, timeout: int = 10, keep_trying: bool = False
+) -> mqtt.Client:
     """
     Create and return a connected MQTT client with optional TLS support.
 
-    If TLS is not enabled, delegates to the upstream ha_services implementation.
-    If TLS is enabled, configures TLS before connecting.
+    The connection logic is the one of ha_services, but the client is an
+    OutboxClient and TLS is configured before connect(), if enabled.
+    With "mqtt_asyncio" it's an AsyncioMqttClient: Call its start() in the
+    event loop instead of loop_start().
+
+    The network loop reconnects lost connections with a backoff. With
+    "keep_trying", it also makes the first connection, if the broker is
+    not reachable yet, e.g. after a power outage.
     """
     tls_settings: MqttTlsSettings = user_settings.mqtt_tls
     mqtt_settings = user_settings.mqtt
 
-    if not tls_settings.enabled:
-        return _upstream_get_connected_client(settings=mqtt_settings, verbosity=verbosity, timeout=timeout)
-
-    # TLS is enabled - we need to set up TLS before connect(),
-    # so we replicate the connection logic with TLS inserted.
-    import socket
-
-    from bx_py_utils.anonymize import anonymize
-    from cli_base.cli_tools.rich_utils import human_error
-    from ha_services.mqtt4homeassistant.mqtt import OnConnectCallback, get_client_id
-    from rich import print
-
     client_id = get_client_id()
     port = int(mqtt_settings.port)
 
@@ -54,12 +65,14 @@ def get_connected_client(user_settings: UserSettings, verbosity: int, timeout: i
         elif verbosity:
             print('Host/port test [green]OK')
 
-    mqttc = mqtt.Client(
+    client_class = AsyncioMqttClient if user_settings.mqtt_asyncio else OutboxClient
+    mqttc = client_class(
         mqtt.CallbackAPIVersion.VERSION2,
         client_id=client_id,
     )
-    mqttc.on_connect = OnConnectCallback(verbosity=verbosity)
+    mqttc.on_connect = OutboxConnectCallback(verbosity=verbosity)
     mqttc.enable_logger(logger=logger)
+    mqttc.reconnect_delay_set(min_delay=MQTT_RECONNECT_MIN_DELAY, max_delay=MQTT_RECONNECT_MAX_DELAY)
 
     if mqtt_settings.user_name and mqtt_settings.password:
         if verbosity:
@@ -69,27 +82,34 @@ def get_connected_client(user_settings: UserSettings, verbosity: int, timeout: i
             )
         mqttc.username_pw_set(mqtt_settings.user_name, mqtt_settings.password)
 
-    # Configure TLS
-    ca_certs = tls_settings.ca_certs or None
-    certfile = tls_settings.certfile or None
-    keyfile = tls_settings.keyfile or None
-
-    if verbosity:
-        print(f'TLS enabled (ca_certs={ca_certs}, certfile={certfile})', end='...')
-
-    mqttc.tls_set(
-        ca_certs=ca_certs,
-        certfile=certfile,
-        keyfile=keyfile,
-        cert_reqs=ssl.CERT_REQUIRED,
-        tls_version=ssl.PROTOCOL_TLS_CLIENT,
-    )
+    if tls_settings.enabled:
+        ca_certs = tls_settings.ca_certs or None
+        certfile = tls_settings.certfile or None
+        keyfile = tls_settings.keyfile or None
 
-    if tls_settings.insecure:
-        mqttc.tls_insecure_set(True)
+        if verbosity:
+            print(f'TLS enabled (ca_certs={ca_certs}, certfile={certfile})', end='...')
+
+        mqttc.tls_set(
+            ca_certs=ca_certs,
+            certfile=certfile,
+            keyfile=keyfile,
+            cert_reqs=ssl.CERT_REQUIRED,
+            tls_version=ssl.PROTOCOL_TLS_CLIENT,
+        )
 
-    mqttc.connect(mqtt_settings.host, port=port)
+        if tls_settings.insecure:
+            mqttc.tls_insecure_set(True)
 
-    if verbosity:
-        print('[green]OK')
+    try:
+        mqttc.connect(mqtt_settings.host, port=port)
+    except OSError as err:
+        if not keep_trying:
+            raise
+        print(f'[red]{err}[/red], keep trying...')
+        logger.warning(f'MQTT broker {mqtt_settings.host}:{port} is not reachable: {err}')
+        mqttc.connect_async(mqtt_settings.host, port=port)
+    else:
+        if verbosity:
+            print('[green]OK')
     return mqttc
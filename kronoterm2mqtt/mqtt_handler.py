@@ -1,94 +1,96 @@
 import asyncio
 from decimal import Decimal
-import itertools
 import logging
-from typing import Any
+import math
+import time
 
+from ha_services.exceptions import InvalidStateValue
+from ha_services.mqtt4homeassistant.components import BaseComponent
 from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
 from ha_services.mqtt4homeassistant.components.select import Select
 from ha_services.mqtt4homeassistant.components.sensor import Sensor
 from ha_services.mqtt4homeassistant.components.switch import Switch
+from ha_services.mqtt4homeassistant.data_classes import NO_STATE
 from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
 from ha_services.mqtt4homeassistant.utilities.string_utils import slugify
 from paho.mqtt.client import Client
-from pymodbus.exceptions import ModbusIOException
-from pymodbus.pdu import ExceptionResponse
-from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
 from rich import print
 
 import kronoterm2mqtt
-from kronoterm2mqtt.api import get_modbus_client
-from kronoterm2mqtt.constants import DEFAULT_DEVICE_MANUFACTURER, MODBUS_SLAVE_ID
+from kronoterm2mqtt.constants import DEFAULT_DEVICE_MANUFACTURER, DEFAULT_POLL_TIER, EXPANDER_REGISTERS, POLL_TIERS
+from kronoterm2mqtt.decode_plan import DecodePlan
+from kronoterm2mqtt.discovery import DiscoveryPublisher
 from kronoterm2mqtt.expander import ExpanderMqttHandler
+from kronoterm2mqtt.json_state import JsonStatePublisher
+from kronoterm2mqtt.modbus_bus import ModbusBus, get_modbus_buses
+from kronoterm2mqtt.mqtt_asyncio import AsyncioMqttClient, run_in_loop
 from kronoterm2mqtt.mqtt_connection import get_connected_client
-from kronoterm2mqtt.user_settings import UserSettings
+from kronoterm2mqtt.mqtt_outbox import OutboxClient
+from kronoterm2mqtt.publish_filter import ChangeFilter, get_deadband
+from kronoterm2mqtt.register_blocks import (
+    IllegalRegisters,
+    estimate_bus_time,
+    plan_register_blocks,
+    read_register_block_bisecting,
+    stagger_poll_tiers,
+)
+from kronoterm2mqtt.register_snapshot import RegisterSnapshot
+from kronoterm2mqtt.timing import FixedRateScheduler, RunningStats, measure_event_loop_lag
+from kronoterm2mqtt.user_settings import HeatPump, UserSettings
 
 
 logger = logging.getLogger(__name__)
 
 
-class KronotermMqttHandler:
-    def __init__(self, user_settings: UserSettings, verbosity: int):
-        self.user_settings = user_settings
+class HeatPumpHandler:
+    """
+    One heat pump on a Modbus bus: Creates its MQTT device from the
+    definitions, reads its registers and publishes the states.
+    """
+
+    def __init__(
+        self,
+        *,
+        heat_pump: HeatPump,
+        device_uid: str,
+        mqtt_client: Client,
+        bus: ModbusBus,
+        verbosity: int,
+    ):
+        self.heat_pump = heat_pump
+        self.device_uid = device_uid
+        self.device_name = heat_pump.device_name
+        self.mqtt_client = mqtt_client
+        self.bus = bus
         self.verbosity = verbosity
-        self.heat_pump = self.user_settings.heat_pump
-        self.device_name = self.heat_pump.device_name
-        self.mqtt_client = get_connected_client(user_settings=user_settings, verbosity=verbosity)
-        self.mqtt_client.loop_start()
-        self.modbus_client = None
-        self.expander: ExpanderMqttHandler | None = (
-            ExpanderMqttHandler(self.mqtt_client, user_settings, verbosity)
-            if self.user_settings.custom_expander.module_enabled
-            else None
-        )
         self.main_device: MqttDevice | None = None
-        self.sensors: dict[int, tuple[Sensor, Decimal]] = dict()
-        self.binary_sensors: dict[int, dict[int, BinarySensor]] = dict()
-        self.enum_sensors: dict[int, tuple[Sensor, dict[str, list[Any]]]] = dict()
-        self.address_ranges: list[tuple[int, int]] = list()
-        self.registers: dict[int] = dict()
-        self.switches: dict[int, Switch] = dict()
-        self.selects: dict[int, tuple[Select, dict[str, list[Any]]]] = dict()
-
-    def __enter__(self):
-        """Enter the context manager."""
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Exit the context manager, cleaning up resources."""
-        if self.verbosity:
-            print('\nClosing MQTT and Modbus client.', end='...')
-
-        if self.expander:
-            self.expander.stop()
-            print('expander stopped', flush=True)
-
-        if self.modbus_client:
-            self.modbus_client.close()
-            
-        if self.mqtt_client:
-            self.mqtt_client.loop_stop()
-            self.mqtt_client.disconnect()
-            
-        BaseMqttDevice.device_uids = set()  # Reset
-        BaseMqttDevice.components = {}  # Global registry of all components
-
-    async def init_device(self):
+        self.decode_plan = DecodePlan()
+        self.address_tiers: dict[int, str] = dict()  # Fastest poll tier of each register
+        self.address_ranges: dict[str, list[tuple[int, int]]] = dict()  # Read blocks of each poll tier
+        self.bus_times: dict[str, float] = dict()  # Estimated seconds to read the blocks of each poll tier
+        self.poll_intervals = self.heat_pump.get_poll_intervals()
+        self.next_poll: dict[str, float] = dict()
+        self.illegal_registers = IllegalRegisters(self.heat_pump.get_illegal_registers_path())
+        self.registers: RegisterSnapshot | None = None
+        self.commands: dict[str, tuple[int, dict[str, int]]] = dict()  # uid -> (address, state -> register value)
+        self.command_latency = RunningStats()  # From the MQTT command to the published confirmed state
+        self.loop: asyncio.AbstractEventLoop | None = None  # Runs the commands received by the MQTT client
+        self.change_filter = ChangeFilter(heartbeat=self.heat_pump.publish_heartbeat)
+        self.json_state: JsonStatePublisher | None = None  # Publishes all states as one message, if enabled
+
+    def init_device(self):
         """
         Create sensors from definitions.toml add it to device for later
         update in publish process.
         """
         self.main_device = MqttDevice(
             name=self.heat_pump.device_name,
-            uid=self.user_settings.mqtt.main_uid,
+            uid=self.device_uid,
             manufacturer=DEFAULT_DEVICE_MANUFACTURER,
             model=self.heat_pump.model,
             sw_version=kronoterm2mqtt.__version__,
-            config_throttle_sec=self.user_settings.mqtt.publish_config_throttle_seconds,
         )
-
-        if self.expander is not None:
-            await self.expander.init_device(self.main_device)
+        self.loop = asyncio.get_running_loop()
 
         definitions = self.heat_pump.get_definitions(self.verbosity)
 
@@ -99,63 +101,66 @@ class KronotermMqttHandler:
                 print(f'Creating sensor {parameter}')
 
             address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
+            self.set_poll_tier(address, parameter)
             scale = Decimal(str(parameter['scale']))
             precision = abs(scale.as_tuple().exponent)
-            self.sensors[address] = (
-                Sensor(
-                    device=self.main_device,
-                    name=parameter['name'],
-                    uid=slugify(parameter['name'], '_').lower(),
-                    device_class=parameter['device_class'],
-                    state_class=parameter['state_class'] if len(parameter['state_class']) else None,
-                    unit_of_measurement=(
-                        parameter['unit_of_measurement'] if len(parameter['unit_of_measurement']) else None
-                    ),
-                    suggested_display_precision=precision,
+            sensor = Sensor(
+                device=self.main_device,
+                name=parameter['name'],
+                uid=slugify(parameter['name'], '_').lower(),
+                device_class=parameter['device_class'],
+                state_class=parameter['state_class'] if len(parameter['state_class']) else None,
+                unit_of_measurement=(
+                    parameter['unit_of_measurement'] if len(parameter['unit_of_measurement']) else None
                 ),
-                scale,
+                suggested_display_precision=precision,
             )
+            self.decode_plan.add_sensor(address, sensor, scale)
+            self.change_filter.set_deadband(sensor, get_deadband(parameter))
 
         binary_sensor_definitions = definitions['binary_sensor']
         for parameter in binary_sensor_definitions:
             address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
-            bit = parameter.get('bit')
-            self.binary_sensors.setdefault(address, {})[bit] = BinarySensor(
+            self.set_poll_tier(address, parameter)
+            binary_sensor = BinarySensor(
                 device=self.main_device,
                 name=parameter['name'],
                 uid=slugify(parameter['name'], '_').lower(),
                 device_class=parameter['device_class'] if len(parameter['device_class']) else None,
             )
+            self.decode_plan.add_binary_sensor(address, binary_sensor, parameter.get('bit'))
         enum_sensor_definitions = definitions['enum_sensor']
         for parameter in enum_sensor_definitions:
             address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
-            self.enum_sensors[address] = (
-                Sensor(
-                    device=self.main_device,
-                    name=parameter['name'],
-                    uid=slugify(parameter['name'], '_').lower(),
-                    device_class=None,
-                    state_class=None,
-                ),
-                *parameter['options'],
+            self.set_poll_tier(address, parameter)
+            enum_sensor = Sensor(
+                device=self.main_device,
+                name=parameter['name'],
+                uid=slugify(parameter['name'], '_').lower(),
+                device_class=None,
+                state_class=None,
             )
+            self.decode_plan.add_options(address, enum_sensor, parameter['options'][0])
 
         if 'switch' in definitions:
             switch_definitions = definitions['switch']
             for parameter in switch_definitions:
                 address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
+                self.set_poll_tier(address, parameter)
                 switch = Switch(
                     device=self.main_device,
                     name=parameter['name'],
                     uid=slugify(parameter['name'], '_').lower(),
-                    callback=self.switch_callback,
+                    callback=self.command_callback,
                 )
-                self.switches[address] = switch
+                self.commands[switch.uid] = (address, {switch.ON: 1, switch.OFF: 0})
+                self.decode_plan.add_switch(address, switch)
 
         if 'select' in definitions:
             select_definitions = definitions['select']
             for parameter in select_definitions:
                 address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
+                self.set_poll_tier(address, parameter)
                 options = parameter['options'][0]  # Get first options object
                 select = Select(
                     device=self.main_device,
@@ -163,186 +168,419 @@ class KronotermMqttHandler:
                     uid=slugify(parameter['name'], '_').lower(),
                     default_option=parameter['default_option'],
                     options=tuple(options['values']),
-                    callback=self.select_callback,
+                    callback=self.command_callback,
                 )
-                self.selects[address] = (select, options)
+                self.commands[select.uid] = (address, dict(zip(options['values'], options['keys'])))
+                self.decode_plan.add_options(address, select, options)
+
+        if self.heat_pump.json_state:
+            self.json_state = JsonStatePublisher(self.main_device, heartbeat=self.heat_pump.publish_heartbeat)
+            for component in self.get_components():
+                self.json_state.add(component)
 
         # Prepare ranges of registers for faster Modbus reads in blocks
-        addresses = sorted(
-            list(self.sensors.keys())
-            + list(self.binary_sensors.keys())
-            + list(self.enum_sensors.keys())
-            + list(self.switches.keys())
-            + list(self.selects.keys())
-        )
-        self.address_ranges = list(self.ranges(list(addresses)))
-        if self.verbosity > 1:
-            print(f'Addresses: {addresses} Ranges: {len(self.address_ranges)}')
+        self.plan_address_ranges()
+        self.schedule_poll_tiers()
+        self.registers = RegisterSnapshot(min(self.address_tiers), max(self.address_tiers))
+
+    def get_components(self) -> list[BaseComponent]:
+        return [component for component in BaseMqttDevice.components.values() if component.device is self.main_device]
+
+    def set_poll_tier(self, address: int, parameter: dict):
+        """Registers shared by several entities are read with the fastest poll tier"""
+        tier = parameter.get('poll', DEFAULT_POLL_TIER)
+        assert tier in POLL_TIERS, f'Invalid poll {tier!r} of {parameter["name"]!r}, use one of {POLL_TIERS}'
+        current_tier = self.address_tiers.get(address, tier)
+        self.address_tiers[address] = min(tier, current_tier, key=POLL_TIERS.index)
+
+    def plan_address_ranges(self):
+        """Plan the Modbus read blocks of each poll tier, avoiding the known illegal registers"""
+        self.address_ranges = dict()
+        self.bus_times = dict()
+        for tier in POLL_TIERS:
+            addresses = [address for address, address_tier in self.address_tiers.items() if address_tier == tier]
+            if not addresses:
+                continue
+            self.address_ranges[tier] = plan_register_blocks(addresses, self.bus.cost, excluded=self.illegal_registers)
+            bus_time = self.bus_times[tier] = estimate_bus_time(self.address_ranges[tier], self.bus.cost)
+            interval = self.poll_intervals[tier]
+            schedule = 'once' if interval is None else f'every {interval} s'
+            print(
+                f'{self.device_name}: Planned {len(self.address_ranges[tier])} Modbus read blocks'
+                f' for {len(addresses)} {tier} registers ({schedule}), estimated bus time {bus_time * 1000:.0f} ms'
+            )
+            if self.verbosity > 1:
+                print(f'Addresses: {sorted(addresses)} Ranges: {self.address_ranges[tier]}')
+        if illegal := sorted(address for address in self.address_tiers if address in self.illegal_registers):
+            logger.warning(f'Skipping illegal registers: {illegal}')
 
-    def switch_callback(self, *, client: Client, component: Switch, old_state: str, new_state: str):
+    def schedule_poll_tiers(self):
         """
-        Generic callback for switch state changes.
+        Check the estimated bus time of the cycles against the pooling interval.
+        Slower poll tiers that don't fit into the first cycle together with the
+        others are read first in one of the next cycles, so that they are not
+        all read in the same cycles later on.
         """
-        logger.info(f'{component.name} state changed: {old_state!r} -> {new_state!r}')
-
-        # Find the address for this switch
-        address = None
-        for addr, switch in self.switches.items():
-            if switch == component:
-                address = addr
-                break
-
-        if address is None:
-            logger.error(f'Could not find address for switch {component.name}')
+        interval = self.heat_pump.pooling_interval
+        if not interval or not self.bus_times:
             return
+        offsets = stagger_poll_tiers(self.bus_times, budget=interval)
+        now = time.monotonic()
+        for tier, offset in offsets.items():
+            self.next_poll[tier] = now + offset * interval
+            if offset:
+                logger.info(f'{self.device_name}: First read of {tier} registers in cycle {offset + 1}')
+        first_tier, *other_tiers = offsets  # The first tier is read in every cycle
+        cycle_times = [self.bus_times[first_tier]] * (max(offsets.values()) + 1)
+        for tier in other_tiers:
+            cycle_times[offsets[tier]] += self.bus_times[tier]
+        cycle_time = max(cycle_times)
+        if cycle_time > interval:
+            logger.warning(
+                f'{self.device_name}: Estimated bus time of a cycle {cycle_time:.1f} s exceeds'
+                f' the pooling interval of {interval} s: Increase "pooling_interval"'
+                ' or use a slower "poll" for some registers in the definitions!'
+            )
 
-        value = 1 if new_state == 'ON' else 0
-        success = self.modbus_client.write_register(address=address, value=value, device_id=MODBUS_SLAVE_ID)
-
-        if success:
-            component.set_state(new_state)
-            component.publish_state(client)
-        else:
-            logger.error(f'Failed to write register for {component.name}')
+    def get_bus_load(self) -> float:
+        """Estimated share of the time this heat pump needs the bus, without the registers read only once"""
+        return sum(
+            bus_time / interval for tier, bus_time in self.bus_times.items() if (interval := self.poll_intervals[tier])
+        )
 
-    def select_callback(self, *, client: Client, component: Select, old_state: str, new_state: str):
+    def due_poll_tiers(self) -> list[str]:
+        """Poll tiers that must be read in this cycle, the "static" ones until they were read"""
+        now = time.monotonic()
+        due = [tier for tier in self.address_ranges if self.next_poll.get(tier, 0) <= now]
+        for tier in due:
+            interval = self.poll_intervals[tier]
+            if interval is not None:
+                # Keep the cadence of the fixed-rate publish loop, a late cycle must not push the next poll back
+                next_poll = self.next_poll.get(tier, now) + interval
+                self.next_poll[tier] = next_poll if next_poll > now else now + interval
+        return due
+
+    def command_callback(self, *, client: Client, component: Switch | Select, old_state: str, new_state: str):
         """
-        Generic callback for select state changes.
+        Generic callback for switch and select state changes. Runs in the
+        MQTT network thread or, with the asyncio client, in the event loop:
+        The command is just handed over to a coroutine in the event loop.
         """
+        received = time.monotonic()
         logger.info(f'{component.name} state changed: {old_state!r} -> {new_state!r}')
+        run_in_loop(self.execute_command(component=component, new_state=new_state, received=received), self.loop)
 
-        # Find the address and options for this select
-        address = None
-        options = None
-        for addr, (select, select_options) in self.selects.items():
-            if select == component:
-                address = addr
-                options = select_options
-                break
-
-        if address is None or options is None:
-            logger.error(f'Could not find address or options for select {component.name}')
+    async def execute_command(self, *, component: Switch | Select, new_state: str, received: float):
+        """
+        Write the register before all waiting reads on the bus and read it back
+        right away. The read value is published as the confirmed state, so a
+        rejected write rolls the state in Home Assistant back.
+        """
+        address, values = self.commands[component.uid]
+        value = values.get(new_state)
+        if value is None:
+            logger.error(f'Could not find register value for {new_state!r} of {component.name}')
             return
 
-        # Convert display value to register value
-        value = None
-        for index, display_value in enumerate(options['values']):
-            if display_value == new_state:
-                value = options['keys'][index]
-                break
+        try:
+            response = await asyncio.wrap_future(
+                self.bus.write_register(slave_id=self.heat_pump.slave_id, address=address, value=value)
+            )
+        except Exception:
+            logger.exception(f'Failed to write register for {component.name}')
+        else:
+            if response.isError():
+                logger.error(f'Failed to write register for {component.name}: {response}')
 
-        if value is None:
-            logger.error(f'Could not find register value for display value {new_state}')
+        try:
+            response = await self.bus.run(self.read_register_block, address, 1, priority=ModbusBus.PRIORITY_WRITE)
+        except Exception:
+            logger.exception(f'Failed to read back register of {component.name}')
+            return
+        if response.isError():
+            logger.error(f'Failed to read back register of {component.name}: {response}')
             return
 
-        success = self.modbus_client.write_register(address=address, value=value, device_id=MODBUS_SLAVE_ID)
+        self.registers.update_block(address, response.registers)
+        for confirmed_component, state in self.decode_plan.decode(self.registers, (address,)):
+            confirmed_component.set_state(state)
+            if self.json_state is None:
+                self.change_filter.publish(confirmed_component, self.mqtt_client, force=True)
+        if self.json_state is not None:
+            self.json_state.publish(self.mqtt_client, force=True)
+        if component.state != new_state:
+            logger.warning(f'{component.name} is {component.state!r} after writing {new_state!r}')
+        self.command_latency.add(time.monotonic() - received)
+
+    def read_register_block(self, address: int, count: int):
+        return self.bus.client.read_holding_registers(address=address, count=count, device_id=self.heat_pump.slave_id)
+
+    async def read_heat_pump_register_blocks(self, tiers: list[str]) -> set[int]:
+        """In order to minimize Modbus communication the register
+        values are fetched in ranges that are planned initially from
+        definitions and then read in blocks (ranges). Blocks may
+        include some unused registers where this saves transactions.
+        Only the blocks of the given poll tiers are read. Every block
+        is a separate request to the bus, so other heat pumps on the
+        same bus can take their turn in between.
+        A block refused by the heat pump is bisected to learn the
+        illegal registers and the blocks are planned again without them.
+        Returns the addresses of all refreshed registers.
+        """
+        refreshed = set()
+        learned = []
+        for tier in tiers:
+            for address_start, address_end in self.address_ranges[tier]:
+                blocks, illegal = await self.bus.run(
+                    read_register_block_bisecting, self.read_register_block, address_start, address_end
+                )
+                for address, registers in blocks:
+                    self.registers.update_block(address, registers)
+                    refreshed.update(range(address, address + len(registers)))
+                learned += illegal
+        if learned:
+            learned = sorted(set(learned))
+            logger.warning(f'{self.device_name} refused to read registers {learned}')
+            self.illegal_registers.add(learned)
+            for address in learned:
+                self.registers.invalidate(address, 1)
+            self.plan_address_ranges()
+        if self.verbosity > 1:
+            logger.info(f'{self.device_name} registers: {self.registers}')
+        return refreshed
+
+    def decode_states(self, refreshed: set[int]) -> list[tuple[BaseComponent, object]]:
+        """The new states of all components of the refreshed registers"""
+        return list(self.decode_plan.decode(self.registers, refreshed))
+
+    def publish_states(self, states: list[tuple[BaseComponent, object]]) -> None:
+        """Set the states and publish the changed ones, or all of them as one JSON document"""
+        for component, state in states:
+            try:
+                component.set_state(state)
+            except InvalidStateValue as err:
+                logger.warning(f'{self.device_name}: Skip invalid state of {component.name}: {err}')
+                continue
+            if self.json_state is None:
+                self.change_filter.publish(component, self.mqtt_client)
+        if self.json_state is None:
+            self.change_filter.publish_heartbeats(self.mqtt_client)
+        elif states:
+            self.json_state.publish(self.mqtt_client)
+
+    def republish_states(self):
+        """Publish all known states again, e.g. after Home Assistant restarted"""
+        if self.json_state is not None:
+            self.json_state.publish(self.mqtt_client, force=True)
+            return
+        for component in self.get_components():
+            if component.state is not NO_STATE:
+                self.change_filter.publish(component, self.mqtt_client, force=True)
+
+    async def poll(self):
+        """Read the due registers and publish the changed states"""
+        tiers = self.due_poll_tiers()
+        refreshed = await self.read_heat_pump_register_blocks(tiers)
+        for tier in tiers:
+            if self.poll_intervals[tier] is None:
+                self.next_poll[tier] = math.inf  # Read once, a failed read is retried in the next cycle
+        self.publish_states(self.decode_states(refreshed))
+
+    def log_statistics(self):
+        publisher = self.change_filter if self.json_state is None else self.json_state
+        logger.debug(f'{self.device_name} published states: {publisher}')
+        if self.verbosity:
+            print(f'\n{self.device_name} published states: {publisher}', end='')
+        publisher.reset_counters()
+        if self.command_latency.count:
+            logger.info(f'{self.device_name} command to confirmed state latency: {self.command_latency}')
+            self.command_latency.reset()
 
-        if success:
-            component.set_state(new_state)
-            component.publish_state(client)
-        else:
-            logger.error(f'Failed to write register for {component.name}')
 
-    def ranges(self, i: list) -> list:
-        """Prepare intervals of modbus addresses for fetching register groups
-        See https://stackoverflow.com/questions/4628333
+class KronotermMqttHandler:
+    """
+    Publish all heat pumps of the settings to MQTT: Each heat pump runs its
+    own publish loop, the heat pumps on the same port share one Modbus bus.
+    """
+
+    def __init__(self, user_settings: UserSettings, verbosity: int, mqtt_client: Client | None = None):
+        self.user_settings = user_settings
+        self.verbosity = verbosity
+        self.heat_pumps = self.user_settings.get_heat_pumps()
+        if mqtt_client is None:
+            mqtt_client = get_connected_client(user_settings=user_settings, verbosity=verbosity, keep_trying=True)
+        self.mqtt_client = mqtt_client
+        if not isinstance(self.mqtt_client, AsyncioMqttClient):
+            self.mqtt_client.loop_start()  # The asyncio client is started in init_devices()
+        self.buses: dict[str, ModbusBus] = dict()  # Modbus connection of each port
+        self.heat_pump_handlers: list[HeatPumpHandler] = list()
+        self.event_loop_lag = RunningStats()
+        self.event_loop_lag_task: asyncio.Task | None = None
+        self.discovery = DiscoveryPublisher(self.mqtt_client, on_birth=self.request_discovery)
+        self.discovery_requested = False  # Set by the MQTT client, published before the states of the next cycle
+        self.expander: ExpanderMqttHandler | None = (
+            ExpanderMqttHandler(self.mqtt_client, user_settings, verbosity)
+            if self.user_settings.custom_expander.module_enabled
+            else None
+        )
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the context manager, cleaning up resources."""
+        if self.verbosity:
+            print('\nClosing MQTT and Modbus client.', end='...')
+
+        if self.expander:
+            self.expander.stop()
+            print('expander stopped', flush=True)
+
+        for bus in self.buses.values():
+            bus.close()
+
+        if self.mqtt_client:
+            self.mqtt_client.loop_stop()
+            self.mqtt_client.disconnect()
+
+        BaseMqttDevice.device_uids = set()  # Reset
+        BaseMqttDevice.components = {}  # Global registry of all components
+
+    async def init_devices(self):
+        if isinstance(self.mqtt_client, AsyncioMqttClient):
+            await self.mqtt_client.start()
+        self.buses = get_modbus_buses(self.heat_pumps, self.verbosity)
+        for heat_pump in self.heat_pumps:
+            logger.info(f'Publishing Home Assistant MQTT discovery for {heat_pump.device_name}')
+            handler = HeatPumpHandler(
+                heat_pump=heat_pump,
+                device_uid=heat_pump.device_uid or self.user_settings.mqtt.main_uid,
+                mqtt_client=self.mqtt_client,
+                bus=self.buses[heat_pump.port],
+                verbosity=self.verbosity,
+            )
+            handler.init_device()
+            if heat_pump.device_discovery:
+                self.discovery.add_device(handler.main_device)
+            self.heat_pump_handlers.append(handler)
+
+        for bus in self.buses.values():
+            bus_load = sum(handler.get_bus_load() for handler in self.heat_pump_handlers if handler.bus is bus)
+            print(f'{bus.name}: Estimated bus load {bus_load:.0%}')
+            if bus_load > 1:
+                logger.warning(f'{bus.name} is overloaded: Increase the pooling intervals or use slower "poll" tiers!')
+
+        if self.expander is not None:
+            # The expander is a sub-device of the first heat pump and controlled by its registers:
+            await self.expander.init_device(self.heat_pump_handlers[0].main_device)
+            if self.heat_pumps[0].device_discovery:
+                self.discovery.add_device(self.expander.mqtt_device)
+
+        if isinstance(self.mqtt_client, OutboxClient):
+            # Set before subscribing, the first connection may be made at any time:
+            self.mqtt_client.on_connected = self.mqtt_connected
+        self.discovery.publish()
+        self.discovery.subscribe()
+
+    def mqtt_connected(self):
+        """
+        Called after every (re-)connect: A clean session has lost all
+        subscriptions, or the broker was not reachable at start.
         """
-        for _, b in itertools.groupby(enumerate(i), lambda pair: pair[1] - pair[0]):
-            b = list(b)
-            yield b[0][1], b[-1][1]
+        self.discovery.subscribe()
+        self.request_discovery()  # Subscribes to the command topics again
 
-    def read_heat_pump_register_blocks(self):
-        """In order to minimize Modbus communication the register
-        values are fetched in ranges that are computed initially from
-        definitions and then read in blocks (ranges)
+    def request_discovery(self):
         """
-        for address_start, address_end in self.address_ranges:
-            count = address_end - address_start + 1
-            response = self.modbus_client.read_holding_registers(
-                address=address_start, count=count, device_id=MODBUS_SLAVE_ID
-            )
-            if isinstance(response, (ExceptionResponse, ModbusIOException)):
-                logger.error(f'Error: {response}')
-            else:
-                assert isinstance(response, ReadHoldingRegistersResponse), f'{response=}'
-                for i in range(count):
-                    value = response.registers[i]
-                    self.registers[address_start + i] = value - (value >> 15 << 16)  # Convert value to signed integer
-        if self.verbosity > 1:
-            logger.info(f'Registers: {self.registers}')
+        Home Assistant (re-)started or the MQTT connection was lost: Called in
+        the MQTT network thread or, with the asyncio client, in the event loop.
+        The publish loop sends the configs at the start of its next cycle, so
+        that no state of that cycle is published before the configs.
+        """
+        self.discovery_requested = True
+
+    async def publish_discovery(self):
+        """Publish the discovery configs and all states, Home Assistant may have lost them"""
+        self.discovery_requested = False
+        self.discovery.publish()
+        for handler in self.heat_pump_handlers:
+            handler.republish_states()
+        if self.expander is not None:
+            self.expander.republish_states()
 
     async def publish_loop(self):
         # setup_logging(verbosity=self.verbosity)
 
-        definitions = self.heat_pump.get_definitions(self.verbosity)
+        if not self.heat_pump_handlers:
+            await self.init_devices()
 
-        self.modbus_client = get_modbus_client(self.heat_pump, definitions, self.verbosity)
+        self.event_loop_lag_task = asyncio.create_task(measure_event_loop_lag(self.event_loop_lag))
 
-        logger.info(f'Publishing Home Assistant MQTT discovery for {self.device_name}')
+        print('Kronoterm to MQTT publish loop started...', flush=True)
+        await asyncio.gather(*(self.heat_pump_loop(handler) for handler in self.heat_pump_handlers))
 
-        if self.main_device is None:
-            await self.init_device()
+    async def update_expander(self, registers: RegisterSnapshot):
+        """Control the expander by the registers of the first heat pump"""
+        if self.expander is None:
+            return
+        if missing := [address for address in EXPANDER_REGISTERS if address not in registers]:
+            # Slower poll tiers may be read first in one of the next cycles:
+            logger.info(f'Expander waits for the first read of the registers {missing}')
+            return
+        try:
+            await self.expander.supervisor.run(
+                self.expander.update_sensors_and_control,
+                outside_temperature=0.1 * registers[2102],  # outside temperature
+                current_desired_dhw_temperature=0.1 * registers[2023],  # Current desired DHW temperature
+                additional_source_enabled=registers[2015] > 0,  # Additional source activated
+                loop_circulation_status=registers[2044] > 0,  # Loop 1 circulation pump status
+                # Loop 1 temperature offset in ECO mode
+                loop_temperature_offset_in_eco_mode=0.1 * registers[2046],
+                loop_operation_status_on_schedule=registers[2043],  # Loop 1 operation status on schedule
+                working_function=registers[2000],  # Heat pump heating=0, standby=5
+            )
+        except asyncio.CancelledError as e:
+            logger.warning(f'Expander update cancelled! {e}')
+            raise
 
-        print('Kronoterm to MQTT publish loop started...', flush=True)
-        while True:
-            self.read_heat_pump_register_blocks()
-            for address in self.sensors:
-                sensor, scale = self.sensors[address]
-                value = float(scale * Decimal(self.registers[address]))
-                sensor.set_state(value)
-                sensor.publish(self.mqtt_client)
-            for address in self.binary_sensors:
-                for bit, sensor in self.binary_sensors[address].items():
-                    value = self.registers[address]
-                    if bit is not None:
-                        value &= 1 << bit
-                    sensor.set_state(sensor.ON if value else sensor.OFF)
-                    sensor.publish(self.mqtt_client)
-            for address in self.enum_sensors:
-                sensor, options = self.enum_sensors[address]
-                value = self.registers[address]
-                for _index, key in enumerate(options['keys']):
-                    if value == key:
-                        break
-                sensor.set_state(options['values'][_index])
-                sensor.publish(self.mqtt_client)
-            for address, switch in self.switches.items():
-                switch.set_state(switch.ON if self.registers[address] else switch.OFF)
-                switch.publish(self.mqtt_client)
-                for address, (select, _) in self.selects.items():
-                    if address in self.registers and address in self.selects:
-                        _, options = self.selects[address]
-                        register_value = self.registers[address]
-                        # Convert register value to display value
-                        display_value = None
-                        for index, key in enumerate(options['keys']):
-                            if register_value == key:
-                                display_value = options['values'][index]
-                                break
-                        if display_value is not None:
-                            select.set_state(display_value)
-                            select.publish(self.mqtt_client)
-
-            if self.expander is not None:
-                try:
-                    await self.expander.update_sensors_and_control(
-                      outside_temperature=0.1 * self.registers[2102],  # outside temperature
-                      current_desired_dhw_temperature=0.1 * self.registers[2023],  # Current desired DHW temperature
-                      additional_source_enabled=self.registers[2015] > 0,  # Additional source activated
-                      loop_circulation_status=self.registers[2044] > 0,  # Loop 1 circulation pump status
-                      # Loop 1 temperature offset in ECO mode
-                      loop_temperature_offset_in_eco_mode=0.1 * self.registers[2046],
-                      loop_operation_status_on_schedule=self.registers[2043],  # Loop 1 operation status on schedule
-                      working_function=self.registers[2000],  # Heat pump heating=0, standby=5
-                    )
-                except asyncio.CancelledError as e:
-                    logger.warning(f'Expander update cancelled! {e}')
-                    raise
+    def log_mqtt_statistics(self):
+        if not isinstance(self.mqtt_client, OutboxClient):
+            return
+        statistics = self.mqtt_client.get_statistics()
+        if self.mqtt_client.dropped:
+            logger.warning(f'MQTT broker is too slow or disconnected: {statistics}')
+        else:
+            logger.debug(f'MQTT {statistics}')
+        if self.verbosity:
+            print(f'\nMQTT {statistics}', end='')
+        self.mqtt_client.reset_statistics()
 
+    async def heat_pump_loop(self, handler: HeatPumpHandler):
+        is_main = handler is self.heat_pump_handlers[0]
+        heat_pump = handler.heat_pump
+        scheduler = FixedRateScheduler(heat_pump.pooling_interval, catch_up=heat_pump.catch_up_missed_cycles)
+        while True:
+            if self.discovery_requested:
+                await self.publish_discovery()
+            # A failed Modbus link or heat pump is restarted in the background, the cycles are skipped until then:
+            polled = await handler.bus.run_slave(heat_pump.slave_id, handler.poll)
+            if isinstance(self.mqtt_client, AsyncioMqttClient):
+                # Flow control: Send the states of this cycle before the next one is read
+                await self.mqtt_client.drain(timeout=heat_pump.pooling_interval)
+
+            if is_main:
+                if polled:  # Don't control the expander by outdated registers
+                    await self.update_expander(handler.registers)
+                logger.debug(f'Event loop lag: {self.event_loop_lag}')
+                if self.verbosity:
+                    print(f'\nEvent loop lag: {self.event_loop_lag}', end='')
+                self.event_loop_lag.reset()
+                self.log_mqtt_statistics()
+            handler.log_statistics()
+
+            logger.debug(f'{handler.device_name} publish loop: {scheduler}')
             if self.verbosity:
+                print(f'\n{handler.device_name} publish loop: {scheduler}', end='')
                 print('\nWait', end='...', flush=True)
-                for i in range(self.user_settings.heat_pump.pooling_interval, 0, -1):
-                    await asyncio.sleep(1)
-                    print(i, end='...', flush=True)
-            else:
-                await asyncio.sleep(self.user_settings.heat_pump.pooling_interval)
+            await scheduler.wait()
@@ -0,0 +1,134 @@
+from collections.abc import Callable
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
+
+from kronoterm2mqtt.constants import MQTT_MAX_INFLIGHT, MQTT_MAX_PENDING
+from kronoterm2mqtt.timing import RunningStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxClient(mqtt.Client):
+    """
+    MQTT client that hands only a few messages at once to paho. While the
+    broker is disconnected or slow, the messages wait in an outbox that keeps
+    only the newest payload of each topic, so memory is bounded and no stale
+    states are replayed: After an outage, the current values are sent in one burst.
+
+    The components publish from the event loop thread, while paho confirms
+    written messages in its network thread, so the outbox is guarded by a lock.
+    paho is called outside of the lock, so a newer message of a topic that is
+    being handed to paho waits in the outbox and can't overtake the older one.
+    """
+
+    def __init__(self, *args, max_inflight: int = MQTT_MAX_INFLIGHT, max_pending: int = MQTT_MAX_PENDING, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox_max_inflight = max_inflight
+        self.outbox_max_pending = max_pending
+        self.outbox_lock = threading.Lock()
+        self.inflight: dict[int, float] = dict()  # mid -> time of the publish() call
+        self.early_published: set[int] = set()  # mids confirmed before publish() returned
+        self.pending: dict[str, tuple] = dict()  # topic -> (payload, qos, retain, properties, time of publish())
+        self.sending: set[str] = set()  # Topics being handed to paho
+        self.dropped = 0  # Payloads replaced by a newer one or lost by a disconnect
+        self.max_depth = 0
+        self.latency = RunningStats()  # From the publish() call until paho has sent the message
+        self.on_publish = self.message_published
+        self.on_connected: Callable[[], None] | None = None  # Called after every (re-)connect in the network thread
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> MQTTMessageInfo:
+        message = (payload, qos, retain, properties, time.monotonic())
+        with self.outbox_lock:
+            if (
+                topic in self.pending
+                or topic in self.sending
+                or not self.is_connected()
+                or len(self.inflight) >= self.outbox_max_inflight
+            ):
+                self.enqueue(topic, message)
+                return MQTTMessageInfo(0)
+            self.sending.add(topic)
+        return self.send(topic, message)
+
+    def enqueue(self, topic: str, message: tuple) -> None:
+        """Keep only the newest message of the topic in the outbox, must be called with the lock held"""
+        if topic in self.pending:
+            self.dropped += 1
+        elif len(self.pending) >= self.outbox_max_pending:
+            del self.pending[next(iter(self.pending))]  # The oldest topic
+            self.dropped += 1
+        self.pending[topic] = message
+        self.max_depth = max(self.max_depth, len(self.pending))
+
+    def send(self, topic: str, message: tuple) -> MQTTMessageInfo:
+        """Hand the message to paho, the topic must be added to `sending` with the lock held before"""
+        payload, qos, retain, properties, published = message
+        info = super().publish(topic, payload, qos, retain, properties)
+        with self.outbox_lock:
+            self.sending.discard(topic)
+            newer = topic in self.pending  # Published while this message was handed to paho
+            if info.rc != MQTT_ERR_SUCCESS:  # e.g. disconnected in the meantime
+                self.early_published.discard(info.mid)
+                if topic not in self.pending:
+                    self.enqueue(topic, message)
+            elif info.mid in self.early_published:
+                self.early_published.remove(info.mid)
+                self.latency.add(time.monotonic() - published)
+            else:
+                self.inflight[info.mid] = published
+        if newer:
+            self.flush()
+        return info
+
+    def flush(self) -> None:
+        """Hand the waiting messages to paho, as far as the in-flight limit allows"""
+        with self.outbox_lock:
+            if not self.is_connected():
+                return
+            count = max(self.outbox_max_inflight - len(self.inflight), 0)
+            topics = [topic for topic in self.pending if topic not in self.sending][:count]
+            messages = [(topic, self.pending.pop(topic)) for topic in topics]
+            self.sending.update(topics)
+        for topic, message in messages:
+            self.send(topic, message)
+
+    def message_published(self, client, userdata, mid: int, reason_code, properties) -> None:
+        """paho callback: The message is sent (QoS 0) or acknowledged by the broker"""
+        with self.outbox_lock:
+            if (published := self.inflight.pop(mid, None)) is None:
+                self.early_published.add(mid)
+            else:
+                self.latency.add(time.monotonic() - published)
+        self.flush()
+
+    def connected(self) -> None:
+        """
+        Called after every (re-)connect: The messages in flight are lost with
+        the old connection, the waiting ones are sent now.
+        """
+        with self.outbox_lock:
+            if self.inflight:
+                logger.info(f'{len(self.inflight)} MQTT messages lost by the reconnect')
+                self.dropped += len(self.inflight)
+                self.inflight.clear()
+            self.early_published.clear()
+        self.flush()
+        if self.on_connected:
+            self.on_connected()
+
+    def get_statistics(self) -> str:
+        return (
+            f'outbox depth {len(self.pending)} (max {self.max_depth}), {len(self.inflight)} in flight,'
+            f' {self.dropped} dropped, publish latency {self.latency}'
+        )
+
+    def reset_statistics(self) -> None:
+        with self.outbox_lock:
+            self.dropped = 0
+            self.max_depth = len(self.pending)
+            self.latency.reset()
@@ -0,0 +1,125 @@
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+import logging
+
+from pymodbus.client import ModbusSerialClient
+from pymodbus.exceptions import ModbusException
+
+from kronoterm2mqtt.constants import BASE_PATH, DEFINITION_SECTIONS, MODBUS_SLAVE_ID, PROBE_TIMEOUT
+from kronoterm2mqtt.register_blocks import is_illegal_register_response
+from kronoterm2mqtt.user_settings import HeatPump
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class ProbeResult:
+    port: str
+    connection: dict | None = None  # Serial settings the heat pump answered with
+    definitions_name: str | None = None  # Definitions whose identification register could be read
+    error: str = ''
+
+    def __str__(self):
+        if not self.connection:
+            return f'{self.port}: {self.error}'
+        speed = '{baudrate} baud {bytesize}{parity}{stopbits}'.format(**self.connection)
+        if not self.definitions_name:
+            return f'{self.port}: {speed}, {self.error}'
+        return f'{self.port}: {speed}, definitions_name = {self.definitions_name!r}'
+
+
+def get_bundled_definitions() -> dict[str, dict]:
+    """All definitions files of kronoterm2mqtt/definitions/ by name"""
+    return {
+        path.stem: HeatPump(definitions_name=path.stem).get_definitions(verbosity=0)
+        for path in sorted((BASE_PATH / 'definitions').glob('*.toml'))
+    }
+
+
+def get_identification_address(definitions: dict) -> int:
+    """
+    The lowest (zero-based) register of the entities: One read of it is
+    enough to check if a device with the definitions answers.
+
+    >>> get_identification_address({'sensor': [{'register': 2014}], 'switch': [{'register': 2002}]})
+    2001
+    """
+    registers = [parameter['register'] for section in DEFINITION_SECTIONS for parameter in definitions.get(section, ())]
+    return min(registers) - 1  # KRONOTERM MA_numbering is one-based in documentation!
+
+
+def get_probe_candidates(all_definitions: dict[str, dict]) -> list[tuple[dict, list[tuple[str, int]]]]:
+    """
+    The distinct serial settings of the definitions, each with the
+    (definitions name, identification address) pairs using them.
+
+    >>> get_probe_candidates({
+    ...     'a': {'connection': {'baudrate': 19200}, 'sensor': [{'register': 2001}]},
+    ...     'b': {'connection': {'baudrate': 115200}, 'sensor': [{'register': 2014}]},
+    ...     'c': {'connection': {'baudrate': 19200}, 'sensor': [{'register': 2100}]},
+    ... })
+    [({'baudrate': 19200}, [('a', 2000), ('c', 2099)]), ({'baudrate': 115200}, [('b', 2013)])]
+    """
+    candidates = []
+    for name, definitions in all_definitions.items():
+        identification = (name, get_identification_address(definitions))
+        for connection, names in candidates:
+            if connection == definitions['connection']:
+                names.append(identification)
+                break
+        else:
+            candidates.append((definitions['connection'], [identification]))
+    return candidates
+
+
+def probe_port(
+    port: str,
+    candidates: list[tuple[dict, list[tuple[str, int]]]],
+    slave_id: int = MODBUS_SLAVE_ID,
+    timeout: float = PROBE_TIMEOUT,
+    client_class: Callable = ModbusSerialClient,
+) -> ProbeResult:
+    """
+    Try the serial settings of the candidates one after another with a
+    single register read, until the heat pump answers.
+    A device refusing the identification register answers with the right
+    settings, so the other definitions with the same settings are tried.
+    """
+    result = ProbeResult(port, error='no response')
+    for connection, identifications in candidates:
+        client = client_class(port, **connection, timeout=timeout, retries=0)
+        try:
+            if not client.connect():
+                return ProbeResult(port, error='can not open port')
+            for definitions_name, address in identifications:
+                try:
+                    response = client.read_holding_registers(address=address, count=1, device_id=slave_id)
+                except ModbusException as err:
+                    logger.debug(f'{port} {connection}: {err}')
+                    break  # No answer with these settings
+                if not response.isError():
+                    return ProbeResult(port, connection, definitions_name)
+                if is_illegal_register_response(response):
+                    result = ProbeResult(port, connection, error='no definitions match')
+                else:
+                    logger.debug(f'{port} {connection}: {response}')
+                    break
+        finally:
+            client.close()
+    return result
+
+
+def probe_ports(
+    ports: list[str],
+    candidates: list[tuple[dict, list[tuple[str, int]]]],
+    slave_id: int = MODBUS_SLAVE_ID,
+    timeout: float = PROBE_TIMEOUT,
+    client_class: Callable = ModbusSerialClient,
+) -> list[ProbeResult]:
+    """Probe all ports at the same time, so it takes as long as probing the slowest port"""
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        return list(executor.map(lambda port: probe_port(port, candidates, slave_id, timeout, client_class), ports))
@@ -0,0 +1,91 @@
+import logging
+import time
+
+from ha_services.mqtt4homeassistant.components import BaseComponent
+from paho.mqtt.client import Client
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_deadband(parameter: dict) -> float:
+    """
+    Deadband of an entity from the definitions: Either absolute in the unit
+    of the sensor with "deadband" or as multiple of the "scale" with "deadband_steps".
+
+    >>> get_deadband({'scale': 0.1, 'deadband': 0.5})
+    0.5
+    >>> get_deadband({'scale': 0.5, 'deadband_steps': 3})
+    1.5
+    >>> get_deadband({'scale': 0.1})
+    0.0
+    """
+    if 'deadband' in parameter:
+        return float(parameter['deadband'])
+    return parameter.get('deadband_steps', 0) * float(parameter.get('scale', 1))
+
+
+class ChangeFilter:
+    """
+    Publish component states only if they changed more than the deadband of
+    the component since the last publish or if the last publish is older than
+    the heartbeat. Counts sent and suppressed states of the current cycle.
+    """
+
+    def __init__(self, heartbeat: float):
+        self.heartbeat = heartbeat
+        self.deadbands: dict[str, float] = dict()
+        self.published: dict[str, tuple[object, float]] = dict()  # uid -> (state, monotonic time)
+        self.components: dict[str, BaseComponent] = dict()  # uid -> component of the published states
+        self.sent = 0
+        self.suppressed = 0
+
+    def set_deadband(self, component: BaseComponent, deadband: float) -> None:
+        self.deadbands[component.uid] = deadband
+
+    def is_changed(self, component: BaseComponent, last_state) -> bool:
+        deadband = self.deadbands.get(component.uid, 0.0)
+        if deadband and isinstance(component.state, (int, float)) and isinstance(last_state, (int, float)):
+            return abs(component.state - last_state) > deadband
+        return component.state != last_state
+
+    def publish(self, component: BaseComponent, client: Client, force: bool = False) -> bool:
+        """
+        Publish the state of the component if needed. Returns True if the state was sent.
+        With `force` the state is sent right away, e.g. to confirm a command.
+        """
+        now = time.monotonic()
+        if force:
+            component._next_publish = 0  # Bypass the state throttling of the component
+        elif last := self.published.get(component.uid):
+            last_state, last_time = last
+            if now - last_time < self.heartbeat and not self.is_changed(component, last_state):
+                self.suppressed += 1
+                return False
+
+        state_info = component.publish_state(client)
+        if state_info is None:  # throttled by the component itself or no state set yet
+            self.suppressed += 1
+            return False
+
+        self.published[component.uid] = (component.state, now)
+        self.components[component.uid] = component
+        self.sent += 1
+        return True
+
+    def publish_heartbeats(self, client: Client) -> None:
+        """
+        Publish the states again whose last publish is older than the heartbeat,
+        also of components not decoded in this cycle, e.g. of a slower poll tier.
+        """
+        now = time.monotonic()
+        for uid, (last_state, last_time) in list(self.published.items()):
+            if now - last_time >= self.heartbeat:
+                self.publish(self.components[uid], client)
+
+    def reset_counters(self) -> None:
+        self.sent = 0
+        self.suppressed = 0
+
+    def __str__(self):
+        return f'{self.sent} sent, {self.suppressed} suppressed'
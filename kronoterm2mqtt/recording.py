@@ -0,0 +1,208 @@
+import bisect
+from collections.abc import Iterator
+import dataclasses
+import itertools
+import logging
+from pathlib import Path
+import struct
+import time
+
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse, WriteSingleRegisterResponse
+
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'KT2MQTT-REC1\n'
+# Unix time, slave id, address, number of registers, Modbus exception code (0 = no error):
+RECORD_HEADER = struct.Struct('<dBHHB')
+READ_HOLDING_REGISTERS = 0x03
+SLAVE_DEVICE_FAILURE = 0x04
+
+
+@dataclasses.dataclass(frozen=True)
+class Frame:
+    """One recorded response of "read holding registers" """
+
+    timestamp: float
+    slave_id: int
+    address: int
+    count: int
+    registers: tuple[int, ...] = ()  # Empty for exception responses
+    exception_code: int = 0
+
+    def covers(self, address: int, count: int) -> bool:
+        return self.address <= address and address + count <= self.address + self.count
+
+    def to_bytes(self) -> bytes:
+        header = RECORD_HEADER.pack(self.timestamp, self.slave_id, self.address, self.count, self.exception_code)
+        return header + struct.pack(f'<{len(self.registers)}H', *self.registers)
+
+
+def iter_frames(file_path: Path) -> Iterator[Frame]:
+    """
+    Read all frames of a recording.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as temp_dir:
+    ...     file_path = Path(temp_dir) / 'test.rec'
+    ...     with FrameWriter(file_path) as writer:
+    ...         writer.write(Frame(timestamp=1.5, slave_id=20, address=2000, count=3, registers=(1, 2, 65535)))
+    ...         writer.write(Frame(timestamp=2.5, slave_id=20, address=2110, count=8, exception_code=2))
+    ...     list(iter_frames(file_path))  # doctest: +NORMALIZE_WHITESPACE
+    [Frame(timestamp=1.5, slave_id=20, address=2000, count=3, registers=(1, 2, 65535), exception_code=0),
+     Frame(timestamp=2.5, slave_id=20, address=2110, count=8, registers=(), exception_code=2)]
+    """
+    data = file_path.read_bytes()
+    if not data.startswith(FILE_MAGIC):
+        raise ValueError(f'{file_path} is not a Modbus recording')
+    offset = len(FILE_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, slave_id, address, count, exception_code = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        length = 0 if exception_code else count
+        if offset + 2 * length > len(data):
+            logger.warning(f'Truncated last frame in {file_path}')
+            break
+        registers = struct.unpack_from(f'<{length}H', data, offset)
+        offset += 2 * length
+        yield Frame(timestamp, slave_id, address, count, registers, exception_code)
+
+
+class FrameWriter:
+    """Append frames to a recording file, creating it if needed"""
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        self.file = file_path.open('ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+
+    def write(self, frame: Frame) -> None:
+        self.file.write(frame.to_bytes())
+        self.file.flush()  # Keep the recording usable, even if the process is killed
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordingClient:
+    """
+    Wraps a pymodbus client and appends every "read holding registers"
+    response to a recording file. Everything else goes to the client as is.
+    """
+
+    def __init__(self, client, file_path: Path):
+        self.client = client
+        self.writer = FrameWriter(file_path)
+        logger.info(f'Record Modbus responses to {file_path}')
+
+    def read_holding_registers(self, *, address: int, count: int, device_id: int):
+        response = self.client.read_holding_registers(address=address, count=count, device_id=device_id)
+        if isinstance(response, ExceptionResponse):
+            frame = Frame(time.time(), device_id, address, count, exception_code=response.exception_code)
+        elif isinstance(response, ReadHoldingRegistersResponse):
+            frame = Frame(time.time(), device_id, address, count, tuple(response.registers))
+        else:  # e.g. ModbusIOException on timeouts
+            return response
+        self.writer.write(frame)
+        return response
+
+    def connect(self) -> bool:
+        if self.writer.file.closed:  # Reopened after close(), e.g. by the supervisor of the Modbus link
+            self.writer = FrameWriter(self.writer.file_path)
+        return self.client.connect()
+
+    def close(self) -> None:
+        self.writer.close()
+        self.client.close()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class ReplayModbusClient:
+    """
+    Serves the responses of a recording instead of a heat pump. A request is
+    answered with the last frame recorded at the replay time that covers the
+    requested registers, so other read blocks (e.g. changed definitions) work
+    as long as the recording contains the registers. The replay time runs
+    `speed` times faster than real time, with speed 0 every request gets the
+    next frame, as fast as possible. At the end of the recording, the last
+    frames (speed > 0) or again the first frames (speed 0) are served.
+    Writes are acknowledged and served by later reads.
+    """
+
+    def __init__(self, file_path: Path, speed: float = 1.0):
+        self.file_path = file_path
+        self.speed = speed
+        self.frames: dict[int, list[Frame]] = dict()  # slave id -> frames in recorded order
+        for frame in iter_frames(file_path):
+            self.frames.setdefault(frame.slave_id, []).append(frame)
+        if not self.frames:
+            raise ValueError(f'No frames in {file_path}')
+        self.first_timestamp = min(frames[0].timestamp for frames in self.frames.values())
+        self.timestamps = {slave_id: [frame.timestamp for frame in frames] for slave_id, frames in self.frames.items()}
+        self.started: float | None = None
+        self.positions: dict[tuple[int, int, int], int] = dict()  # Next frame index of requests if speed is 0
+        self.written: dict[tuple[int, int], int] = dict()
+        logger.info(f'Replay {sum(map(len, self.frames.values()))} frames from {file_path} with speed {speed}')
+
+    def connect(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def replay_time(self) -> float:
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        return self.first_timestamp + (now - self.started) * self.speed
+
+    def find_frame(self, slave_id: int, address: int, count: int) -> Frame | None:
+        """
+        The frame that covers the requested registers: The last one before the
+        replay time or, with speed 0, the next one of this request. Responses
+        are preferred over recorded exceptions.
+        """
+        frames = self.frames.get(slave_id, [])
+        if self.speed:
+            index = bisect.bisect_right(self.timestamps.get(slave_id, []), self.replay_time()) - 1
+            order = itertools.chain(range(index, -1, -1), range(index + 1, len(frames)))
+        else:
+            index = self.positions.get((slave_id, address, count), 0)
+            order = itertools.chain(range(index, len(frames)), range(index))  # Start over at the end
+        found = None
+        for index in order:
+            frame = frames[index]
+            if frame.covers(address, count) and (found is None or not frame.exception_code):
+                found = index
+                if not frame.exception_code:
+                    break
+        if found is None:
+            return None
+        self.positions[(slave_id, address, count)] = found + 1
+        return frames[found]
+
+    def read_holding_registers(self, *, address: int, count: int, device_id: int):
+        frame = self.find_frame(device_id, address, count)
+        if frame is None:
+            return ExceptionResponse(READ_HOLDING_REGISTERS, SLAVE_DEVICE_FAILURE)
+        if frame.exception_code:
+            return ExceptionResponse(READ_HOLDING_REGISTERS, frame.exception_code)
+        start = address - frame.address
+        registers = list(frame.registers[start : start + count])
+        for index in range(count):
+            registers[index] = self.written.get((device_id, address + index), registers[index])
+        return ReadHoldingRegistersResponse(registers=registers)
+
+    def write_register(self, *, address: int, value: int, device_id: int):
+        self.written[(device_id, address)] = value
+        return WriteSingleRegisterResponse(address=address, registers=[value])
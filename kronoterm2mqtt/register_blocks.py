@@ -0,0 +1,214 @@
+import bisect
+from collections.abc import Callable, Iterable
+import dataclasses
+import json
+import logging
+import math
+from pathlib import Path
+
+from pymodbus.pdu import ExceptionResponse
+
+from kronoterm2mqtt.constants import (
+    MODBUS_ILLEGAL_REGISTER_EXCEPTION_CODES,
+    MODBUS_MAX_READ_REGISTERS,
+    MODBUS_RTU_FRAME_GAP_CHARS,
+    MODBUS_RTU_READ_REQUEST_BYTES,
+    MODBUS_RTU_READ_RESPONSE_BYTES,
+    MODBUS_TRANSACTION_SECONDS,
+    MODBUS_TURNAROUND_SECONDS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_rtu_char_time(connection: dict) -> float:
+    """
+    Seconds to transfer one character on the serial line: start bit, data bits, optional parity bit and stop bits.
+
+    >>> round(get_rtu_char_time(dict(baudrate=19200, bytesize=8, parity='E', stopbits=1)) * 1000, 3)
+    0.573
+    """
+    bits_per_char = 1 + connection['bytesize'] + (connection['parity'] != 'N') + connection['stopbits']
+    return bits_per_char / connection['baudrate']
+
+
+@dataclasses.dataclass(frozen=True)
+class BusCost:
+    """
+    Simple cost model of one Modbus "read holding registers" transaction:
+    a fixed price per request plus a price for every register in the response.
+    """
+
+    transaction: float  # seconds per request, regardless of its size
+    register: float  # seconds per transferred register
+
+    @classmethod
+    def for_serial(cls, connection: dict) -> 'BusCost':
+        """
+        Derive the cost from the serial line settings of the definitions: The
+        on-wire time of the RTU request and response frames, including the
+        silent intervals after them, plus the turnaround time of the heat pump.
+
+        >>> cost = BusCost.for_serial(dict(baudrate=19200, bytesize=8, parity='N', stopbits=1))
+        >>> round(cost.transaction * 1000, 2), round(cost.register * 1000, 3)
+        (30.42, 1.042)
+        >>> cost = BusCost.for_serial(dict(baudrate=115200, bytesize=8, parity='N', stopbits=1))
+        >>> round(cost.transaction * 1000, 2), round(cost.register * 1000, 3)
+        (21.74, 0.174)
+        """
+        char_time = get_rtu_char_time(connection)
+        frame_chars = MODBUS_RTU_READ_REQUEST_BYTES + MODBUS_RTU_READ_RESPONSE_BYTES + 2 * MODBUS_RTU_FRAME_GAP_CHARS
+        return cls(transaction=MODBUS_TURNAROUND_SECONDS + frame_chars * char_time, register=2 * char_time)
+
+    @classmethod
+    def for_tcp(cls) -> 'BusCost':
+        return cls(transaction=MODBUS_TRANSACTION_SECONDS, register=0.0)
+
+    def block_time(self, count: int) -> float:
+        return self.transaction + count * self.register
+
+
+def plan_register_blocks(
+    addresses: Iterable[int],
+    cost: BusCost,
+    max_count: int = MODBUS_MAX_READ_REGISTERS,
+    excluded: Iterable[int] = (),
+) -> list[tuple[int, int]]:
+    """
+    Group register addresses into (first, last) blocks for Modbus reads.
+    Unused registers in a gap are read as well, when this is cheaper than
+    an additional transaction. The result has the minimal estimated bus
+    time, where no block is larger than `max_count` registers and no block
+    contains an `excluded` (illegal) address.
+
+    >>> cost = BusCost(transaction=0.03, register=0.001)
+    >>> plan_register_blocks([2000, 2001, 2005, 2100, 2101], cost)
+    [(2000, 2005), (2100, 2101)]
+    >>> plan_register_blocks([2000, 2001, 2005, 2100, 2101], cost, max_count=4)
+    [(2000, 2001), (2005, 2005), (2100, 2101)]
+    >>> plan_register_blocks([2000, 2001, 2005, 2100, 2101], cost, excluded=[2003, 2101])
+    [(2000, 2001), (2005, 2005), (2100, 2100)]
+    """
+    excluded = sorted(set(excluded))
+    addresses = sorted(set(addresses).difference(excluded))
+    best = [0.0] + [math.inf] * len(addresses)  # minimal time to read first n addresses
+    block_start = [0] * (len(addresses) + 1)
+    for end in range(1, len(addresses) + 1):
+        last_address = addresses[end - 1]
+        index = bisect.bisect_left(excluded, last_address)
+        excluded_below = excluded[index - 1] if index else -1  # Nearest excluded address before the last one
+        for begin in range(end - 1, -1, -1):
+            count = last_address - addresses[begin] + 1
+            if count > max_count or addresses[begin] < excluded_below:
+                break
+            total = best[begin] + cost.block_time(count)
+            if total < best[end]:
+                best[end] = total
+                block_start[end] = begin
+
+    blocks = []
+    end = len(addresses)
+    while end:
+        begin = block_start[end]
+        blocks.append((addresses[begin], addresses[end - 1]))
+        end = begin
+    blocks.reverse()
+    return blocks
+
+
+def estimate_bus_time(blocks: list[tuple[int, int]], cost: BusCost) -> float:
+    """Estimated seconds needed to read all blocks"""
+    return sum(cost.block_time(last - first + 1) for first, last in blocks)
+
+
+def stagger_poll_tiers(bus_times: dict[str, float], budget: float) -> dict[str, int]:
+    """
+    Offsets in cycles for the first read of each poll tier, so that the
+    tiers read in the same cycle fit into the budget (the pooling interval).
+    The first tier is read in every cycle, the others are placed into the
+    first cycle where they fit or, if they never fit, into a cycle of their own.
+
+    >>> stagger_poll_tiers({'fast': 4.0, 'normal': 3.0, 'slow': 5.0, 'static': 2.0}, budget=10.0)
+    {'fast': 0, 'normal': 0, 'slow': 1, 'static': 0}
+    >>> stagger_poll_tiers({'fast': 4.0, 'normal': 7.0, 'slow': 7.0}, budget=10.0)
+    {'fast': 0, 'normal': 1, 'slow': 2}
+    """
+    (first_tier, first_time), *other_tiers = bus_times.items()
+    cycle_times = [first_time]
+    offsets = {first_tier: 0}
+    for tier, bus_time in other_tiers:
+        offset = next(
+            (offset for offset, cycle_time in enumerate(cycle_times) if cycle_time + bus_time <= budget),
+            None,
+        )
+        if offset is None:
+            offset = len(cycle_times)
+            cycle_times.append(first_time)
+        cycle_times[offset] += bus_time
+        offsets[tier] = offset
+    return offsets
+
+
+def is_illegal_register_response(response) -> bool:
+    """Is the response an exception because of an illegal (not supported) register address?"""
+    return (
+        isinstance(response, ExceptionResponse) and response.exception_code in MODBUS_ILLEGAL_REGISTER_EXCEPTION_CODES
+    )
+
+
+def read_register_block_bisecting(
+    read: Callable, first: int, last: int
+) -> tuple[list[tuple[int, list[int]]], list[int]]:
+    """
+    Read the registers from `first` to `last` with `read(address, count)`.
+    If the device refuses the block with an illegal address exception, the
+    block is bisected until all readable parts are read and the illegal
+    addresses are found. Returns the read (address, registers) blocks and
+    the illegal addresses. Other errors (e.g. timeouts) are only logged.
+    """
+    blocks = []
+    illegal = []
+    pending = [(first, last)]
+    while pending:
+        first, last = pending.pop()
+        response = read(first, last - first + 1)
+        if is_illegal_register_response(response):
+            if first == last:
+                illegal.append(first)
+            else:
+                middle = (first + last) // 2
+                pending.extend(((middle + 1, last), (first, middle)))  # Lower half first
+        elif response.isError():
+            logger.error(f'Error: {response}')
+        else:
+            blocks.append((first, response.registers))
+    return blocks, illegal
+
+
+class IllegalRegisters:
+    """
+    Register addresses the heat pump firmware refuses to read. They are
+    learned while reading and stored in a JSON file, so the block planner
+    can avoid them right from the start of the next run. Remove the file
+    to learn them again, e.g. after a firmware update.
+    """
+
+    def __init__(self, file_path: Path | None = None):
+        self.file_path = file_path
+        self.addresses: set[int] = set()
+        if file_path is not None and file_path.is_file():
+            self.addresses = set(json.loads(file_path.read_text(encoding='UTF-8')))
+            logger.info(f'Loaded {len(self.addresses)} illegal registers from {file_path}')
+
+    def __contains__(self, address: int) -> bool:
+        return address in self.addresses
+
+    def __iter__(self):
+        return iter(sorted(self.addresses))
+
+    def add(self, addresses: Iterable[int]) -> None:
+        self.addresses.update(addresses)
+        if self.file_path is not None:
+            self.file_path.write_text(json.dumps(sorted(self.addresses)), encoding='UTF-8')
+            logger.info(f'Stored {len(self.addresses)} illegal registers to {self.file_path}')
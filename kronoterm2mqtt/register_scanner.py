@@ -0,0 +1,111 @@
+from collections.abc import Callable
+import csv
+import dataclasses
+import json
+import logging
+from pathlib import Path
+
+from kronoterm2mqtt.constants import MODBUS_MAX_READ_REGISTERS
+from kronoterm2mqtt.register_blocks import read_register_block_bisecting
+
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ('address', 'hex', 'value', 'status')
+
+
+@dataclasses.dataclass
+class RegisterScan:
+    """
+    Map all readable registers of an address range with as few requests as
+    possible: The range is read in blocks of the maximum size and only the
+    blocks refused with an illegal address exception are bisected.
+    The scan can be saved (CSV or JSON) and continued later: Only the
+    addresses that are neither read nor known as illegal are scanned again,
+    e.g. after a timeout or when the scan was interrupted.
+    """
+
+    values: dict[int, int] = dataclasses.field(default_factory=dict)  # address -> register value
+    illegal: set[int] = dataclasses.field(default_factory=set)
+    requests: int = dataclasses.field(default=0, compare=False)  # Modbus requests of the scans
+
+    def get_unknown_blocks(self, first: int, last: int, max_count: int = MODBUS_MAX_READ_REGISTERS):
+        """
+        (first, last) blocks of the addresses that are not scanned yet.
+
+        >>> scan = RegisterScan(values={2: 0, 3: 0}, illegal={7})
+        >>> scan.get_unknown_blocks(0, 12, max_count=4)
+        [(0, 1), (4, 6), (8, 11), (12, 12)]
+        """
+        blocks = []
+        for address in range(first, last + 1):
+            if address in self.values or address in self.illegal:
+                continue
+            if blocks and blocks[-1][1] == address - 1 and address - blocks[-1][0] < max_count:
+                blocks[-1] = (blocks[-1][0], address)
+            else:
+                blocks.append((address, address))
+        return blocks
+
+    def scan(
+        self,
+        read: Callable,
+        first: int,
+        last: int,
+        max_count: int = MODBUS_MAX_READ_REGISTERS,
+        on_block: Callable | None = None,
+    ) -> None:
+        """
+        Scan the unknown registers from `first` to `last` with `read(address, count)`.
+        `on_block(scan)` is called after each block, e.g. to save the progress.
+        """
+
+        def counting_read(address: int, count: int):
+            self.requests += 1
+            return read(address, count)
+
+        for block_first, block_last in self.get_unknown_blocks(first, last, max_count):
+            blocks, illegal = read_register_block_bisecting(counting_read, block_first, block_last)
+            for address, registers in blocks:
+                self.values.update(zip(range(address, address + len(registers)), registers))
+            self.illegal.update(illegal)
+            if on_block:
+                on_block(self)
+
+    def save(self, file_path: Path) -> None:
+        """Store as CSV or JSON, depending on the file suffix"""
+        addresses = sorted(self.values.keys() | self.illegal)
+        temp_path = file_path.with_name(f'{file_path.name}.tmp')  # Keep the last complete file on interrupts
+        if file_path.suffix == '.csv':
+            with temp_path.open('w', newline='', encoding='UTF-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_FIELDS)
+                for address in addresses:
+                    if address in self.values:
+                        writer.writerow((address, f'{address:04x}', self.values[address], 'ok'))
+                    else:
+                        writer.writerow((address, f'{address:04x}', '', 'illegal'))
+        else:
+            data = dict(
+                values={str(address): value for address, value in sorted(self.values.items())},
+                illegal=sorted(self.illegal),
+            )
+            temp_path.write_text(json.dumps(data, indent=2), encoding='UTF-8')
+        temp_path.replace(file_path)
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'RegisterScan':
+        scan = cls()
+        if file_path.suffix == '.csv':
+            with file_path.open(newline='', encoding='UTF-8') as file:
+                for row in csv.DictReader(file):
+                    if row['status'] == 'ok':
+                        scan.values[int(row['address'])] = int(row['value'])
+                    else:
+                        scan.illegal.add(int(row['address']))
+        else:
+            data = json.loads(file_path.read_text(encoding='UTF-8'))
+            scan.values = {int(address): value for address, value in data['values'].items()}
+            scan.illegal = set(data['illegal'])
+        logger.info(f'Loaded {len(scan.values)} registers and {len(scan.illegal)} illegal addresses from {file_path}')
+        return scan
@@ -0,0 +1,65 @@
+from array import array
+from collections.abc import Iterator, Mapping
+
+
+class RegisterSnapshot(Mapping):
+    """
+    Last read values of the holding registers from `first` to `last` (inclusive),
+    stored as signed 16-bit integers in one compact array. Each read block is
+    converted to signed at once by reinterpreting the unsigned words, not one
+    Python int at a time. A validity mask tells read values from missing ones,
+    missing registers are not part of the mapping.
+
+    >>> snapshot = RegisterSnapshot(2000, 2005)
+    >>> snapshot.update_block(2001, [215, 0xFFFE, 1])
+    >>> snapshot[2001], snapshot[2002]
+    (215, -2)
+    >>> 2000 in snapshot, 2001 in snapshot, 1999 in snapshot
+    (False, True, False)
+    >>> dict(snapshot)
+    {2001: 215, 2002: -2, 2003: 1}
+    >>> snapshot.invalidate(2002, 1)
+    >>> snapshot.get(2002), len(snapshot)
+    (None, 2)
+    """
+
+    def __init__(self, first: int, last: int):
+        self.first = first
+        count = last - first + 1
+        self.values = array('h', bytes(2 * count))
+        self.valid = bytearray(count)
+
+    def update_block(self, address: int, registers: list[int]) -> None:
+        """Store the unsigned register values of one Modbus response"""
+        block = array('H', registers)  # Raises OverflowError for values outside of 16 bits
+        start = address - self.first
+        end = start + len(block)
+        if start < 0 or end > len(self.valid):
+            raise IndexError(f'Block {address}-{address + len(block) - 1} outside of the snapshot')
+        self.values[start:end] = array('h', block.tobytes())  # Same bytes as two's complement
+        self.valid[start:end] = b'\x01' * len(block)
+
+    def invalidate(self, address: int, count: int) -> None:
+        start = max(address - self.first, 0)
+        end = min(address - self.first + count, len(self.valid))
+        if start < end:
+            self.valid[start:end] = bytes(end - start)
+
+    def __getitem__(self, address: int) -> int:
+        index = address - self.first
+        if 0 <= index < len(self.valid) and self.valid[index]:
+            return self.values[index]
+        raise KeyError(address)
+
+    def __contains__(self, address) -> bool:
+        index = address - self.first
+        return 0 <= index < len(self.valid) and self.valid[index] == 1
+
+    def __iter__(self) -> Iterator[int]:
+        return (self.first + index for index, valid in enumerate(self.valid) if valid)
+
+    def __len__(self) -> int:
+        return self.valid.count(1)
+
+    def __repr__(self):
+        return f'<RegisterSnapshot {self.first}-{self.first + len(self.valid) - 1}: {dict(self)}>'
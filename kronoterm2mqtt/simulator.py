@@ -0,0 +1,322 @@
+import asyncio
+from collections.abc import Iterable
+import dataclasses
+import logging
+import math
+import os
+import random
+import time
+import tty
+
+from pymodbus.constants import ExcCodes
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse, WriteSingleRegisterResponse
+from pymodbus.server import ModbusSerialServer, ModbusTcpServer
+from pymodbus.simulator import DataType, SimData, SimDevice
+
+from kronoterm2mqtt.constants import (
+    MODBUS_RTU_FRAME_GAP_CHARS,
+    MODBUS_RTU_READ_REQUEST_BYTES,
+    MODBUS_RTU_READ_RESPONSE_BYTES,
+    MODBUS_RTU_WRITE_BYTES,
+)
+from kronoterm2mqtt.register_blocks import get_rtu_char_time
+
+
+logger = logging.getLogger(__name__)
+
+GENERATORS = ('constant', 'random-walk', 'sine')
+SINE_PERIOD = 60.0  # seconds of one period of the "sine" generator
+CHANGE_PROBABILITY = 0.05  # of options and bits per read with the "random-walk" generator
+SENSOR_RANGES = {  # Plausible (low, high) sensor values by unit, others use (0, 100)
+    '°C': (15, 55),
+    '%': (0, 100),
+    'h': (0, 20_000),
+    'kW': (0, 10),
+    'bar': (1, 3),
+}
+READ_HOLDING_REGISTERS = 0x03
+WRITE_SINGLE_REGISTER = 0x06
+
+
+@dataclasses.dataclass
+class RegisterGenerator:
+    """
+    Creates the next raw value of a register that is only read by the
+    client: a sensor value within [low, high], one of the option keys
+    or a combination of the bits in mask.
+    """
+
+    low: int = 0
+    high: int = 0
+    keys: tuple[int, ...] = ()
+    mask: int = 0
+
+    def next_value(self, value: int, generator: str, elapsed: float, rng: random.Random) -> int:
+        """
+        >>> rng = random.Random(1)
+        >>> RegisterGenerator(low=200, high=400).next_value(300, 'sine', elapsed=SINE_PERIOD / 4, rng=rng)
+        400
+        >>> RegisterGenerator(keys=(0, 1, 2)).next_value(1, 'constant', elapsed=1, rng=rng)
+        1
+        >>> RegisterGenerator(mask=0b1010).next_value(0, 'sine', elapsed=1, rng=rng)
+        10
+        """
+        if generator == 'constant':
+            return value
+        phase = math.sin(2 * math.pi * elapsed / SINE_PERIOD)
+        if self.keys:
+            if generator == 'sine':
+                return self.keys[int(elapsed / SINE_PERIOD * len(self.keys)) % len(self.keys)]
+            return rng.choice(self.keys) if rng.random() < CHANGE_PROBABILITY else value
+        if self.mask:
+            if generator == 'sine':
+                return self.mask if phase >= 0 else 0
+            if rng.random() < CHANGE_PROBABILITY:
+                value ^= rng.choice([1 << bit for bit in range(16) if self.mask & (1 << bit)])
+            return value
+        if generator == 'sine':
+            return round((self.low + self.high) / 2 + (self.high - self.low) / 2 * phase)
+        return min(max(value + rng.randint(-1, 1), self.low), self.high)
+
+
+class HeatPumpSimulator:
+    """
+    Holding registers of a simulated heat pump, populated from the
+    definitions. Read-only registers change with every read, following the
+    generator. Only switch and select registers can be written. Each request
+    can be delayed by a fixed latency plus the transfer time of the RTU frames
+    at an emulated baud rate, and fail with injected exceptions.
+    """
+
+    def __init__(
+        self,
+        definitions: dict,
+        *,
+        generator: str = 'random-walk',
+        latency: float = 0.0,
+        baudrate: int = 0,
+        exception_rate: float = 0.0,
+        illegal_registers: Iterable[int] = (),
+        seed: int | None = None,
+    ):
+        assert generator in GENERATORS, f'Invalid generator {generator!r}, use one of {GENERATORS}'
+        self.generator = generator
+        self.latency = latency
+        self.exception_rate = exception_rate
+        self.illegal_registers = frozenset(illegal_registers)
+        self.rng = random.Random(seed)
+        self.char_time = 0.0
+        if baudrate:
+            self.char_time = get_rtu_char_time({**definitions['connection'], 'baudrate': baudrate})
+
+        self.values: dict[int, int] = dict()  # address -> initial raw value
+        self.generators: dict[int, RegisterGenerator] = dict()
+        self.writable: set[int] = set()
+        for parameter in definitions['sensor']:
+            address = parameter['register'] - 1  # KRONOTERM MA_numbering is one-based in documentation!
+            low, high = SENSOR_RANGES.get(parameter['unit_of_measurement'], (0, 100))
+            scale = parameter['scale']
+            sensor_generator = RegisterGenerator(low=round(low / scale), high=round(high / scale))
+            self.add(address, self.rng.randint(sensor_generator.low, sensor_generator.high), sensor_generator)
+        for parameter in definitions['binary_sensor']:
+            address = parameter['register'] - 1
+            bit = parameter.get('bit')
+            mask = self.generators.get(address, RegisterGenerator()).mask | (0xFFFF if bit is None else 1 << bit)
+            self.add(address, self.rng.randrange(0x10000) & mask, RegisterGenerator(mask=mask))
+        for parameter in definitions['enum_sensor']:
+            keys = self.get_option_keys(parameter)
+            self.add(parameter['register'] - 1, self.rng.choice(keys), RegisterGenerator(keys=keys))
+        for parameter in definitions.get('switch', ()):
+            self.add(parameter['register'] - 1, self.rng.randint(0, 1))
+        for parameter in definitions.get('select', ()):
+            self.add(parameter['register'] - 1, self.rng.choice(self.get_option_keys(parameter)))
+
+        self.first_address = min(self.values)
+        self.last_address = max(self.values)
+        self.started = time.monotonic()
+        self.requests = 0
+        self.injected_exceptions = 0
+
+    @staticmethod
+    def get_option_keys(parameter: dict) -> tuple[int, ...]:
+        options = parameter['options'][0]
+        return tuple(options['keys'][: len(options['values'])])  # Only keys with a value
+
+    def add(self, address: int, value: int, generator: RegisterGenerator | None = None) -> None:
+        self.values[address] = value & 0xFFFF
+        if generator is None:
+            self.writable.add(address)
+        else:
+            self.generators[address] = generator
+
+    def get_device(self, slave_id: int) -> SimDevice:
+        """The pymodbus simulator device with all registers between the first and last defined one"""
+        values = [self.values.get(address, 0) for address in range(self.first_address, self.last_address + 1)]
+        # The values are unsigned, DataType.REGISTERS is signed in some pymodbus versions:
+        simdata = SimData(address=self.first_address, values=values, datatype=DataType.UINT16)
+        return SimDevice(id=slave_id, simdata=simdata, action=self.action)
+
+    def get_transfer_time(self, function_code: int, count: int) -> float:
+        """Time of request and response on the RTU line at the emulated baud rate"""
+        if function_code == READ_HOLDING_REGISTERS:
+            chars = MODBUS_RTU_READ_REQUEST_BYTES + MODBUS_RTU_READ_RESPONSE_BYTES + 2 * count
+        else:
+            chars = 2 * MODBUS_RTU_WRITE_BYTES
+        return (chars + 2 * MODBUS_RTU_FRAME_GAP_CHARS) * self.char_time
+
+    def handle_request(
+        self,
+        function_code: int,
+        start_address: int,
+        address: int,
+        count: int,
+        registers: list[int],
+        set_values: list[int] | list[bool] | None,
+    ) -> ExcCodes | None:
+        """Check the request and generate the new values of the requested read-only registers"""
+        self.requests += 1
+        addresses = range(address, address + count)
+        if not self.illegal_registers.isdisjoint(addresses):
+            return ExcCodes.ILLEGAL_ADDRESS
+        if self.exception_rate and self.rng.random() < self.exception_rate:
+            self.injected_exceptions += 1
+            return ExcCodes.DEVICE_BUSY
+        if set_values:
+            if not self.writable.issuperset(addresses):
+                return ExcCodes.ILLEGAL_ADDRESS
+            return None
+        elapsed = time.monotonic() - self.started
+        for register_address in addresses:
+            if generator := self.generators.get(register_address):
+                offset = register_address - start_address
+                value = registers[offset]
+                if value >= 0x8000:  # Negative values, e.g. temperatures
+                    value -= 0x10000
+                value = generator.next_value(value, self.generator, elapsed, self.rng)
+                registers[offset] = value & 0xFFFF
+        return None
+
+    async def action(
+        self,
+        function_code: int,
+        start_address: int,
+        address: int,
+        count: int,
+        registers: list[int],
+        set_values: list[int] | list[bool] | None,
+    ) -> ExcCodes | None:
+        """Called by the pymodbus server for every request, before the registers are read or written"""
+        if delay := self.latency + self.get_transfer_time(function_code, count):
+            await asyncio.sleep(delay)
+        return self.handle_request(function_code, start_address, address, count, registers, set_values)
+
+
+class SimulatedModbusClient:
+    """
+    Serves the simulator in-process instead of a pymodbus client, without a
+    server and without I/O. Used by the port "simulate:" and the benchmarks.
+    """
+
+    def __init__(self, simulator: HeatPumpSimulator):
+        self.simulator = simulator
+        self.registers: dict[int, list[int]] = dict()  # slave id -> registers from the first address
+
+    def connect(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def request(self, function_code: int, address: int, count: int, device_id: int, set_values: list[int] | None):
+        """Returns the exception code or the registers from the first address of the simulator"""
+        simulator = self.simulator
+        if delay := simulator.latency + simulator.get_transfer_time(function_code, count):
+            time.sleep(delay)
+        if address < simulator.first_address or address + count - 1 > simulator.last_address:
+            return ExcCodes.ILLEGAL_ADDRESS
+        if (registers := self.registers.get(device_id)) is None:
+            registers = simulator.get_device(device_id).simdata.values.copy()
+            self.registers[device_id] = registers
+        if exception_code := simulator.handle_request(
+            function_code, simulator.first_address, address, count, registers, set_values
+        ):
+            return exception_code
+        offset = address - simulator.first_address
+        if set_values:
+            registers[offset : offset + count] = set_values
+        return registers[offset : offset + count]
+
+    def read_holding_registers(self, *, address: int, count: int, device_id: int):
+        result = self.request(READ_HOLDING_REGISTERS, address, count, device_id, None)
+        if isinstance(result, ExcCodes):
+            return ExceptionResponse(READ_HOLDING_REGISTERS, result)
+        return ReadHoldingRegistersResponse(registers=result)
+
+    def write_register(self, *, address: int, value: int, device_id: int):
+        result = self.request(WRITE_SINGLE_REGISTER, address, 1, device_id, [value])
+        if isinstance(result, ExcCodes):
+            return ExceptionResponse(WRITE_SINGLE_REGISTER, result)
+        return WriteSingleRegisterResponse(address=address, registers=result)
+
+
+class VirtualSerialLine:
+    """
+    Two pseudo terminals connected like a null modem cable: The simulator
+    serves RTU on `server_port` and the client connects to `client_port`.
+    """
+
+    def __init__(self):
+        self.terminals = [os.openpty() for _ in range(2)]  # (controller, terminal) file descriptors
+        for _, terminal in self.terminals:
+            tty.setraw(terminal)
+        (self.controller_a, terminal_a), (self.controller_b, terminal_b) = self.terminals
+        self.server_port = os.ttyname(terminal_a)
+        self.client_port = os.ttyname(terminal_b)
+
+    def relay(self, source: int, target: int) -> None:
+        os.write(target, os.read(source, 1024))
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.controller_a, self.relay, self.controller_a, self.controller_b)
+        loop.add_reader(self.controller_b, self.relay, self.controller_b, self.controller_a)
+
+    def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        for controller, terminal in self.terminals:
+            loop.remove_reader(controller)
+            os.close(controller)
+            os.close(terminal)
+
+
+async def serve_simulator(simulator: HeatPumpSimulator, *, slave_id: int, port: str, connection: dict) -> None:
+    """
+    Serve the simulator until cancelled: Modbus TCP on "host:port" or,
+    with port "pty", Modbus RTU on a virtual serial line.
+    """
+    device = simulator.get_device(slave_id)
+    if port == 'pty':
+        line = VirtualSerialLine()
+        line.start()
+        server = ModbusSerialServer(
+            device,
+            port=line.server_port,
+            baudrate=connection['baudrate'],
+            bytesize=connection['bytesize'],
+            parity=connection['parity'],
+            stopbits=connection['stopbits'],
+        )
+        print(f'Serve Modbus RTU with slave id {slave_id}, use port = "{line.client_port}"')
+    else:
+        line = None
+        host, _, tcp_port = port.rpartition(':')
+        server = ModbusTcpServer(device, address=(host, int(tcp_port)))
+        print(f'Serve Modbus TCP with slave id {slave_id}, use port = "{port}"')
+    try:
+        await server.serve_forever()
+    finally:
+        await server.shutdown()
+        if line:
+            line.close()
+        logger.info(f'{simulator.requests} requests, {simulator.injected_exceptions} injected exceptions')
@@ -0,0 +1,76 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+import logging
+import time
+
+from kronoterm2mqtt.constants import SUPERVISOR_MAX_DELAY, SUPERVISOR_MIN_DELAY
+from kronoterm2mqtt.timing import RunningStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Restart one subsystem (a Modbus link or the expander UART) after a failure,
+    without touching the others: While it's down, its work is skipped and a
+    task restarts it with an exponential backoff until it runs again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        restart: Callable[[], Awaitable[None]],
+        errors: tuple[type[Exception], ...],
+        min_delay: float = SUPERVISOR_MIN_DELAY,
+        max_delay: float = SUPERVISOR_MAX_DELAY,
+    ):
+        self.name = name
+        self.restart = restart
+        self.errors = errors  # Failures of the subsystem, other exceptions are raised
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.restart_task: asyncio.Task | None = None
+        self.restarts = 0
+        self.down_time = RunningStats()  # From the failure until the subsystem runs again
+
+    @property
+    def is_down(self) -> bool:
+        return self.restart_task is not None
+
+    async def run(self, func: Callable[..., Awaitable], *args, **kwargs) -> bool:
+        """Await func of the subsystem, unless it's down. Returns if it succeeded."""
+        if self.is_down:
+            logger.debug(f'{self.name} is down: Skip {func.__name__}()')
+            return False
+        try:
+            await func(*args, **kwargs)
+        except self.errors as err:
+            self.failed(err)
+            return False
+        return True
+
+    def failed(self, err: Exception) -> None:
+        """Take the subsystem down and restart it in the background"""
+        if self.is_down:
+            return
+        logger.error(f'{self.name} failed: {err!r}')
+        self.restart_task = asyncio.get_running_loop().create_task(self.restart_loop())
+
+    async def restart_loop(self) -> None:
+        failed = time.monotonic()
+        delay = self.min_delay
+        while True:
+            logger.info(f'Restart {self.name} in {delay} seconds...')
+            await asyncio.sleep(delay)
+            try:
+                await self.restart()
+            except Exception as err:  # noqa: BLE001 - Retried until the subsystem runs again
+                logger.warning(f'Restart of {self.name} failed: {err!r}')
+                delay = min(delay * 2, self.max_delay)
+            else:
+                break
+        self.restarts += 1
+        self.down_time.add(time.monotonic() - failed)
+        logger.info(f'{self.name} restarted after {time.monotonic() - failed:.1f} seconds')
+        self.restart_task = None
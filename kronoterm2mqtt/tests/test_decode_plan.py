@@ -0,0 +1,57 @@
+from decimal import Decimal
+from unittest import TestCase
+
+from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
+from ha_services.mqtt4homeassistant.components.select import Select
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.components.switch import Switch
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
+
+from kronoterm2mqtt.decode_plan import DecodePlan
+
+
+class DecodePlanTestCase(TestCase):
+    def tearDown(self):
+        BaseMqttDevice.device_uids = set()
+        BaseMqttDevice.components = {}
+
+    def test_decode(self):
+        device = MqttDevice(name='Test', uid='test')
+        temperature = Sensor(device=device, name='Temperature', uid='temperature')
+        pressure = Sensor(device=device, name='Pressure', uid='pressure')
+        defrost = BinarySensor(device=device, name='Defrost', uid='defrost')
+        heater = BinarySensor(device=device, name='Heater', uid='heater')
+        system = Switch(device=device, name='System', uid='system', callback=lambda **kwargs: None)
+        mode = Select(
+            device=device,
+            name='Mode',
+            uid='mode',
+            options=('normal', 'eco'),
+            default_option='normal',
+            callback=lambda **kwargs: None,
+        )
+        status = Sensor(device=device, name='Status', uid='status')
+
+        plan = DecodePlan()
+        plan.add_sensor(10, temperature, Decimal('0.1'))
+        plan.add_sensor(11, pressure, Decimal('0.01'))
+        plan.add_binary_sensor(12, defrost, 2)
+        plan.add_binary_sensor(12, heater, None)
+        plan.add_switch(13, system)
+        plan.add_options(14, mode, {'keys': [0, 2], 'values': ['normal', 'eco']})
+        plan.add_options(15, status, {'keys': [0, 1], 'values': ['off', 'on']})
+
+        registers = {10: 223, 11: 1234, 12: 0b011, 13: 1, 14: 2, 15: 7}
+        self.assertEqual(
+            list(plan.decode(registers, registers)),
+            [
+                (temperature, 22.3),
+                (pressure, 12.34),
+                (defrost, 'OFF'),
+                (heater, 'ON'),
+                (system, 'ON'),
+                (mode, 'eco'),
+                # Unknown value 7 of the status is skipped
+            ],
+        )
+        self.assertEqual(list(plan.decode(registers, {10, 13})), [(temperature, 22.3), (system, 'ON')])
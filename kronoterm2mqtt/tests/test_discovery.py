@@ -0,0 +1,75 @@
+import json
+from unittest import TestCase, mock
+
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.components.switch import Switch
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessage
+
+from kronoterm2mqtt.discovery import DiscoveryPublisher
+from kronoterm2mqtt.publish_filter import ChangeFilter
+
+
+class DiscoveryPublisherTestCase(TestCase):
+    def tearDown(self):
+        BaseMqttDevice.device_uids = set()
+        BaseMqttDevice.components = {}
+
+    def test_birth_message(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        switch = Switch(device=device, name='Pump', uid='pump')
+        client = mock.MagicMock()
+        client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+        on_birth = mock.Mock()
+        discovery = DiscoveryPublisher(client, on_birth=on_birth)
+
+        discovery.publish()
+        discovery.subscribe()
+        configs = {call.kwargs['topic']: call.kwargs['payload'] for call in client.publish.call_args_list}
+        self.assertEqual(set(configs), {f'{sensor.topic_prefix}/config', f'{switch.topic_prefix}/config'})
+        self.assertEqual(json.loads(configs[f'{switch.topic_prefix}/config'])['command_topic'], switch.command_topic)
+        client.subscribe.assert_any_call('homeassistant/status')
+
+        # The states are published without the configs:
+        client.reset_mock()
+        sensor.set_state(20.5)
+        ChangeFilter(heartbeat=60).publish(sensor, client)
+        topics = [call.kwargs['topic'] for call in client.publish.call_args_list]
+        self.assertEqual(topics, [f'{sensor.topic_prefix}/state'])
+
+        for payload in (b'offline', b'online'):
+            message = MQTTMessage(topic=b'homeassistant/status')
+            message.payload = payload
+            discovery.status_callback(client, None, message)
+        on_birth.assert_called_once_with()
+
+        # Published again on request, not throttled:
+        client.reset_mock()
+        discovery.publish()
+        self.assertEqual(client.publish.call_count, 2)
+        self.assertEqual(discovery.published, 2)
+
+    def test_device_discovery(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        switch = Switch(device=device, name='Pump', uid='pump')
+        other = Sensor(device=MqttDevice(name='Other', uid='other'), name='Power', uid='power')
+        client = mock.MagicMock()
+        client.subscribe.return_value = (MQTT_ERR_SUCCESS, 1)
+        discovery = DiscoveryPublisher(client, on_birth=mock.Mock())
+        discovery.add_device(device)
+
+        discovery.publish()
+        configs = {call.kwargs['topic']: call.kwargs['payload'] for call in client.publish.call_args_list}
+        self.assertEqual(set(configs), {'homeassistant/device/test/config', f'{other.topic_prefix}/config'})
+        config = json.loads(configs['homeassistant/device/test/config'])
+        self.assertEqual(config['device']['identifiers'], 'test')
+        self.assertEqual(set(config['components']), {sensor.uid, switch.uid})
+        self.assertEqual(config['components'][sensor.uid]['platform'], 'sensor')
+        self.assertEqual(config['components'][sensor.uid]['state_topic'], f'{sensor.topic_prefix}/state')
+        self.assertNotIn('device', config['components'][switch.uid])
+
+        # The switch receives its commands without publish_config():
+        client.subscribe.assert_called_once_with(switch.command_topic)
+        client.message_callback_add.assert_called_once_with(switch.command_topic, switch._command_callback)
@@ -0,0 +1,49 @@
+import json
+from unittest import TestCase, mock
+
+from ha_services.mqtt4homeassistant.components.binary_sensor import BinarySensor
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
+
+from kronoterm2mqtt.json_state import JsonStatePublisher
+
+
+class JsonStatePublisherTestCase(TestCase):
+    def tearDown(self):
+        BaseMqttDevice.device_uids = set()
+        BaseMqttDevice.components = {}
+
+    def test_publish(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        binary_sensor = BinarySensor(device=device, name='Pump', uid='pump')
+        client = mock.MagicMock()
+        json_state = JsonStatePublisher(device, heartbeat=60)
+        json_state.add(sensor)
+        json_state.add(binary_sensor)
+
+        def publish(now, force=False):
+            with mock.patch('kronoterm2mqtt.json_state.time.monotonic', return_value=now):
+                return json_state.publish(client, force=force)
+
+        sensor.set_state(20.5)
+        publish(now=100)  # The binary sensor has no state yet
+        binary_sensor.set_state(binary_sensor.ON)
+        publish(now=110)
+        publish(now=120)  # unchanged
+        publish(now=130, force=True)
+        publish(now=190)  # heartbeat
+        self.assertEqual(str(json_state), '4 JSON documents sent, 1 suppressed')
+
+        config = sensor.get_config().payload
+        self.assertEqual(config['state_topic'], 'homeassistant/test/state')
+        self.assertEqual(config['value_template'], "{{ value_json['temperature'] }}")
+
+        messages = {call.kwargs['topic']: call.kwargs['payload'] for call in client.publish.call_args_list}
+        self.assertEqual(json.loads(messages['homeassistant/test/state']), {'temperature': 20.5, 'pump': 'ON'})
+        self.assertNotIn('homeassistant/sensor/test/test-temperature/state', messages)
+
+        state_payloads = [
+            call.kwargs['payload'] for call in client.publish.call_args_list if call.kwargs['topic'].endswith('/state')
+        ]
+        self.assertEqual(state_payloads[:2], ['{"temperature":20.5}', '{"temperature":20.5,"pump":"ON"}'])
@@ -0,0 +1,64 @@
+import threading
+from unittest import TestCase
+
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse, WriteSingleRegisterResponse
+
+from kronoterm2mqtt.modbus_bus import ModbusBus
+from kronoterm2mqtt.register_blocks import BusCost
+
+
+class BlockingClient:
+    """Records the requests and blocks the bus thread until released"""
+
+    def __init__(self):
+        self.requests = []
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read_holding_registers(self, *, address, count, device_id):
+        self.reading.set()
+        self.release.wait(timeout=5)
+        self.requests.append(('read', address))
+        return ReadHoldingRegistersResponse(registers=[0] * count)
+
+    def write_register(self, *, address, value, device_id):
+        self.requests.append(('write', address, value))
+        return WriteSingleRegisterResponse(address=address, registers=[value])
+
+    def close(self):
+        pass
+
+
+class ModbusBusTestCase(TestCase):
+    def test_writes_preempt_reads_and_coalesce(self):
+        client = BlockingClient()
+        bus = ModbusBus('test', client, BusCost.for_tcp())
+        try:
+            reads = [
+                bus.submit(client.read_holding_registers, address=address, count=1, device_id=20)
+                for address in (2000, 2100, 2200)
+            ]
+            # The first read blocks the bus, the others wait in the queue:
+            self.assertTrue(client.reading.wait(timeout=5))
+            first_write = bus.write_register(slave_id=20, address=2015, value=1)
+            second_write = bus.write_register(slave_id=20, address=2015, value=0)
+            other_write = bus.write_register(slave_id=20, address=2016, value=1)
+            self.assertIs(first_write, second_write)
+            self.assertEqual(bus.coalesced_writes, 1)
+
+            client.release.set()
+            for future in (*reads, first_write, other_write):
+                future.result(timeout=5)
+        finally:
+            bus.close()
+
+        self.assertEqual(
+            client.requests,
+            [
+                ('read', 2000),
+                ('write', 2015, 0),  # Only the latest value is written
+                ('write', 2016, 1),
+                ('read', 2100),
+                ('read', 2200),
+            ],
+        )
@@ -0,0 +1,136 @@
+import asyncio
+import socket
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase, mock
+
+import paho.mqtt.client as mqtt
+
+from kronoterm2mqtt.mqtt_asyncio import AsyncioMqttClient
+
+
+CONNACK = b'\x20\x02\x00\x00'
+
+
+class FakeBroker:
+    """Serves one MQTT connection over a socket pair, without a real network connection"""
+
+    def __init__(self):
+        self.client_socket, self.broker_socket = socket.socketpair()
+        self.received = bytearray()
+        self.closed = asyncio.Event()
+        self.writer: asyncio.StreamWriter | None = None
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        reader, writer = await asyncio.open_connection(sock=self.broker_socket)
+        self.task = asyncio.create_task(self.handle(reader, writer))
+
+    def create_socket_connection(self) -> socket.socket:
+        """Replaces the TCP connection of paho: Connects once, reconnects are refused"""
+        if self.client_socket is None:
+            raise ConnectionRefusedError
+        client_socket, self.client_socket = self.client_socket, None
+        return client_socket
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.received += await reader.read(1024)  # CONNECT
+        writer.write(CONNACK)
+        while data := await reader.read(65536):
+            self.received += data
+        self.closed.set()
+
+    def send_message(self, topic: str, payload: bytes):
+        encoded_topic = topic.encode()
+        body = len(encoded_topic).to_bytes(2, 'big') + encoded_topic + payload
+        self.writer.write(bytes([0x30, len(body)]) + body)
+
+
+class AsyncioMqttClientTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.broker = FakeBroker()
+        await self.broker.start()
+        self.client = AsyncioMqttClient(mqtt.CallbackAPIVersion.VERSION2, client_id='test', max_inflight=2)
+        self.client.on_connect = lambda client, *args: client.connected()
+        patcher = mock.patch.object(self.client, '_create_socket_connection', self.broker.create_socket_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.connect('broker.invalid')
+
+    async def asyncTearDown(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.broker.writer.close()
+        await self.broker.closed.wait()
+        await self.broker.task
+
+    async def test_publish_and_receive(self):
+        await self.client.start(timeout=2)
+        self.assertTrue(self.client.is_connected())
+        self.assertIsNone(self.client._thread)  # No paho network thread
+
+        for number in range(10):
+            self.client.publish(topic=f'topic{number}', payload=b'x' * 100)
+        self.assertEqual(len(self.client.pending), 8)  # Waiting for the in-flight messages
+        self.assertTrue(await self.client.drain(timeout=2))
+        self.assertEqual((self.client.pending, self.client.inflight), ({}, {}))
+        self.assertEqual(self.client.latency.count, 10)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.broker.received.count(b'x' * 100), 10)
+
+        # The callbacks of received messages run in the event loop thread:
+        received = []
+        self.client.on_message = lambda client, userdata, message: received.append(
+            (message.topic, message.payload, threading.current_thread())
+        )
+        self.broker.send_message('command', b'ON')
+        await asyncio.sleep(0.05)
+        self.assertEqual(received, [('command', b'ON', threading.current_thread())])
+
+    async def test_disconnected(self):
+        await self.client.start(timeout=2)
+        self.broker.writer.close()
+        self.assertTrue(await self.client.wait_until(lambda: not self.client.is_connected(), timeout=2))
+        self.client.publish(topic='topic', payload='1')
+        self.assertTrue(await self.client.drain(timeout=2))  # Returns at once, the outbox keeps the state
+        self.assertEqual(list(self.client.pending), ['topic'])
+
+    async def test_unreachable_broker(self):
+        with mock.patch('kronoterm2mqtt.mqtt_asyncio.MQTT_RECONNECT_MIN_DELAY', 0.01):
+            await self.client.start(timeout=2)
+        self.broker.writer.close()
+        self.assertTrue(await self.client.wait_until(lambda: not self.client.is_connected(), timeout=2))
+
+        connecting = threading.Event()
+        timed_out = threading.Event()
+
+        def create_socket_connection():
+            connecting.set()
+            time.sleep(0.3)  # The TCP connection to an unreachable broker times out
+            timed_out.set()
+            raise TimeoutError('timed out')
+
+        # The event loop, e.g. the Modbus reads of the publish loop, goes on while the client reconnects:
+        with mock.patch.object(self.client, '_create_socket_connection', create_socket_connection):
+            async with asyncio.timeout(2):
+                while not connecting.is_set():
+                    await asyncio.sleep(0.01)
+                ticks = 0
+                while not timed_out.is_set():
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+        self.assertGreater(ticks, 10)
+        self.assertFalse(self.client.is_connected())
+
+        # The socket callbacks of the reconnect in the executor thread are run in the event loop:
+        broker = FakeBroker()
+        await broker.start()
+        with mock.patch.object(self.client, '_create_socket_connection', broker.create_socket_connection):
+            self.assertTrue(await self.client.wait_until(self.client.is_connected, timeout=2))
+        self.client.publish(topic='topic', payload='reconnected')
+        self.assertTrue(await self.client.drain(timeout=2))
+        self.client.loop_stop()
+        self.client.disconnect()
+        await broker.closed.wait()
+        self.assertIn(b'reconnected', broker.received)
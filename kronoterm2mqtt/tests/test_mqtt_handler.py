@@ -0,0 +1,185 @@
+import asyncio
+import math
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, CallbackAPIVersion, MQTTMessage, MQTTMessageInfo
+from pymodbus.exceptions import ModbusIOException
+
+from kronoterm2mqtt.benchmarks import BenchmarkMqttClient, benchmark_definitions
+from kronoterm2mqtt.constants import HOME_ASSISTANT_BIRTH_PAYLOAD, HOME_ASSISTANT_STATUS_TOPIC, SIMULATE_PORT_PREFIX
+from kronoterm2mqtt.mqtt_handler import KronotermMqttHandler
+from kronoterm2mqtt.mqtt_outbox import OutboxClient
+from kronoterm2mqtt.register_blocks import BusCost, IllegalRegisters
+from kronoterm2mqtt.supervisor import Supervisor
+from kronoterm2mqtt.user_settings import UserSettings
+
+
+class TopicsMqttClient(BenchmarkMqttClient):
+    """Records the topics of the published messages"""
+
+    def __init__(self):
+        super().__init__()
+        self.topics = []
+
+    def publish(self, *, topic: str, payload=None, **kwargs) -> MQTTMessageInfo:
+        self.topics.append(topic)
+        return super().publish(topic=topic, payload=payload, **kwargs)
+
+
+class BrokerSessionMqttClient(OutboxClient):
+    """Keeps the subscriptions like a broker: A clean session loses them"""
+
+    def __init__(self):
+        super().__init__(CallbackAPIVersion.VERSION2)
+        self.online = False
+        self.subscriptions = set()
+        self.callbacks = {}
+
+    def connect_clean_session(self):
+        self.online = True
+        self.subscriptions.clear()
+        self.connected()
+
+    def deliver(self, topic: str, payload: str):
+        if topic in self.subscriptions:
+            message = MQTTMessage(topic=topic.encode())
+            message.payload = payload.encode()
+            self.callbacks[topic](self, None, message)
+
+    def publish(self, *, topic: str, payload=None, **kwargs) -> MQTTMessageInfo:
+        return MQTTMessageInfo(0)
+
+    def subscribe(self, topic, *args, **kwargs):
+        if not self.online:
+            return MQTT_ERR_NO_CONN, None
+        self.subscriptions.add(topic)
+        return MQTT_ERR_SUCCESS, len(self.subscriptions)
+
+    def message_callback_add(self, sub, callback):
+        self.callbacks[sub] = callback
+
+    def loop_start(self, *args, **kwargs):
+        pass
+
+    def loop_stop(self, *args, **kwargs):
+        pass
+
+    def disconnect(self, *args, **kwargs):
+        pass
+
+
+class KronotermMqttHandlerTestCase(IsolatedAsyncioTestCase):
+    async def test_expander_with_staggered_poll_tiers(self):
+        user_settings = UserSettings()
+        user_settings.heat_pump.port = f'{SIMULATE_PORT_PREFIX}constant'
+        with KronotermMqttHandler(user_settings, verbosity=0, mqtt_client=BenchmarkMqttClient()) as handler:
+            await handler.init_devices()
+            heat_pump_handler = handler.heat_pump_handlers[0]
+            heat_pump_handler.illegal_registers = IllegalRegisters()
+            heat_pump_handler.bus.cost = BusCost(transaction=0.0, register=1.0)  # Read no unused registers
+            heat_pump_handler.plan_address_ranges()
+            self.assertEqual(heat_pump_handler.address_tiers[2046], 'slow')
+
+            # The expander needs its UART hardware, a fake one records the updates:
+            expander = SimpleNamespace(update_sensors_and_control=AsyncMock())
+            expander.supervisor = Supervisor('Fake expander', restart=AsyncMock(), errors=(OSError,))
+            handler.expander = expander
+            try:
+                # The slow registers are read first in one of the next cycles:
+                heat_pump_handler.next_poll = {'slow': math.inf}
+                await heat_pump_handler.poll()
+                self.assertNotIn(2046, heat_pump_handler.registers)
+                await handler.update_expander(heat_pump_handler.registers)
+                expander.update_sensors_and_control.assert_not_awaited()
+
+                heat_pump_handler.next_poll = {}
+                await heat_pump_handler.poll()
+                await handler.update_expander(heat_pump_handler.registers)
+                expander.update_sensors_and_control.assert_awaited_once()
+                kwargs = expander.update_sensors_and_control.await_args.kwargs
+                self.assertEqual(kwargs['loop_temperature_offset_in_eco_mode'], 0.1 * heat_pump_handler.registers[2046])
+                self.assertFalse(expander.supervisor.is_down)
+            finally:
+                handler.expander = None  # Nothing to stop
+
+    async def test_discovery_before_states(self):
+        user_settings = UserSettings()
+        user_settings.heat_pump.port = f'{SIMULATE_PORT_PREFIX}constant'
+        user_settings.heat_pump.pooling_interval = 60
+        mqtt_client = TopicsMqttClient()
+        with KronotermMqttHandler(user_settings, verbosity=0, mqtt_client=mqtt_client) as handler:
+            await handler.init_devices()
+            heat_pump_handler = handler.heat_pump_handlers[0]
+            expander = SimpleNamespace(republish_states=Mock(), update_sensors_and_control=AsyncMock())
+            expander.supervisor = Supervisor('Fake expander', restart=AsyncMock(), errors=(OSError,))
+            handler.expander = expander
+            try:
+                await heat_pump_handler.poll()
+                mqtt_client.topics.clear()
+
+                # Home Assistant restarted between two cycles:
+                message = MQTTMessage(topic=HOME_ASSISTANT_STATUS_TOPIC.encode())
+                message.payload = HOME_ASSISTANT_BIRTH_PAYLOAD.encode()
+                handler.discovery.status_callback(mqtt_client, None, message)
+                self.assertEqual(mqtt_client.topics, [])
+                with self.assertRaises(TimeoutError):  # One cycle, then it waits for the next one
+                    await asyncio.wait_for(handler.heat_pump_loop(heat_pump_handler), timeout=1)
+            finally:
+                handler.expander = None  # Nothing to stop
+
+            self.assertFalse(handler.discovery_requested)
+            expander.republish_states.assert_called_once()
+            configs = [index for index, topic in enumerate(mqtt_client.topics) if topic.endswith('/config')]
+            states = [index for index, topic in enumerate(mqtt_client.topics) if not topic.endswith('/config')]
+            self.assertEqual(len(configs), len(heat_pump_handler.get_components()))
+            self.assertLess(max(configs), min(states))
+
+    async def test_json_state_with_ksm_definitions(self):
+        per_entity = await benchmark_definitions('kronoterm_ksm', cycles=5, json_state=False)
+        json_state = await benchmark_definitions('kronoterm_ksm', cycles=5, json_state=True)
+        self.assertEqual(json_state.messages, 1)
+        self.assertGreater(per_entity.messages, 10)
+        self.assertGreater(per_entity.message_bytes, 0)
+        self.assertGreater(json_state.message_bytes, 0)
+
+    async def test_birth_message_after_reconnect(self):
+        user_settings = UserSettings()
+        user_settings.heat_pump.port = f'{SIMULATE_PORT_PREFIX}constant'
+        mqtt_client = BrokerSessionMqttClient()
+        with KronotermMqttHandler(user_settings, verbosity=0, mqtt_client=mqtt_client) as handler:
+            await handler.init_devices()  # The broker is not reachable yet
+            self.assertEqual(mqtt_client.subscriptions, set())
+
+            for _ in range(2):  # The first connection, then a reconnect with a clean session
+                mqtt_client.connect_clean_session()
+                self.assertTrue(handler.discovery_requested)
+                handler.discovery_requested = False
+
+                mqtt_client.deliver(HOME_ASSISTANT_STATUS_TOPIC, HOME_ASSISTANT_BIRTH_PAYLOAD)
+                self.assertTrue(handler.discovery_requested)
+                handler.discovery_requested = False
+
+    async def test_static_tier_read_until_success(self):
+        user_settings = UserSettings()
+        user_settings.heat_pump.port = f'{SIMULATE_PORT_PREFIX}constant'
+        with KronotermMqttHandler(user_settings, verbosity=0, mqtt_client=BenchmarkMqttClient()) as handler:
+            await handler.init_devices()
+            heat_pump_handler = handler.heat_pump_handlers[0]
+            heat_pump_handler.address_tiers[2046] = 'static'
+            heat_pump_handler.plan_address_ranges()
+            heat_pump_handler.next_poll = {}
+
+            failed_read = AsyncMock(side_effect=ModbusIOException('No response'))
+            with (
+                patch.object(heat_pump_handler, 'read_heat_pump_register_blocks', failed_read),
+                self.assertRaises(ModbusIOException),
+            ):
+                await heat_pump_handler.poll()
+            self.assertIn('static', heat_pump_handler.due_poll_tiers())
+
+            await heat_pump_handler.poll()
+            self.assertIn(2046, heat_pump_handler.registers)
+            self.assertEqual(heat_pump_handler.next_poll['static'], math.inf)
+            self.assertNotIn('static', heat_pump_handler.due_poll_tiers())
@@ -0,0 +1,91 @@
+from unittest import TestCase, mock
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
+
+from kronoterm2mqtt.mqtt_outbox import OutboxClient
+
+
+class OutboxClientTestCase(TestCase):
+    def setUp(self):
+        self.client = OutboxClient(mqtt.CallbackAPIVersion.VERSION2, max_inflight=2, max_pending=3)
+        self.is_connected = True
+        self.sent = []  # (mid, topic, payload) handed to paho
+
+        def publish(topic, payload, qos, retain, properties):
+            info = MQTTMessageInfo(len(self.sent) + 1)
+            info.rc = MQTT_ERR_SUCCESS if self.is_connected else mqtt.MQTT_ERR_NO_CONN
+            self.sent.append((info.mid, topic, payload))
+            return info
+
+        patchers = (
+            mock.patch.object(mqtt.Client, 'publish', side_effect=publish),
+            mock.patch.object(OutboxClient, 'is_connected', side_effect=lambda: self.is_connected),
+        )
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def acknowledge(self, mid: int):
+        self.client.message_published(self.client, None, mid, None, None)
+
+    def test_latest_value_wins(self):
+        for topic in ('a', 'b', 'c', 'c', 'c'):
+            self.client.publish(topic=topic, payload=f'{topic}{len(self.sent)}')
+        self.assertEqual(self.sent, [(1, 'a', 'a0'), (2, 'b', 'b1')])
+        self.assertEqual(list(self.client.pending), ['c'])
+        self.assertEqual(self.client.dropped, 2)
+
+        self.acknowledge(1)
+        self.assertEqual(self.sent[2], (3, 'c', 'c2'))  # Only the newest payload
+        self.acknowledge(2)
+        self.acknowledge(3)
+        self.assertEqual((self.client.inflight, self.client.pending), ({}, {}))
+        self.assertEqual(self.client.latency.count, 3)
+        self.assertIn('outbox depth 0 (max 1), 0 in flight, 2 dropped', self.client.get_statistics())
+
+    def test_outage(self):
+        self.client.publish(topic='a', payload='old')
+        self.is_connected = False
+        for number in range(10):
+            self.client.publish(topic=f'topic{number % 5}', payload=str(number))
+            self.client.publish(topic='a', payload=str(number))
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(list(self.client.pending), ['topic3', 'topic4', 'a'])  # The oldest topics are dropped
+
+        # After the reconnect the newest values are sent at once, the message in flight is lost:
+        self.is_connected = True
+        self.client.connected()
+        self.assertEqual(self.sent[1:], [(2, 'topic3', '8'), (3, 'topic4', '9')])
+        self.acknowledge(2)
+        self.assertEqual(self.sent[3], (4, 'a', '9'))
+        self.assertEqual(self.client.max_depth, 3)
+        self.client.reset_statistics()
+        self.assertEqual((self.client.dropped, self.client.max_depth), (0, 0))
+
+    def test_confirmed_before_publish_returned(self):
+        def publish(topic, payload, qos, retain, properties):
+            self.acknowledge(1)  # paho may write and confirm the message right away
+            return MQTTMessageInfo(1)
+
+        with mock.patch.object(mqtt.Client, 'publish', side_effect=publish):
+            self.client.publish(topic='a', payload='1')
+        self.assertEqual((self.client.inflight, self.client.early_published), ({}, set()))
+        self.assertEqual(self.client.latency.count, 1)
+
+    def test_newer_message_during_send(self):
+        self.is_connected = False
+        self.client.publish(topic='a', payload='old')
+        self.is_connected = True
+        send = mqtt.Client.publish.side_effect
+
+        def publish(topic, payload, qos, retain, properties):
+            if payload == 'old':
+                # The event loop thread publishes a newer state, before paho got the flushed one:
+                self.client.publish(topic='a', payload='new')
+            return send(topic, payload, qos, retain, properties)
+
+        with mock.patch.object(mqtt.Client, 'publish', side_effect=publish):
+            self.client.connected()
+        self.assertEqual(self.sent, [(1, 'a', 'old'), (2, 'a', 'new')])  # The newest payload is retained
+        self.assertEqual((self.client.pending, self.client.sending), ({}, set()))
@@ -0,0 +1,60 @@
+import time
+from unittest import TestCase
+
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from kronoterm2mqtt.port_probe import ProbeResult, get_bundled_definitions, get_probe_candidates, probe_ports
+
+
+HEAT_PUMPS = {'/dev/ttyUSB1': 19200, '/dev/ttyUSB2': 9600}  # port -> baud rate of the connected heat pump
+
+
+class FakeSerialClient:
+    """A port with a heat pump answering at one baud rate, all other ports time out"""
+
+    def __init__(self, port: str, *, baudrate: int, timeout: float, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+    def connect(self) -> bool:
+        return self.port != '/dev/ttyUSB3'  # e.g. no permissions
+
+    def close(self):
+        pass
+
+    def read_holding_registers(self, address: int, count: int, device_id: int):
+        if HEAT_PUMPS.get(self.port) != self.baudrate:
+            time.sleep(self.timeout)
+            raise ModbusIOException('No response received')
+        if self.port == '/dev/ttyUSB2':
+            return ExceptionResponse(function_code=3, exception_code=2)  # A device with other registers
+        return ReadHoldingRegistersResponse(registers=[0])
+
+
+class PortProbeTestCase(TestCase):
+    def test_probe_ports(self):
+        candidates = get_probe_candidates(get_bundled_definitions())
+        self.assertEqual([connection['baudrate'] for connection, _ in candidates], [115200, 19200])
+
+        connection = {**candidates[0][0], 'baudrate': 9600}
+        candidates.append((connection, [('other', 2000)]))
+        ports = [f'/dev/ttyUSB{port_number}' for port_number in range(4)]
+        start = time.monotonic()
+        results = probe_ports(ports, candidates, timeout=0.2, client_class=FakeSerialClient)
+        duration = time.monotonic() - start
+        self.assertEqual(
+            results,
+            [
+                ProbeResult('/dev/ttyUSB0', error='no response'),
+                ProbeResult('/dev/ttyUSB1', candidates[1][0], 'kronoterm_wpg'),
+                ProbeResult('/dev/ttyUSB2', connection, error='no definitions match'),
+                ProbeResult('/dev/ttyUSB3', error='can not open port'),
+            ],
+        )
+        self.assertEqual(str(results[1]), "/dev/ttyUSB1: 19200 baud 8N1, definitions_name = 'kronoterm_wpg'")
+
+        # The ports are probed at the same time: One after another would need six timeouts
+        self.assertLess(duration, 0.2 * 4.5)
@@ -0,0 +1,90 @@
+from unittest import TestCase, mock
+
+from ha_services.mqtt4homeassistant.components.sensor import Sensor
+from ha_services.mqtt4homeassistant.device import BaseMqttDevice, MqttDevice
+
+from kronoterm2mqtt.publish_filter import ChangeFilter
+
+
+class ChangeFilterTestCase(TestCase):
+    def tearDown(self):
+        BaseMqttDevice.device_uids = set()
+        BaseMqttDevice.components = {}
+
+    def test_deadband_and_heartbeat(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        client = mock.MagicMock()
+        change_filter = ChangeFilter(heartbeat=60)
+        change_filter.set_deadband(sensor, 0.5)
+
+        def publish(state, now):
+            sensor.set_state(state)
+            with mock.patch('kronoterm2mqtt.publish_filter.time.monotonic', return_value=now):
+                return change_filter.publish(sensor, client)
+
+        self.assertTrue(publish(20.0, now=100))  # first state is always sent
+        self.assertFalse(publish(20.3, now=110))  # inside the deadband
+        self.assertFalse(publish(20.5, now=120))
+        self.assertTrue(publish(20.6, now=130))  # compared to the last published state
+        self.assertTrue(publish(20.6, now=190))  # heartbeat
+        self.assertEqual(str(change_filter), '3 sent, 2 suppressed')
+        state_payloads = [
+            call.kwargs['payload'] for call in client.publish.call_args_list if call.kwargs['topic'].endswith('/state')
+        ]
+        self.assertEqual(state_payloads, [20.0, 20.6, 20.6])
+
+        change_filter.reset_counters()
+        self.assertEqual(str(change_filter), '0 sent, 0 suppressed')
+
+    def test_heartbeat_of_components_not_decoded(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        fast = Sensor(device=device, name='Fast', uid='fast')
+        slow = Sensor(device=device, name='Slow', uid='slow')
+        client = mock.MagicMock()
+        change_filter = ChangeFilter(heartbeat=60)
+
+        def publish_cycle(now, *sensors):
+            with mock.patch('kronoterm2mqtt.publish_filter.time.monotonic', return_value=now):
+                for sensor in sensors:
+                    sensor.set_state(20.0)
+                    change_filter.publish(sensor, client)
+                change_filter.publish_heartbeats(client)
+
+        publish_cycle(100, fast, slow)
+        publish_cycle(130, fast)  # The slow poll tier isn't read in this cycle
+        self.assertEqual(str(change_filter), '2 sent, 1 suppressed')
+        publish_cycle(160, fast)
+        self.assertEqual(str(change_filter), '4 sent, 1 suppressed')  # Heartbeat of both
+        self.assertEqual(change_filter.published[slow.uid], (20.0, 160))
+
+    def test_force(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=0)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        client = mock.MagicMock()
+        change_filter = ChangeFilter(heartbeat=60)
+
+        sensor.set_state(20.0)
+        self.assertTrue(change_filter.publish(sensor, client))
+        self.assertFalse(change_filter.publish(sensor, client))
+        self.assertTrue(change_filter.publish(sensor, client, force=True))
+        self.assertEqual(str(change_filter), '2 sent, 1 suppressed')
+
+    def test_force_inside_throttle_window(self):
+        device = MqttDevice(name='Test', uid='test', throttle_sec=60)
+        sensor = Sensor(device=device, name='Temperature', uid='temperature')
+        client = mock.MagicMock()
+        change_filter = ChangeFilter(heartbeat=60)
+
+        sensor.set_state(20.0)
+        self.assertTrue(change_filter.publish(sensor, client, force=True))
+        sensor.set_state(21.0)
+        self.assertTrue(change_filter.publish(sensor, client, force=True))
+        sensor.set_state(22.0)
+        self.assertFalse(change_filter.publish(sensor, client))  # throttled by the component
+        self.assertEqual(change_filter.published[sensor.uid][0], 21.0)
+        self.assertEqual(str(change_filter), '2 sent, 1 suppressed')
+        state_payloads = [
+            call.kwargs['payload'] for call in client.publish.call_args_list if call.kwargs['topic'].endswith('/state')
+        ]
+        self.assertEqual(state_payloads, [20.0, 21.0])
@@ -0,0 +1,58 @@
+from pathlib import Path
+import tempfile
+from unittest import TestCase
+
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from kronoterm2mqtt.recording import RecordingClient, ReplayModbusClient, iter_frames
+
+
+class CountingClient:
+    """Returns the address plus the number of reads as register values, refuses register 2110"""
+
+    def __init__(self):
+        self.reads = 0
+
+    def read_holding_registers(self, *, address, count, device_id):
+        if address <= 2110 < address + count:
+            return ExceptionResponse(0x03, 0x02)
+        self.reads += 1
+        return ReadHoldingRegistersResponse(registers=[self.reads + address + index for index in range(count)])
+
+    def close(self):
+        pass
+
+
+class RecordingTestCase(TestCase):
+    def test_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / 'test.rec'
+            client = RecordingClient(CountingClient(), file_path)
+            for _ in range(2):
+                client.read_holding_registers(address=2000, count=4, device_id=20)
+                client.read_holding_registers(address=2108, count=4, device_id=20)
+            client.close()
+            frames = list(iter_frames(file_path))
+            replay = ReplayModbusClient(file_path, speed=0)
+
+        def read(address, count):
+            return replay.read_holding_registers(address=address, count=count, device_id=20)
+
+        self.assertEqual(len(frames), 4)
+        self.assertEqual(frames[1].exception_code, 0x02)
+
+        # Every request gets the next recorded frame:
+        self.assertEqual(read(2000, 4).registers, [2001, 2002, 2003, 2004])
+        self.assertEqual(read(2000, 4).registers, [2002, 2003, 2004, 2005])
+
+        # Parts of recorded blocks:
+        self.assertEqual(read(2001, 2).registers, [2002, 2003])
+
+        # Recorded exceptions and unknown registers:
+        self.assertEqual(read(2108, 4).exception_code, 0x02)
+        self.assertEqual(read(3000, 1).exception_code, 0x04)
+
+        # Written values are served by later reads:
+        replay.write_register(address=2001, value=1, device_id=20)
+        self.assertEqual(read(2000, 2).registers, [2001, 1])
@@ -0,0 +1,114 @@
+from pathlib import Path
+import tempfile
+from unittest import TestCase
+
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from kronoterm2mqtt.constants import MODBUS_MAX_READ_REGISTERS
+from kronoterm2mqtt.register_blocks import (
+    BusCost,
+    IllegalRegisters,
+    estimate_bus_time,
+    plan_register_blocks,
+    read_register_block_bisecting,
+)
+from kronoterm2mqtt.user_settings import HeatPump
+
+
+class FakeDevice:
+    """Answers reads with the address as value and refuses the illegal addresses"""
+
+    def __init__(self, illegal: set[int]):
+        self.illegal = illegal
+        self.requests = []
+
+    def read(self, address: int, count: int):
+        self.requests.append((address, count))
+        if self.illegal.intersection(range(address, address + count)):
+            return ExceptionResponse(function_code=3, exception_code=2)
+        return ReadHoldingRegistersResponse(registers=list(range(address, address + count)))
+
+
+class RegisterBlocksTestCase(TestCase):
+    def test_contiguous_addresses(self):
+        cost = BusCost(transaction=0.03, register=0.001)
+        self.assertEqual(plan_register_blocks([3, 1, 2, 2], cost), [(1, 3)])
+        self.assertEqual(plan_register_blocks([], cost), [])
+
+    def test_gap_merging_depends_on_cost(self):
+        addresses = [10, 11, 20, 21]
+        self.assertEqual(
+            plan_register_blocks(addresses, BusCost(transaction=0.03, register=0.001)),
+            [(10, 21)],
+        )
+        self.assertEqual(
+            plan_register_blocks(addresses, BusCost(transaction=0.001, register=0.001)),
+            [(10, 11), (20, 21)],
+        )
+
+    def test_max_count(self):
+        cost = BusCost.for_tcp()
+        blocks = plan_register_blocks(range(2000, 2300), cost)
+        self.assertEqual(blocks, [(2000, 2124), (2125, 2249), (2250, 2299)])
+        for first, last in blocks:
+            self.assertLessEqual(last - first + 1, MODBUS_MAX_READ_REGISTERS)
+
+    def test_bundled_definitions(self):
+        for definitions_name in ('kronoterm_ksm', 'kronoterm_wpg'):
+            with self.subTest(definitions_name):
+                definitions = HeatPump(definitions_name=definitions_name).get_definitions(verbosity=0)
+                addresses = {
+                    parameter['register'] - 1
+                    for kind in ('sensor', 'binary_sensor', 'enum_sensor', 'switch', 'select')
+                    for parameter in definitions.get(kind, ())
+                }
+                cost = BusCost.for_serial(definitions['connection'])
+                blocks = plan_register_blocks(addresses, cost)
+
+                covered = {address for first, last in blocks for address in range(first, last + 1)}
+                self.assertTrue(addresses <= covered)
+
+                contiguous = plan_register_blocks(addresses, BusCost(transaction=1e-6, register=1.0))
+                self.assertLessEqual(len(blocks), len(contiguous))
+                self.assertLessEqual(estimate_bus_time(blocks, cost), estimate_bus_time(contiguous, cost))
+
+    def test_excluded_addresses(self):
+        cost = BusCost(transaction=0.03, register=0.001)
+        self.assertEqual(plan_register_blocks([1, 2, 3, 4], cost, excluded=[3]), [(1, 2), (4, 4)])
+        self.assertEqual(plan_register_blocks([1, 2, 5, 6], cost, excluded=[3]), [(1, 2), (5, 6)])
+        self.assertEqual(plan_register_blocks([1, 2, 5, 6], cost, excluded=[7]), [(1, 6)])
+
+
+class BisectingReadTestCase(TestCase):
+    def test_readable_block(self):
+        device = FakeDevice(illegal=set())
+        blocks, illegal = read_register_block_bisecting(device.read, 10, 13)
+        self.assertEqual(blocks, [(10, [10, 11, 12, 13])])
+        self.assertEqual(illegal, [])
+        self.assertEqual(device.requests, [(10, 4)])
+
+    def test_bisect_illegal_addresses(self):
+        device = FakeDevice(illegal={13, 17})
+        blocks, illegal = read_register_block_bisecting(device.read, 10, 19)
+        self.assertEqual(sorted(illegal), [13, 17])
+        values = {address + i: value for address, registers in blocks for i, value in enumerate(registers)}
+        self.assertEqual(sorted(values), [10, 11, 12, 14, 15, 16, 18, 19])
+        self.assertTrue(all(address == value for address, value in values.items()))
+
+        # The next plan avoids the learned addresses:
+        device.requests.clear()
+        for first, last in plan_register_blocks(values, BusCost.for_tcp(), excluded=illegal):
+            read_register_block_bisecting(device.read, first, last)
+        self.assertEqual(device.requests, [(10, 3), (14, 3), (18, 2)])
+
+    def test_persist_illegal_registers(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / 'illegal_registers.json'
+            illegal_registers = IllegalRegisters(file_path)
+            self.assertEqual(list(illegal_registers), [])
+            illegal_registers.add([2017, 2003])
+
+            illegal_registers = IllegalRegisters(file_path)
+            self.assertEqual(list(illegal_registers), [2003, 2017])
+            self.assertIn(2003, illegal_registers)
@@ -0,0 +1,62 @@
+from pathlib import Path
+import tempfile
+from unittest import TestCase
+
+from pymodbus.pdu import ExceptionResponse
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from kronoterm2mqtt.register_scanner import RegisterScan
+
+
+class FakeDevice:
+    """Answers reads with the address as value, refuses the illegal addresses and can time out once"""
+
+    def __init__(self, illegal: set[int], timeout_address: int | None = None):
+        self.illegal = illegal
+        self.timeout_address = timeout_address
+        self.requests = []
+
+    def read(self, address: int, count: int):
+        self.requests.append((address, count))
+        if address == self.timeout_address:
+            self.timeout_address = None
+            return ExceptionResponse(function_code=3, exception_code=0x0B)  # Gateway target failed to respond
+        if self.illegal.intersection(range(address, address + count)):
+            return ExceptionResponse(function_code=3, exception_code=2)
+        return ReadHoldingRegistersResponse(registers=list(range(address, address + count)))
+
+
+class RegisterScanTestCase(TestCase):
+    def test_scan(self):
+        device = FakeDevice(illegal={2110, 2500, 2501})
+        scan = RegisterScan()
+        scan.scan(device.read, 2000, 3030)
+        self.assertEqual(scan.illegal, {2110, 2500, 2501})
+        self.assertEqual(len(scan.values), 1031 - 3)
+        self.assertEqual(scan.values[2111], 2111)
+        # 9 blocks of max. 125 registers, two of them are bisected:
+        self.assertEqual(scan.requests, len(device.requests))
+        self.assertLess(scan.requests, 40)
+
+    def check_save_and_resume(self, file_path: Path):
+        def save(scan):
+            scan.save(file_path)
+
+        device = FakeDevice(illegal={2010}, timeout_address=2125)
+        scan = RegisterScan()
+        scan.scan(device.read, 2000, 2300, on_block=save)
+        self.assertEqual(scan.get_unknown_blocks(2000, 2300), [(2125, 2249)])
+
+        # Only the block that timed out is read again:
+        device.requests.clear()
+        scan = RegisterScan.load(file_path)
+        self.assertEqual(scan.illegal, {2010})
+        scan.scan(device.read, 2000, 2300, on_block=save)
+        self.assertEqual(device.requests, [(2125, 125)])
+        self.assertEqual(scan.get_unknown_blocks(2000, 2300), [])
+        self.assertEqual(RegisterScan.load(file_path), scan)
+
+    def test_save_and_resume(self):
+        for suffix in ('.csv', '.json'):
+            with self.subTest(suffix), tempfile.TemporaryDirectory() as temp_dir:
+                self.check_save_and_resume(Path(temp_dir) / f'scan{suffix}')
@@ -0,0 +1,83 @@
+import asyncio
+from unittest import TestCase
+
+from pymodbus.constants import ExcCodes
+
+from kronoterm2mqtt.simulator import HeatPumpSimulator, SimulatedModbusClient
+from kronoterm2mqtt.user_settings import HeatPump
+
+
+class HeatPumpSimulatorTestCase(TestCase):
+    def setUp(self):
+        self.definitions = HeatPump(definitions_name='kronoterm_ksm').get_definitions(verbosity=0)
+
+    def request(self, simulator, function_code, address, count, set_values=None):
+        device = simulator.get_device(slave_id=20)
+        registers = list(device.simdata.values)
+        result = asyncio.run(
+            simulator.action(function_code, simulator.first_address, address, count, registers, set_values)
+        )
+        return result, registers[address - simulator.first_address : address - simulator.first_address + count]
+
+    def test_registers_of_definitions(self):
+        simulator = HeatPumpSimulator(self.definitions, generator='constant', seed=1)
+        sensor = self.definitions['sensor'][0]
+        self.assertIn(sensor['register'] - 1, simulator.values)
+        self.assertIn(sensor['register'] - 1, simulator.generators)
+        switch = self.definitions['switch'][0]
+        self.assertIn(switch['register'] - 1, simulator.writable)
+
+        result, registers = self.request(simulator, 0x03, simulator.first_address, 10)
+        self.assertIsNone(result)
+        addresses = range(simulator.first_address, simulator.first_address + 10)
+        self.assertEqual(registers, [simulator.values.get(address, 0) for address in addresses])
+
+    def test_registers_above_0x8000(self):
+        address = self.definitions['sensor'][0]['register'] - 1
+        simulator = HeatPumpSimulator(self.definitions, generator='constant', seed=1)
+        simulator.add(address, -50, simulator.generators[address])  # e.g. a negative temperature
+        simulator.add(address + 1, 0xFFFF)
+        self.assertEqual(self.request(simulator, 0x03, address, 2), (None, [0xFFCE, 0xFFFF]))
+
+        client = SimulatedModbusClient(simulator)
+        response = client.read_holding_registers(address=address, count=2, device_id=20)
+        self.assertEqual(response.registers, [0xFFCE, 0xFFFF])
+
+    def test_generators(self):
+        address = self.definitions['sensor'][0]['register'] - 1
+        simulator = HeatPumpSimulator(self.definitions, generator='random-walk', seed=1)
+        generator = simulator.generators[address]
+        for _ in range(20):
+            result, (value,) = self.request(simulator, 0x03, address, 1)
+            self.assertIsNone(result)
+            self.assertTrue(generator.low <= value <= generator.high)
+
+    def test_exceptions(self):
+        switch_address = self.definitions['switch'][0]['register'] - 1
+        sensor_address = self.definitions['sensor'][0]['register'] - 1
+        simulator = HeatPumpSimulator(self.definitions, illegal_registers=[2109], seed=1)
+        self.assertEqual(self.request(simulator, 0x03, 2100, 20)[0], ExcCodes.ILLEGAL_ADDRESS)
+        self.assertIsNone(self.request(simulator, 0x06, switch_address, 1, set_values=[1])[0])
+        self.assertEqual(self.request(simulator, 0x06, sensor_address, 1, set_values=[1])[0], ExcCodes.ILLEGAL_ADDRESS)
+
+        simulator = HeatPumpSimulator(self.definitions, exception_rate=1.0, seed=1)
+        self.assertEqual(self.request(simulator, 0x03, sensor_address, 1)[0], ExcCodes.DEVICE_BUSY)
+        self.assertEqual(simulator.injected_exceptions, 1)
+
+    def test_transfer_time(self):
+        simulator = HeatPumpSimulator(self.definitions, baudrate=19200)  # 8N1: 10 bits per char
+        self.assertAlmostEqual(simulator.get_transfer_time(0x03, count=10), (8 + 5 + 20 + 7) * 10 / 19200)
+        self.assertEqual(HeatPumpSimulator(self.definitions).get_transfer_time(0x03, count=10), 0)
+
+    def test_simulated_client(self):
+        switch_address = self.definitions['switch'][0]['register'] - 1
+        client = SimulatedModbusClient(HeatPumpSimulator(self.definitions, illegal_registers=[2109], seed=1))
+        response = client.read_holding_registers(address=2000, count=10, device_id=20)
+        self.assertEqual(len(response.registers), 10)
+        self.assertEqual(client.read_holding_registers(address=2100, count=20, device_id=20).exception_code, 2)
+        self.assertEqual(client.read_holding_registers(address=100, count=1, device_id=20).exception_code, 2)
+
+        self.assertFalse(client.write_register(address=switch_address, value=1, device_id=20).isError())
+        response = client.read_holding_registers(address=switch_address, count=1, device_id=20)
+        self.assertEqual(response.registers, [1])
+        self.assertTrue(client.write_register(address=2000, value=1, device_id=20).isError())
@@ -0,0 +1,163 @@
+import asyncio
+from pathlib import Path
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from pymodbus.pdu.register_message import ReadHoldingRegistersResponse
+
+from kronoterm2mqtt.modbus_bus import ModbusBus
+from kronoterm2mqtt.recording import RecordingClient, iter_frames
+from kronoterm2mqtt.register_blocks import BusCost
+from kronoterm2mqtt.supervisor import Supervisor
+
+
+class UnpluggedClient:
+    """A serial client whose USB adapter is unplugged until `plugged` is set"""
+
+    def __init__(self):
+        self.plugged = True
+        self.connected = True
+        self.connects = 0
+
+    def read_holding_registers(self, *, address, count, device_id):
+        if not self.connected:
+            raise ConnectionException('Failed to connect')
+        if not self.plugged:
+            self.connected = False
+            raise ConnectionException('Device disconnected')
+        return ReadHoldingRegistersResponse(registers=[1] * count)
+
+    def write_register(self, *, address, value, device_id):
+        raise NotImplementedError
+
+    def connect(self):
+        self.connects += 1
+        self.connected = self.plugged
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+
+class SlavesClient(UnpluggedClient):
+    """Slaves on one bus, the unresponsive ones time out"""
+
+    def __init__(self):
+        super().__init__()
+        self.unresponsive = set()
+
+    def read_holding_registers(self, *, address, count, device_id):
+        if device_id in self.unresponsive:
+            raise ModbusIOException('No response received after 3 retries')
+        return super().read_holding_registers(address=address, count=count, device_id=device_id)
+
+
+class SupervisorTestCase(IsolatedAsyncioTestCase):
+    async def test_restart_with_backoff(self):
+        attempts = []
+
+        async def restart():
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) < 3:
+                raise OSError('still unplugged')
+
+        async def work():
+            raise OSError('unplugged')
+
+        supervisor = Supervisor('test', restart=restart, errors=(OSError,), min_delay=0.01, max_delay=0.02)
+        self.assertIs(await supervisor.run(work), False)
+        self.assertTrue(supervisor.is_down)
+        self.assertIs(await supervisor.run(work), False)  # Skipped while down
+
+        await supervisor.restart_task
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.02)  # The delay is doubled up to max_delay
+        self.assertEqual((supervisor.is_down, supervisor.restarts, supervisor.down_time.count), (False, 1, 1))
+        self.assertIs(await supervisor.run(asyncio.sleep, 0), True)
+
+        with self.assertRaises(ValueError):  # Not a failure of the subsystem
+            await supervisor.run(int, 'x')
+
+    async def test_modbus_link(self):
+        client = UnpluggedClient()
+        bus = ModbusBus('/dev/ttyUSB0', client, BusCost.for_tcp())
+        bus.supervisor.min_delay = 0.01
+        try:
+
+            async def read():
+                return await bus.run(client.read_holding_registers, address=2000, count=1, device_id=20)
+
+            self.assertIs(await bus.supervisor.run(read), True)
+            client.plugged = False
+            self.assertIs(await bus.supervisor.run(read), False)
+            await asyncio.sleep(0.05)
+            self.assertTrue(bus.supervisor.is_down)  # Reconnecting fails while unplugged
+
+            client.plugged = True
+            await bus.supervisor.restart_task
+            self.assertIs(await bus.supervisor.run(read), True)
+            self.assertGreater(client.connects, 1)
+        finally:
+            bus.close()
+
+    async def test_modbus_link_while_recording(self):
+        client = UnpluggedClient()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / 'test.rec'
+            bus = ModbusBus('/dev/ttyUSB0', RecordingClient(client, file_path), BusCost.for_tcp())
+            bus.supervisor.min_delay = 0.01
+            try:
+
+                async def read():
+                    return await bus.run(bus.client.read_holding_registers, address=2000, count=1, device_id=20)
+
+                self.assertIs(await bus.supervisor.run(read), True)
+                client.plugged = False
+                self.assertIs(await bus.supervisor.run(read), False)
+                client.plugged = True
+                await bus.supervisor.restart_task
+                self.assertIs(await bus.supervisor.run(read), True)  # Recorded to the reopened file
+            finally:
+                bus.close()
+            self.assertEqual(len(list(iter_frames(file_path))), 2)
+
+    async def test_unresponsive_slave(self):
+        client = SlavesClient()
+        bus = ModbusBus('/dev/ttyUSB0', client, BusCost.for_tcp())
+        bus.supervisor.min_delay = 0.01
+        for slave_id in (20, 21):
+            bus.get_slave_supervisor(slave_id).min_delay = 0.01
+        try:
+
+            async def read(slave_id):
+                return await bus.run(client.read_holding_registers, address=2000, count=1, device_id=slave_id)
+
+            async def poll(slave_id):
+                return await bus.run_slave(slave_id, read, slave_id)
+
+            self.assertIs(await poll(20), True)
+            client.unresponsive = {21}
+            self.assertIs(await poll(21), False)
+            self.assertIs(await poll(21), False)  # Skipped while down
+            self.assertIs(await poll(20), True)  # The other slave goes on, the bus is not reopened
+            self.assertFalse(bus.supervisor.is_down)
+            self.assertEqual(client.connects, 0)
+
+            await asyncio.sleep(0.05)
+            self.assertTrue(bus.get_slave_supervisor(21).is_down)  # The probes time out, too
+            client.unresponsive = set()
+            await bus.get_slave_supervisor(21).restart_task
+            self.assertIs(await poll(21), True)
+
+            # No slave responds: Maybe the connection itself
+            client.unresponsive = {20, 21}
+            self.assertIs(await poll(20), False)
+            self.assertFalse(bus.supervisor.is_down)
+            self.assertIs(await poll(21), False)
+            self.assertTrue(bus.supervisor.is_down)
+            client.unresponsive = set()
+            await bus.supervisor.restart_task
+            self.assertEqual(client.connects, 1)
+        finally:
+            bus.close()
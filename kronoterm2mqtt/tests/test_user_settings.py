@@ -15,3 +15,23 @@ class UserSettingsTestCase(TestCase):
         self.assertEqual(systemd_settings.service_slug, 'kronoterm2mqtt')
         self.assertEqual(systemd_settings.template_context.syslog_identifier, 'kronoterm2mqtt')
         self.assertEqual(systemd_settings.service_file_path, Path('/etc/systemd/system/kronoterm2mqtt.service'))
+
+    def test_get_heat_pumps(self):
+        user_settings = UserSettings()
+        self.assertEqual(user_settings.get_heat_pumps(), [user_settings.heat_pump])
+
+        user_settings.heat_pump.port = '192.168.1.10'
+        user_settings.additional_heat_pumps = [
+            {'device_name': 'Second Heat Pump', 'port': '192.168.1.10', 'slave_id': 21},
+            {'device_name': 'Third Heat Pump', 'device_uid': 'garage', 'port': '/dev/ttyUSB2'},
+        ]
+        main, second, third = user_settings.get_heat_pumps()
+        self.assertIs(main, user_settings.heat_pump)
+        self.assertEqual((main.device_uid, main.slave_id), ('', 20))
+        self.assertEqual((second.device_uid, second.port, second.slave_id), ('kronoterm_2', '192.168.1.10', 21))
+        self.assertEqual((third.device_uid, third.port, third.slave_id), ('garage', '/dev/ttyUSB2', 20))
+        self.assertEqual(third.pooling_interval, 10)
+
+        user_settings.additional_heat_pumps = [{'device_uid': 'kronoterm'}]
+        with self.assertRaises(ValueError):
+            user_settings.get_heat_pumps()
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import math
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunningStats:
+    """
+    Count, mean and extremes of measured durations in seconds.
+
+    >>> stats = RunningStats()
+    >>> for value in (0.001, 0.003, 0.002):
+    ...     stats.add(value)
+    >>> stats.count, round(stats.mean, 6), stats.maximum
+    (3, 0.002, 0.003)
+    >>> str(stats)
+    'mean 2.0 ms, max 3.0 ms (3 samples)'
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return f'mean {self.mean * 1000:.1f} ms, max {self.maximum * 1000:.1f} ms ({self.count} samples)'
+
+
+async def measure_event_loop_lag(stats: RunningStats, interval: float = 0.1):
+    """
+    Measure how late the event loop wakes up a sleeping task. Any blocking
+    call in a coroutine (e.g. synchronous serial I/O) shows up as lag.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stats.add(max(loop.time() - start - interval, 0.0))
+
+
+class FixedRateScheduler:
+    """
+    Run cycles at a fixed rate on monotonic deadlines, so that the duration
+    of a cycle does not add up to the period. If a cycle overruns the next
+    deadline, the missed cycles are either run back to back ("catch_up") or
+    skipped, continuing with the next deadline in the future.
+
+    >>> scheduler = FixedRateScheduler(interval=10, catch_up=False, start=100)
+    >>> scheduler.next_deadline(now=101)  # Cycle took 1 second
+    110
+    >>> scheduler.next_deadline(now=135)  # Overrun: 120 and 130 are skipped
+    140
+    >>> scheduler.overruns, scheduler.skipped
+    (1, 2)
+    >>> scheduler = FixedRateScheduler(interval=10, catch_up=True, start=100)
+    >>> scheduler.next_deadline(now=125), scheduler.next_deadline(now=125), scheduler.next_deadline(now=125)
+    (110, 120, 130)
+    """
+
+    def __init__(self, interval: float, catch_up: bool, start: float | None = None):
+        self.interval = interval
+        self.catch_up = catch_up
+        self.deadline = time.monotonic() if start is None else start
+        self.jitter = RunningStats()  # How late the cycles start after their deadline
+        self.overruns = 0
+        self.skipped = 0
+
+    def next_deadline(self, now: float) -> float:
+        self.deadline += self.interval
+        if now > self.deadline:
+            self.overruns += 1
+            if not self.catch_up and self.interval > 0:
+                missed = math.ceil((now - self.deadline) / self.interval)
+                self.skipped += missed
+                self.deadline += missed * self.interval
+        return self.deadline
+
+    async def wait(self) -> None:
+        """Sleep until the deadline of the next cycle"""
+        deadline = self.next_deadline(now=time.monotonic())
+        await asyncio.sleep(max(deadline - time.monotonic(), 0))
+        self.jitter.add(max(time.monotonic() - deadline, 0.0))
+
+    def __str__(self):
+        return f'jitter {self.jitter}, {self.overruns} overruns, {self.skipped} skipped'
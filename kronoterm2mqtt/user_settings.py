@@ -1,5 +1,6 @@
 import dataclasses
 import logging
+from pathlib import Path
 import sys
 
 from bx_py_utils.path import assert_is_file
@@ -9,7 +10,7 @@ from ha_services.mqtt4homeassistant.data_classes import MqttSettings
 from rich import print  # noqa
 from rich.pretty import pprint
 
-from kronoterm2mqtt.constants import BASE_PATH
+from kronoterm2mqtt.constants import BASE_PATH, MODBUS_SLAVE_ID
 
 
 try:
@@ -46,10 +47,20 @@ class HeatPump:
 
     definitions_name: str = 'kronoterm_ksm'
     device_name: str = 'Heat Pump'  # Appearing in MQTT as Device
+    device_uid: str = ''  # MQTT device uid, empty: Use "main_uid" of the MQTT settings
     model: str = 'ETERA'  # Just for MQTT device Model info
     port: str = '/dev/ttyUSB0'
+    slave_id: int = MODBUS_SLAVE_ID
+    record_file: str = ''  # Append all Modbus responses to this file, replay it with port = "replay:<file>"
+    replay_speed: float = 1.0  # Speed of a "replay:" port, 0: as fast as possible
     timeout: float = 0.5
     pooling_interval: int = 10  # Sensor update in seconds
+    catch_up_missed_cycles: bool = False  # Run cycles missed by a slow cycle at once, instead of skipping them
+    normal_pooling_interval: int = 60  # Update of registers with poll = "normal" in seconds
+    slow_pooling_interval: int = 600  # Update of registers with poll = "slow" in seconds
+    publish_heartbeat: int = 300  # Publish unchanged states at least every n seconds
+    json_state: bool = False  # Publish all states of a cycle as one JSON message on a single topic
+    device_discovery: bool = False  # One discovery config message for the device instead of one per entity
 
     def get_definitions(self, verbosity) -> dict:
         definition_file_path = BASE_PATH / 'definitions' / f'{self.definitions_name}.toml'
@@ -62,6 +73,20 @@ class HeatPump:
 
         return definitions
 
+    def get_poll_intervals(self) -> dict[str, int | None]:
+        """Seconds between reads of each poll tier, "static" registers are read only once"""
+        return {
+            'fast': self.pooling_interval,
+            'normal': self.normal_pooling_interval,
+            'slow': self.slow_pooling_interval,
+            'static': None,
+        }
+
+    def get_illegal_registers_path(self) -> Path:
+        """JSON file with learned register addresses that the heat pump refuses to read"""
+        name = f'{self.device_uid}_{self.definitions_name}' if self.device_uid else self.definitions_name
+        return get_toml_settings().file_path.parent / f'{name}_illegal_registers.json'
+
 
 @dataclasses.dataclass
 class CustomEteraExpander:
@@ -173,17 +198,41 @@ class UserSettings:
     # TLS settings for MQTT connection:
     mqtt_tls: dataclasses = dataclasses.field(default_factory=MqttTlsSettings)
 
+    # Run the MQTT client in the event loop of the publish loop, instead of in its own network thread:
+    mqtt_asyncio: bool = False
+
     systemd: dataclasses = dataclasses.field(default_factory=SystemdServiceInfo)
 
     heat_pump: dataclasses = dataclasses.field(default_factory=HeatPump)
 
     custom_expander: dataclasses = dataclasses.field(default_factory=CustomEteraExpander)
 
+    # More heat pumps as [[additional_heat_pumps]] tables with the fields of [heat_pump]:
+    additional_heat_pumps: list = dataclasses.field(default_factory=list)
+
     def __post_init__(self):
         """Modify the MQTT defaults"""
         self.mqtt.main_uid = 'kronoterm'
         self.mqtt.host = 'mqtt.your-server.tld'
 
+    def get_heat_pumps(self) -> list[HeatPump]:
+        """
+        The [heat_pump] and all [[additional_heat_pumps]]. Missing values of
+        additional heat pumps are the defaults, not the values of [heat_pump].
+        """
+        heat_pumps = [self.heat_pump]
+        for number, table in enumerate(self.additional_heat_pumps, start=2):
+            values = table.unwrap() if hasattr(table, 'unwrap') else dict(table)  # tomlkit table or plain dict
+            heat_pump = HeatPump(**values)
+            if not heat_pump.device_uid:
+                heat_pump.device_uid = f'{self.mqtt.main_uid}_{number}'
+            heat_pumps.append(heat_pump)
+
+        device_uids = [heat_pump.device_uid or self.mqtt.main_uid for heat_pump in heat_pumps]
+        if len(set(device_uids)) != len(device_uids):
+            raise ValueError(f'Heat pumps must have unique "device_uid" values, got: {device_uids}')
+        return heat_pumps
+
 
 def get_toml_settings() -> TomlSettings:
     return TomlSettings(